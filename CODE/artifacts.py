@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import LabelEncoder
+from sklearn.feature_extraction.text import TfidfVectorizer
+from models import CollaborativeFilteringModel, ContentBasedModel, NeuMFModel
+from embedding_index import EmbeddingIndex
+
+# Bump when the on-disk layout changes; older bundles are rejected on load
+ARTIFACT_VERSION = 3
+
+DEFAULT_ARTIFACT_DIR = os.path.join(os.path.dirname(__file__), '..', 'ARTIFACTS')
+# Tuned ensemble weights of a bundle (see cross_validation.py)
+HYBRID_WEIGHTS_FILE = 'hybrid_weights.json'
+
+class ModelBundle:
+    """Everything needed to serve recommendations, restored from an artifact directory."""
+
+    def __init__(self, cf_model, cbf_model, neumf_model, user_encoder, movie_encoder, movies, manifest, item_index=None,
+                 hybrid_weights=None):
+        self.cf_model = cf_model
+        self.cbf_model = cbf_model
+        self.neumf_model = neumf_model
+        # Inner-product index over NeuMF item embeddings for candidate retrieval
+        self.item_index = item_index
+        self.user_encoder = user_encoder
+        self.movie_encoder = movie_encoder
+        self.movies = movies
+        self.manifest = manifest
+        # Tuning summary with the bundle's hybrid 'weights', or None if untuned
+        self.hybrid_weights = hybrid_weights
+        # Movie id -> title for rendering results
+        titles = pd.Series(movies['title'].values, index=movies['id'].values)
+        self.titles = titles[~titles.index.duplicated()]
+
+# --- Helpers ---
+def _save_array(directory, name, array):
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+def _load_array(directory, name, mmap=True):
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+
+def _save_csr(directory, name, matrix):
+    _save_array(directory, f"{name}_data", matrix.data)
+    _save_array(directory, f"{name}_indices", matrix.indices)
+    _save_array(directory, f"{name}_indptr", matrix.indptr)
+    return list(matrix.shape)
+
+def _load_csr(directory, name, shape):
+    data = _load_array(directory, f"{name}_data")
+    indices = _load_array(directory, f"{name}_indices")
+    indptr = _load_array(directory, f"{name}_indptr")
+    return csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+
+def _save_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def resolve_artifact_dir(artifact_root=DEFAULT_ARTIFACT_DIR):
+    """Path of the most recent bundle under ``artifact_root``, or None."""
+    latest = os.path.join(artifact_root, 'LATEST')
+    if not os.path.exists(latest):
+        return None
+    with open(latest) as f:
+        path = os.path.join(artifact_root, f.read().strip())
+    return path if os.path.isdir(path) else None
+
+# --- Component writers ---
+def save_encoders(directory, user_encoder, movie_encoder):
+    os.makedirs(directory, exist_ok=True)
+    _save_array(directory, 'user_classes', user_encoder.classes_)
+    _save_array(directory, 'movie_classes', movie_encoder.classes_)
+    return {'num_users': len(user_encoder.classes_), 'num_movies': len(movie_encoder.classes_)}
+
+def save_catalog(directory, movies):
+    os.makedirs(directory, exist_ok=True)
+    _save_array(directory, 'movie_ids', movies['id'].values.astype(np.int32))
+    _save_json(os.path.join(directory, 'titles.json'), movies['title'].astype(str).tolist())
+    return {'num_catalog_movies': len(movies)}
+
+def save_cf(directory, cf_model):
+    os.makedirs(directory, exist_ok=True)
+    cf_model.precompute_neighbors()
+    shape = _save_csr(directory, 'user_item', cf_model.user_item_matrix)
+    _save_array(directory, 'user_ids', cf_model.user_index.values)
+    _save_array(directory, 'movie_ids', cf_model.movie_index.values)
+    _save_array(directory, 'user_means', cf_model.user_means)
+    _save_array(directory, 'neighbors', cf_model.neighbors)
+    _save_array(directory, 'neighbor_sims', cf_model.neighbor_sims)
+    return {'k': cf_model.k, 'shape': shape, 'global_mean': cf_model.global_mean}
+
+def save_cbf(directory, cbf_model):
+    os.makedirs(directory, exist_ok=True)
+    vocabulary = {term: int(i) for term, i in cbf_model.tfidf.vocabulary_.items()}
+    _save_json(os.path.join(directory, 'vocabulary.json'), vocabulary)
+    _save_array(directory, 'idf', cbf_model.tfidf.idf_)
+    shape = _save_csr(directory, 'tfidf', cbf_model.tfidf_matrix)
+    _save_array(directory, 'neighbor_indices', cbf_model.neighbor_indices)
+    _save_array(directory, 'neighbor_scores', cbf_model.neighbor_scores)
+    profile_shape = _save_csr(directory, 'user_ratings', cbf_model.user_ratings)
+    _save_array(directory, 'user_ids', cbf_model.user_index.values)
+    _save_array(directory, 'user_means', cbf_model.user_means)
+    return {
+        'k': cbf_model.k,
+        'chunk_size': cbf_model.chunk_size,
+        'shape': shape,
+        'profile_shape': profile_shape,
+        'global_mean': cbf_model.global_mean,
+    }
+
+def save_neumf(directory, neumf_model):
+    os.makedirs(directory, exist_ok=True)
+    neumf_model.save_weights(os.path.join(directory, 'neumf.weights.h5'))
+    EmbeddingIndex.from_model(neumf_model).build_ivf().save(os.path.join(directory, 'item_index'))
+    return {
+        'num_users': neumf_model.user_embedding.input_dim,
+        'num_items': neumf_model.item_embedding.input_dim,
+        'embedding_size': neumf_model.user_embedding.output_dim,
+        'objective': neumf_model.objective,
+    }
+
+def begin_bundle(artifact_root=DEFAULT_ARTIFACT_DIR):
+    """New bundle version and the temporary directory its components are written to."""
+    version = base = time.strftime('%Y%m%d-%H%M%S')
+    # Bundles saved within the same second (e.g. a compaction right after
+    # training) get a numbered suffix
+    suffix = 1
+    while os.path.exists(os.path.join(artifact_root, version)):
+        version = f"{base}-{suffix}"
+        suffix += 1
+    tmp_dir = os.path.join(artifact_root, version) + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    return version, tmp_dir
+
+def publish_bundle(artifact_root, version, tmp_dir, manifest):
+    """
+    Write the manifest, rename the temporary directory into place and
+    point LATEST at it, so readers never see a half-written bundle.
+    """
+    final_dir = os.path.join(artifact_root, version)
+    _save_json(os.path.join(tmp_dir, 'manifest.json'), manifest)
+    os.replace(tmp_dir, final_dir)
+
+    with open(os.path.join(artifact_root, 'LATEST.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(artifact_root, 'LATEST.tmp'), os.path.join(artifact_root, 'LATEST'))
+    print(f"Artifacts saved to {final_dir}")
+    return final_dir
+
+def save_artifacts(cf_model, cbf_model, neumf_model, user_encoder, movie_encoder, movies,
+                   artifact_root=DEFAULT_ARTIFACT_DIR, extra_manifest=None, hybrid_weights=None):
+    """
+    Write a new versioned bundle under ``artifact_root`` and point LATEST at
+    it. ``extra_manifest`` entries (e.g. online update state) are added to
+    the manifest; ``hybrid_weights`` (a tuning summary) is kept with the
+    bundle.
+    """
+    version, tmp_dir = begin_bundle(artifact_root)
+    manifest = {
+        'format_version': ARTIFACT_VERSION,
+        'created_at': version,
+        'encoders': save_encoders(os.path.join(tmp_dir, 'encoders'), user_encoder, movie_encoder),
+        'catalog': save_catalog(os.path.join(tmp_dir, 'catalog'), movies),
+        'cf': save_cf(os.path.join(tmp_dir, 'cf'), cf_model),
+        'cbf': save_cbf(os.path.join(tmp_dir, 'cbf'), cbf_model),
+        'neumf': save_neumf(os.path.join(tmp_dir, 'neumf'), neumf_model),
+    }
+    manifest.update(extra_manifest or {})
+    if hybrid_weights is not None:
+        _save_json(os.path.join(tmp_dir, HYBRID_WEIGHTS_FILE), hybrid_weights)
+    return publish_bundle(artifact_root, version, tmp_dir, manifest)
+
+def save_hybrid_weights(summary, artifact_root=DEFAULT_ARTIFACT_DIR, version=None):
+    """
+    Write a hybrid weight tuning summary into a bundle (the latest unless
+    ``version`` is given), so the weights only apply to the models they
+    were tuned for. Returns the file's path.
+    """
+    bundle_dir = os.path.join(artifact_root, version) if version else resolve_artifact_dir(artifact_root)
+    if bundle_dir is None or not os.path.isdir(bundle_dir):
+        raise FileNotFoundError(f"No bundle {version or 'LATEST'} under {artifact_root}, train the models first")
+    path = os.path.join(bundle_dir, HYBRID_WEIGHTS_FILE)
+    _save_json(path + '.tmp', summary)
+    os.replace(path + '.tmp', path)
+    return path
+
+# --- Component loaders ---
+def load_encoders(directory):
+    user_encoder = LabelEncoder()
+    user_encoder.classes_ = _load_array(directory, 'user_classes')
+    movie_encoder = LabelEncoder()
+    movie_encoder.classes_ = _load_array(directory, 'movie_classes')
+    return user_encoder, movie_encoder
+
+def load_catalog(directory):
+    return pd.DataFrame({
+        'id': _load_array(directory, 'movie_ids', mmap=False),
+        'title': _load_json(os.path.join(directory, 'titles.json')),
+    })
+
+def load_cf(directory, meta):
+    cf_model = CollaborativeFilteringModel(k=meta['k'])
+    cf_model.user_item_matrix = _load_csr(directory, 'user_item', meta['shape'])
+    cf_model.user_index = pd.Index(_load_array(directory, 'user_ids'))
+    cf_model.movie_index = pd.Index(_load_array(directory, 'movie_ids'))
+    cf_model.user_means = _load_array(directory, 'user_means')
+    cf_model.global_mean = meta['global_mean']
+    cf_model.neighbors = _load_array(directory, 'neighbors')
+    cf_model.neighbor_sims = _load_array(directory, 'neighbor_sims')
+    cf_model.has_neighbors = np.ones(cf_model.user_item_matrix.shape[0], dtype=bool)
+    # Brute-force fit only keeps a reference to the matrix
+    cf_model.model.fit(cf_model.user_item_matrix)
+    return cf_model
+
+def load_cbf(directory, meta, movies):
+    cbf_model = ContentBasedModel(k=meta['k'], chunk_size=meta['chunk_size'])
+    vocabulary = _load_json(os.path.join(directory, 'vocabulary.json'))
+    cbf_model.tfidf = TfidfVectorizer(stop_words='english', vocabulary=vocabulary, dtype=np.float32)
+    cbf_model.tfidf.idf_ = _load_array(directory, 'idf', mmap=False)
+    cbf_model.tfidf_matrix = _load_csr(directory, 'tfidf', meta['shape'])
+    cbf_model.neighbor_indices = _load_array(directory, 'neighbor_indices')
+    cbf_model.neighbor_scores = _load_array(directory, 'neighbor_scores')
+    cbf_model.index_movies(movies)
+    cbf_model.user_ratings = _load_csr(directory, 'user_ratings', meta['profile_shape'])
+    cbf_model.user_index = pd.Index(_load_array(directory, 'user_ids'))
+    cbf_model.user_means = _load_array(directory, 'user_means')
+    cbf_model.global_mean = meta['global_mean']
+    return cbf_model
+
+def load_neumf(directory, meta):
+    neumf_model = NeuMFModel(meta['num_users'], meta['num_items'], embedding_size=meta['embedding_size'])
+    # Build the variables with a dummy batch before restoring weights
+    neumf_model([np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int32)])
+    neumf_model.load_weights(os.path.join(directory, 'neumf.weights.h5'))
+    neumf_model.objective = meta.get('objective', 'rating')
+    return neumf_model
+
+def load_bundle_neumf(bundle, artifact_root=DEFAULT_ARTIFACT_DIR):
+    """
+    Load the NeuMF model and item index into a bundle restored with
+    load_neumf_model=False (e.g. before forking workers, as TensorFlow
+    state does not survive a fork).
+    """
+    bundle_dir = os.path.join(artifact_root, bundle.manifest['created_at'])
+    bundle.neumf_model = load_neumf(os.path.join(bundle_dir, 'neumf'), bundle.manifest['neumf'])
+    bundle.item_index = EmbeddingIndex.load(os.path.join(bundle_dir, 'neumf', 'item_index'))
+    return bundle
+
+def load_artifacts(artifact_root=DEFAULT_ARTIFACT_DIR, load_neumf_model=True):
+    """
+    Restore the most recent bundle without reading any raw CSVs.
+
+    NumPy arrays are memory-mapped read-only, so startup cost does not grow
+    with the size of the rating or TF-IDF matrices. Returns None if no
+    bundle has been saved yet.
+    """
+    bundle_dir = resolve_artifact_dir(artifact_root)
+    if bundle_dir is None:
+        return None
+    manifest = _load_json(os.path.join(bundle_dir, 'manifest.json'))
+    if manifest.get('format_version') != ARTIFACT_VERSION:
+        print(f"Ignoring artifacts in {bundle_dir} (format {manifest.get('format_version')}, expected {ARTIFACT_VERSION})")
+        return None
+
+    user_encoder, movie_encoder = load_encoders(os.path.join(bundle_dir, 'encoders'))
+    movies = load_catalog(os.path.join(bundle_dir, 'catalog'))
+    cf_model = load_cf(os.path.join(bundle_dir, 'cf'), manifest['cf'])
+    cbf_model = load_cbf(os.path.join(bundle_dir, 'cbf'), manifest['cbf'], movies)
+    bundle = ModelBundle(cf_model, cbf_model, None, user_encoder, movie_encoder, movies, manifest)
+    weights_path = os.path.join(bundle_dir, HYBRID_WEIGHTS_FILE)
+    if os.path.exists(weights_path):
+        bundle.hybrid_weights = _load_json(weights_path)
+        print(f"Using tuned hybrid weights (CF, CBF, NeuMF) {bundle.hybrid_weights['weights']} "
+              f"of bundle {manifest['created_at']}")
+    if load_neumf_model:
+        load_bundle_neumf(bundle, artifact_root)
+    return bundle
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from artifacts import DEFAULT_ARTIFACT_DIR
+from parallel_train import ThreadLimit
+
+# Recommendations stored per user (requests for more fall back to live scoring)
+TOP_N = 50
+# Users per worker task, and (user, movie) pairs scored per vectorized chunk
+USERS_PER_TASK = 256
+PAIRS_PER_CHUNK = 1 << 18
+
+def topn_dir(artifact_root, version):
+    """Where the precomputed top-N of one bundle version lives."""
+    return os.path.join(artifact_root, 'recommendations', version)
+
+# --- Batch scoring (worker) ---
+# Per-process scoring state, set once by _init_worker
+_worker = None
+
+def _init_worker(artifact_root, version, out_dir):
+    """
+    Worker initializer: load the bundle and open the shared output files
+    once per process, so the load cost grows with workers, not users.
+    """
+    global _worker
+    from artifacts import load_artifacts
+    from hybrid import HybridRecommender
+
+    bundle = load_artifacts(artifact_root)
+    if bundle is None or bundle.manifest.get('created_at') != version:
+        # Raised from each task, where the pool reports it
+        _worker = {'error': f"Bundle {version} is no longer the latest, rerun the batch job"}
+        return
+    catalog = np.asarray(bundle.movie_encoder.classes_)
+    _worker = {
+        'recommender': HybridRecommender.from_bundle(bundle),
+        'cf': bundle.cf_model,
+        'user_ids': np.asarray(bundle.user_encoder.classes_),
+        'catalog': catalog,
+        # CF matrix columns -> catalog positions, to mask movies users have seen
+        'column_positions': pd.Index(catalog).get_indexer(bundle.cf_model.movie_index),
+        'items': np.load(os.path.join(out_dir, 'items.npy'), mmap_mode='r+'),
+        'scores': np.load(os.path.join(out_dir, 'scores.npy'), mmap_mode='r+'),
+    }
+
+def _score_users(start, end):
+    """
+    Worker task: top-N unseen movies for users [start, end) of the bundle's
+    user encoder, written into the shared items/scores files. Returns the
+    number of users scored.
+    """
+    if 'error' in _worker:
+        raise RuntimeError(_worker['error'])
+    recommender, cf, catalog = _worker['recommender'], _worker['cf'], _worker['catalog']
+    column_positions, items, scores = _worker['column_positions'], _worker['items'], _worker['scores']
+    user_ids = _worker['user_ids'][start:end]
+    k = min(items.shape[1], len(catalog))
+    chunk_size = max(1, PAIRS_PER_CHUNK // max(len(catalog), 1))
+
+    for chunk_start in range(0, len(user_ids), chunk_size):
+        users = user_ids[chunk_start:chunk_start + chunk_size]
+        block = recommender.score(np.repeat(users, len(catalog)), np.tile(catalog, len(users))).reshape(len(users), -1)
+
+        rows = cf.user_index.get_indexer(users)
+        known = np.flatnonzero(rows >= 0)
+        seen = cf.user_item_matrix[rows[known]].tocoo()
+        positions = column_positions[seen.col]
+        in_catalog = positions >= 0
+        block[known[seen.row[in_catalog]], positions[in_catalog]] = -np.inf
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        # Users who have seen almost everything get -1 padding
+        valid = np.isfinite(top_scores)
+        out = slice(start + chunk_start, start + chunk_start + len(users))
+        items[out, :k] = np.where(valid, catalog[top], -1)
+        scores[out, :k] = np.where(valid, top_scores, 0)
+    items.flush()
+    scores.flush()
+    return len(user_ids)
+
+def build_topn(artifact_root=DEFAULT_ARTIFACT_DIR, n=TOP_N, max_workers=None, users_per_task=USERS_PER_TASK):
+    """
+    Offline batch job: score every user of the latest bundle against the
+    whole catalog and store their top-n unseen movies.
+
+    Users are split into tasks for a 'spawn' process pool; each worker
+    loads the bundle once, scores its tasks' users in vectorized chunks and
+    writes their rows straight into shared memory-mapped files:
+
+    - items.npy: int32 [users, n] movie ids, best first (-1 padding)
+    - scores.npy: float16 [users, n] hybrid scores
+    - offsets.npy: int32 [max user id + 1], user id -> row (-1 if absent)
+
+    The files are written to a temporary directory and renamed into place
+    under recommendations/<bundle version>. Returns that directory.
+    """
+    from artifacts import load_artifacts
+    from hybrid import HybridRecommender
+
+    bundle = load_artifacts(artifact_root, load_neumf_model=False)
+    if bundle is None:
+        print("No saved artifacts found, train the models first")
+        return None
+    version = bundle.manifest['created_at']
+    user_ids = np.asarray(bundle.user_encoder.classes_)
+    weights = HybridRecommender.from_bundle(bundle).weights.tolist()
+    del bundle
+
+    out_dir = topn_dir(artifact_root, version)
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    items = np.lib.format.open_memmap(os.path.join(tmp_dir, 'items.npy'), mode='w+', dtype=np.int32, shape=(len(user_ids), n))
+    items[:] = -1
+    scores = np.lib.format.open_memmap(os.path.join(tmp_dir, 'scores.npy'), mode='w+', dtype=np.float16, shape=(len(user_ids), n))
+    del items, scores
+
+    # Dense offset index: a lookup is one array read, no hashing
+    offsets = np.full(int(user_ids.max()) + 1 if len(user_ids) else 0, -1, dtype=np.int32)
+    offsets[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+
+    tasks = [(start, min(start + users_per_task, len(user_ids))) for start in range(0, len(user_ids), users_per_task)]
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+    print(f"Scoring {len(user_ids)} users in {len(tasks)} tasks with {max_workers} workers...")
+    start_time = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ThreadLimit(threads), ProcessPoolExecutor(max_workers, mp_context=context, initializer=_init_worker,
+                                                       initargs=(artifact_root, version, tmp_dir)) as pool:
+            futures = [pool.submit(_score_users, start, end) for start, end in tasks]
+            done = 0
+            for future in as_completed(futures):
+                done += future.result()
+                print(f"  {done}/{len(user_ids)} users")
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': version, 'n': n, 'num_users': len(user_ids), 'weights': weights,
+                   'created_at': time.strftime('%Y%m%d-%H%M%S')}, f)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    print(f"Top-{n} recommendations saved to {out_dir} in {time.perf_counter() - start_time:.1f}s")
+    return out_dir
+
+# --- Lookup ---
+class TopNStore:
+    """Read side of build_topn: memory-mapped per-user top-N, looked up in O(1)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.items = np.load(os.path.join(directory, 'items.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(directory, 'scores.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r')
+
+    def lookup(self, user_id, n=10):
+        """
+        (movie ids, scores) of a user's top-n, or None if the user was not
+        in the batch or n is not between 1 and the stored n.
+        """
+        if not 1 <= n <= self.items.shape[1] or not 0 <= user_id < len(self.offsets):
+            return None
+        row = self.offsets[user_id]
+        if row < 0:
+            return None
+        movie_ids = self.items[row, :n]
+        keep = movie_ids >= 0
+        return movie_ids[keep], self.scores[row, :n][keep].astype(np.float32)
+
+def load_topn(artifact_root, version):
+    """TopNStore for a bundle version, or None if the batch job has not run for it."""
+    directory = topn_dir(artifact_root, version)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    return TopNStore(directory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute every user's top-N recommendations for the latest bundle")
+    parser.add_argument('--artifact-root', default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument('--n', type=int, default=TOP_N)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    build_topn(args.artifact_root, args.n, args.workers)
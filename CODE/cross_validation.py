@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from sklearn.model_selection import KFold
+from parallel_train import share_data, load_shared, ThreadLimit
+
+COMPONENT_NAMES = ['CF', 'CBF', 'NeuMF']
+DEFAULT_CV_DIR = os.path.join(os.path.dirname(__file__), '..', 'ARTIFACTS', 'cv')
+
+# --- Per-fold training (worker) ---
+def _run_fold(fold, work_dir, fold_path, options):
+    """
+    Worker: train CF, CBF and NeuMF on every fold but ``fold`` and save
+    their predictions for the held-out rows to ``fold_path`` (.npz).
+    """
+    import pandas as pd
+    from data_loader import RatingsTable, fitted_encoder
+    from train import train_cbf, train_neumf
+    from models import CollaborativeFilteringModel
+    from hybrid import HybridRecommender, DEFAULT_WEIGHTS
+
+    start = time.perf_counter()
+    data = load_shared(work_dir)
+    test_idx = np.load(os.path.join(work_dir, f"fold_{fold}_test.npy"))
+    train_mask = np.ones(len(data['ratings']), dtype=bool)
+    train_mask[test_idx] = False
+
+    train_ratings = RatingsTable(*(data[name][train_mask] for name in
+                                   ['user_ids', 'movie_ids', 'ratings', 'user_encoded', 'movie_encoded']))
+    movies = pd.read_pickle(os.path.join(work_dir, 'movies.pkl'))
+    user_encoder = fitted_encoder(np.asarray(data['user_classes']))
+    movie_encoder = fitted_encoder(np.asarray(data['movie_classes']))
+
+    cf_model = CollaborativeFilteringModel()
+    cf_model.train(train_ratings)
+    cbf_model = train_cbf(movies, train_ratings)
+    neumf_model = train_neumf(train_ratings.user_codes, train_ratings.movie_codes,
+                              train_ratings.ratings, len(user_encoder.classes_), len(movie_encoder.classes_),
+                              epochs=options['neumf_epochs'], batch_size=options['neumf_batch_size'])
+
+    # Only the component scores are used; the weights are searched over them later
+    recommender = HybridRecommender(cf_model, cbf_model, neumf_model, user_encoder, movie_encoder, weights=DEFAULT_WEIGHTS)
+    users = np.asarray(data['user_ids'][test_idx])
+    items = np.asarray(data['movie_ids'][test_idx])
+    cf_preds, cbf_preds, neumf_preds = recommender.component_scores(users, items)
+
+    tmp_path = fold_path + '.tmp.npz'
+    np.savez(tmp_path, users=users, items=items, y_true=np.asarray(data['ratings'][test_idx]),
+             predictions=np.stack([cf_preds, cbf_preds, neumf_preds], axis=1).astype(np.float32))
+    os.replace(tmp_path, fold_path)
+    return fold, time.perf_counter() - start
+
+# --- Cached predictions ---
+def _cache_key(data_dir, ratings_file, n_folds, seed, options):
+    """Folds are only reused for the same data, split and training options."""
+    from dataset_cache import file_hash, MOVIES_FILE
+    config = {
+        'ratings': file_hash(os.path.join(data_dir, ratings_file)),
+        'movies': file_hash(os.path.join(data_dir, MOVIES_FILE)),
+        'n_folds': n_folds,
+        'seed': seed,
+        'options': options,
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+def compute_fold_predictions(data_dir=None, ratings_file='ratings_small.csv', n_folds=5, seed=42,
+                             cv_dir=DEFAULT_CV_DIR, max_workers=None, neumf_epochs=None, neumf_batch_size=None):
+    """
+    K-fold per-component predictions, one .npz per fold under cv_dir.
+
+    Folds already on disk for the same data and settings are reused;
+    the rest are trained in parallel 'spawn' workers that memory-map the
+    encoded ratings. Returns the list of fold file paths.
+    """
+    from data_loader import load_data_streaming
+    from neumf_training import DEFAULT_BATCH_SIZE
+
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
+    options = {'neumf_epochs': neumf_epochs, 'neumf_batch_size': neumf_batch_size or DEFAULT_BATCH_SIZE}
+    run_dir = os.path.join(cv_dir, _cache_key(data_dir, ratings_file, n_folds, seed, options))
+    fold_paths = [os.path.join(run_dir, f"fold_{k}.npz") for k in range(n_folds)]
+    missing = [k for k, path in enumerate(fold_paths) if not os.path.exists(path)]
+    if not missing:
+        print(f"Using cached fold predictions from {run_dir}")
+        return fold_paths
+
+    movies, ratings, _, _, user_encoder, movie_encoder, rating_matrix = load_data_streaming(data_dir, ratings_file)
+    work_dir = os.path.join(run_dir, 'data')
+    os.makedirs(work_dir, exist_ok=True)
+    share_data(work_dir, movies, ratings, user_encoder, movie_encoder, rating_matrix)
+    folds = KFold(n_splits=n_folds, shuffle=True, random_state=seed).split(np.arange(len(ratings)))
+    for k, (_, test_idx) in enumerate(folds):
+        np.save(os.path.join(work_dir, f"fold_{k}_test.npy"), test_idx.astype(np.int64))
+    del ratings, rating_matrix
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(missing))
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+    print(f"Training {len(missing)} folds with {max_workers} workers...")
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ThreadLimit(threads), ProcessPoolExecutor(max_workers, mp_context=context) as pool:
+            futures = [pool.submit(_run_fold, k, work_dir, fold_paths[k], options) for k in missing]
+            for future in as_completed(futures):
+                fold, seconds = future.result()
+                print(f"Fold {fold + 1}/{n_folds} finished in {seconds:.1f}s")
+    finally:
+        # Finished folds stay cached; the shared copy of the data does not
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return fold_paths
+
+def load_fold_predictions(fold_paths):
+    """(predictions [N, 3], y_true [N], fold [N]) stacked over all folds."""
+    predictions, y_true, fold_ids = [], [], []
+    for k, path in enumerate(fold_paths):
+        with np.load(path) as fold:
+            predictions.append(fold['predictions'])
+            y_true.append(fold['y_true'])
+            fold_ids.append(np.full(len(fold['y_true']), k))
+    return np.concatenate(predictions).astype(np.float64), np.concatenate(y_true).astype(np.float64), np.concatenate(fold_ids)
+
+# --- Weight search ---
+def simplex_grid(step=0.05, num_components=3):
+    """All non-negative weight vectors summing to 1 on a grid of ``step``."""
+    steps = int(round(1 / step))
+    grid = [w for w in itertools.product(range(steps + 1), repeat=num_components - 1) if sum(w) <= steps]
+    grid = np.array([list(w) + [steps - sum(w)] for w in grid], dtype=np.float64)
+    return grid / steps
+
+def grid_search_weights(predictions, y_true, step=0.05, chunk_size=256):
+    """
+    Weights on the simplex grid with the lowest RMSE. All candidates are
+    scored with one matrix product per chunk of the grid.
+    """
+    grid = simplex_grid(step, predictions.shape[1])
+    sse = np.empty(len(grid))
+    for start in range(0, len(grid), chunk_size):
+        errors = predictions @ grid[start:start + chunk_size].T - y_true[:, None]
+        sse[start:start + chunk_size] = np.einsum('ij,ij->j', errors, errors)
+    return grid[np.argmin(sse)]
+
+def least_squares_weights(predictions, y_true):
+    """Closed-form least squares weights constrained to sum to 1."""
+    # Substitute w_last = 1 - sum(others) and solve the unconstrained problem
+    base = predictions[:, -1]
+    design = predictions[:, :-1] - base[:, None]
+    head, *_ = np.linalg.lstsq(design, y_true - base, rcond=None)
+    return np.append(head, 1 - head.sum())
+
+def _rmse(predictions, y_true, weights):
+    return float(np.sqrt(np.mean((predictions @ weights - y_true) ** 2)))
+
+def search_weights(predictions, y_true, fold_ids, method='grid', step=0.05):
+    """
+    Fit ensemble weights on the cached predictions with ``method`` ('grid'
+    or 'lstsq'). Out-of-fold RMSE comes from refitting with each fold left
+    out; the returned weights are fit on all folds.
+    """
+    if method == 'grid':
+        fit = lambda p, y: grid_search_weights(p, y, step)
+    elif method == 'lstsq':
+        fit = least_squares_weights
+    else:
+        raise ValueError(f"Unknown weight search method '{method}', expected 'grid' or 'lstsq'")
+
+    fold_rmse = []
+    for k in np.unique(fold_ids):
+        held_out = fold_ids == k
+        weights = fit(predictions[~held_out], y_true[~held_out])
+        fold_rmse.append(_rmse(predictions[held_out], y_true[held_out], weights))
+    weights = fit(predictions, y_true)
+    return weights, float(np.mean(fold_rmse))
+
+def tune_hybrid_weights(data_dir=None, ratings_file='ratings_small.csv', n_folds=5, seed=42, method='grid',
+                        step=0.05, cv_dir=DEFAULT_CV_DIR, artifact_root=None, version=None, max_workers=None,
+                        neumf_epochs=None):
+    """
+    Cross-validate the components, search ensemble weights over the cached
+    fold predictions and save them with the bundle trained on the same
+    ratings (the latest under ``artifact_root`` unless ``version`` is
+    given), where HybridRecommender.from_bundle picks them up. Returns the
+    saved summary.
+    """
+    from artifacts import save_hybrid_weights, DEFAULT_ARTIFACT_DIR
+
+    start = time.perf_counter()
+    fold_paths = compute_fold_predictions(data_dir, ratings_file, n_folds, seed, cv_dir, max_workers, neumf_epochs)
+    predictions, y_true, fold_ids = load_fold_predictions(fold_paths)
+
+    search_start = time.perf_counter()
+    weights, cv_rmse = search_weights(predictions, y_true, fold_ids, method, step)
+    search_seconds = time.perf_counter() - search_start
+
+    component_rmse = {name: float(np.sqrt(np.mean((predictions[:, i] - y_true) ** 2)))
+                      for i, name in enumerate(COMPONENT_NAMES)}
+    summary = {
+        'weights': [float(w) for w in weights],
+        'method': method,
+        'n_folds': n_folds,
+        'cv_rmse': cv_rmse,
+        'component_rmse': component_rmse,
+        'num_predictions': int(len(y_true)),
+        'ratings_file': ratings_file,
+    }
+    weights_file = save_hybrid_weights(summary, artifact_root or DEFAULT_ARTIFACT_DIR, version)
+
+    print("\nComponent RMSE (out of fold):")
+    for name, value in component_rmse.items():
+        print(f"  {name:<6} {value:.4f}")
+    print(f"Hybrid weights (CF, CBF, NeuMF): {np.round(weights, 3).tolist()}")
+    print(f"Hybrid RMSE (out of fold): {cv_rmse:.4f}")
+    print(f"Weight search took {search_seconds:.2f}s, total {time.perf_counter() - start:.1f}s")
+    print(f"Weights saved to {weights_file}")
+    return summary
+
+if __name__ == "__main__":
+    tune_hybrid_weights()
@@ -1,6 +1,58 @@
+import os
 import pandas as pd
 import numpy as np
+from scipy.sparse import csr_matrix
 from sklearn.preprocessing import LabelEncoder
+from dataset_cache import load_movies
+
+# Compact dtypes for reading ratings CSVs (the timestamp column is never read)
+RATINGS_COLUMNS = ['userId', 'movieId', 'rating']
+RATINGS_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+RATINGS_CHUNK_SIZE = 1_000_000
+
+class RatingsTable:
+    """
+    Ratings as aligned typed arrays instead of a DataFrame: int32 raw ids
+    and encoded codes, float32 ratings (20 bytes per rating with codes).
+    The models, trainers and evaluation take the arrays as they are, with
+    no per-stage dtype conversions or copies.
+    """
+    __slots__ = ('user_ids', 'movie_ids', 'ratings', 'user_codes', 'movie_codes')
+
+    def __init__(self, user_ids, movie_ids, ratings, user_codes=None, movie_codes=None):
+        # asarray does not copy arrays that already have the right dtype
+        self.user_ids = np.asarray(user_ids, dtype=np.int32)
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int32)
+        self.ratings = np.asarray(ratings, dtype=np.float32)
+        # Encoder codes (set by preprocess_features or the streaming loader)
+        self.user_codes = None if user_codes is None else np.asarray(user_codes, dtype=np.int32)
+        self.movie_codes = None if movie_codes is None else np.asarray(movie_codes, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ratings)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__ if getattr(self, name) is not None)
+
+    def take(self, rows):
+        """Subset by an index array or boolean mask, e.g. one side of a train/test split."""
+        def pick(values):
+            return None if values is None else values[rows]
+        return RatingsTable(self.user_ids[rows], self.movie_ids[rows], self.ratings[rows],
+                            pick(self.user_codes), pick(self.movie_codes))
+
+    @classmethod
+    def from_frame(cls, df):
+        """Table from a ratings frame (userId, movieId, rating and optional user_encoded, movie_encoded)."""
+        def column(name):
+            return df[name].values if name in df else None
+        return cls(df['userId'].values, df['movieId'].values, df['rating'].values,
+                   column('user_encoded'), column('movie_encoded'))
+
+def as_ratings_table(ratings):
+    """Accept ratings frames where a RatingsTable is expected."""
+    return RatingsTable.from_frame(ratings) if isinstance(ratings, pd.DataFrame) else ratings
 
 def load_data(data_dir):
     """
@@ -8,22 +60,19 @@ def load_data(data_dir):
     """
     print(f"Loading data from {data_dir}...")
     
-    # Load movies metadata
-    # Using low_memory=False because of mixed types in some columns
-    movies = pd.read_csv(f"{data_dir}/movies_metadata.csv", low_memory=False)
+    # Load movies metadata from the columnar cache (numeric IDs only, genres
+    # already parsed); the CSV is only re-read when it changes
+    movies = load_movies(data_dir)
     
     # Load ratings (using small dataset for development/testing)
-    ratings = pd.read_csv(f"{data_dir}/ratings_small.csv")
-    
-    # Filter valid movies (numeric IDs only)
-    movies = movies[movies['id'].str.isnumeric()]
-    movies['id'] = movies['id'].astype(int)
+    frame = pd.read_csv(f"{data_dir}/ratings_small.csv", usecols=RATINGS_COLUMNS, dtype=RATINGS_DTYPES)
     
     # Keep only relevant columns for content-based filtering
     movies = movies[['id', 'title', 'overview', 'genres', 'vote_average', 'vote_count']]
     
-    # Merge to ensure we only have ratings for movies we have metadata for
-    ratings = ratings[ratings['movieId'].isin(movies['id'])]
+    # Keep only ratings for movies we have metadata for
+    keep = np.isin(frame['movieId'].values, movies['id'].values)
+    ratings = RatingsTable(frame['userId'].values[keep], frame['movieId'].values[keep], frame['rating'].values[keep])
     
     return movies, ratings
 
@@ -33,18 +82,106 @@ def preprocess_features(movies, ratings):
     """
     print("Preprocessing features...")
     
+    ratings = as_ratings_table(ratings)
+    
     # Fill missing overviews
     movies['overview'] = movies['overview'].fillna('')
     
-    # Encode User IDs and Movie IDs for NeuMF
-    user_encoder = LabelEncoder()
-    movie_encoder = LabelEncoder()
-    
-    ratings['user_encoded'] = user_encoder.fit_transform(ratings['userId'])
-    ratings['movie_encoded'] = movie_encoder.fit_transform(ratings['movieId'])
+    # Encode User IDs and Movie IDs for NeuMF (sorted classes, so the codes
+    # are what LabelEncoder.fit_transform gives, but int32)
+    user_classes, user_codes = np.unique(ratings.user_ids, return_inverse=True)
+    movie_classes, movie_codes = np.unique(ratings.movie_ids, return_inverse=True)
+    ratings.user_codes = user_codes.astype(np.int32)
+    ratings.movie_codes = movie_codes.astype(np.int32)
+    user_encoder = fitted_encoder(user_classes)
+    movie_encoder = fitted_encoder(movie_classes)
     
     num_users = len(user_encoder.classes_)
     num_movies = len(movie_encoder.classes_)
     
     return movies, ratings, num_users, num_movies, user_encoder, movie_encoder
 
+
+def fitted_encoder(classes):
+    """LabelEncoder with precomputed (sorted) classes, as if fit on the ids."""
+    encoder = LabelEncoder()
+    encoder.classes_ = classes
+    return encoder
+
+def _csr_from_codes(user_codes, movie_codes, values, num_users, num_movies):
+    """
+    CSR matrix built straight from its arrays (no COO intermediate). Rows
+    already sorted by (user, movie), as in ratings.csv, skip the sort.
+    """
+    keys = user_codes.astype(np.int64) * num_movies + movie_codes
+    if len(keys) > 1 and not (keys[1:] > keys[:-1]).all():
+        order = np.argsort(keys, kind='stable')
+        movie_codes, values = movie_codes[order], values[order]
+    del keys
+    indptr = np.zeros(num_users + 1, dtype=np.int64)
+    np.cumsum(np.bincount(user_codes, minlength=num_users), out=indptr[1:])
+    return csr_matrix((values, movie_codes, indptr), shape=(num_users, num_movies))
+
+def stream_ratings(path, valid_movie_ids, chunksize=RATINGS_CHUNK_SIZE):
+    """
+    Read a ratings CSV in chunks without materializing the full frame.
+
+    Each chunk is parsed with compact dtypes and filtered against the sorted
+    valid_movie_ids; user and movie ids are collected as int32 and ratings as
+    uint8 half-stars, and the sorted id vocabularies are grown chunk by chunk.
+    Returns (user_ids, movie_ids, half_stars, user_classes, movie_classes).
+    """
+    valid_movie_ids = np.unique(np.asarray(valid_movie_ids, dtype=np.int32))
+    users, movies, half_stars = [], [], []
+    user_classes = np.empty(0, dtype=np.int32)
+    movie_classes = np.empty(0, dtype=np.int32)
+
+    reader = pd.read_csv(path, usecols=RATINGS_COLUMNS, dtype=RATINGS_DTYPES, chunksize=chunksize)
+    for chunk in reader:
+        movie_ids = chunk['movieId'].values
+        pos = np.minimum(np.searchsorted(valid_movie_ids, movie_ids), max(len(valid_movie_ids) - 1, 0))
+        keep = valid_movie_ids[pos] == movie_ids if len(valid_movie_ids) else np.zeros(len(chunk), dtype=bool)
+
+        chunk_users = chunk['userId'].values[keep]
+        chunk_movies = movie_ids[keep]
+        users.append(chunk_users)
+        movies.append(chunk_movies)
+        half_stars.append(np.rint(chunk['rating'].values[keep] * 2).astype(np.uint8))
+        user_classes = np.union1d(user_classes, np.unique(chunk_users))
+        movie_classes = np.union1d(movie_classes, np.unique(chunk_movies))
+
+    def concat(parts, dtype):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    return (concat(users, np.int32), concat(movies, np.int32), concat(half_stars, np.uint8),
+            user_classes.astype(np.int32), movie_classes.astype(np.int32))
+
+def load_data_streaming(data_dir, ratings_file='ratings.csv', chunksize=RATINGS_CHUNK_SIZE):
+    """
+    Memory-bounded alternative to load_data + preprocess_features for the
+    full ratings.csv.
+
+    Returns the same (movies, ratings, num_users, num_movies, user_encoder,
+    movie_encoder) as preprocess_features, followed by the sparse
+    users x movies rating matrix in encoded order.
+    """
+    print(f"Loading data from {data_dir} (streaming {ratings_file})...")
+    movies = load_movies(data_dir)
+    movies = movies[['id', 'title', 'overview', 'genres', 'vote_average', 'vote_count']]
+    movies['overview'] = movies['overview'].fillna('')
+
+    user_ids, movie_ids, half_stars, user_classes, movie_classes = stream_ratings(
+        os.path.join(data_dir, ratings_file), movies['id'].values, chunksize)
+
+    # Classes are sorted, so codes match what LabelEncoder.fit_transform gives
+    user_codes = np.searchsorted(user_classes, user_ids).astype(np.int32)
+    movie_codes = np.searchsorted(movie_classes, movie_ids).astype(np.int32)
+    ratings_values = half_stars.astype(np.float32) / 2
+    del half_stars
+
+    rating_matrix = _csr_from_codes(user_codes, movie_codes, ratings_values, len(user_classes), len(movie_classes))
+    ratings = RatingsTable(user_ids, movie_ids, ratings_values, user_codes, movie_codes)
+    print(f"Loaded {len(ratings)} ratings from {len(user_classes)} users on {len(movie_classes)} movies")
+
+    return (movies, ratings, len(user_classes), len(movie_classes),
+            fitted_encoder(user_classes), fitted_encoder(movie_classes), rating_matrix)
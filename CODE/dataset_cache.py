@@ -0,0 +1,148 @@
+import os
+import ast
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Bump when the cached layout or cleaning rules change
+CACHE_VERSION = 1
+
+MOVIES_FILE = 'movies_metadata.csv'
+STRING_COLUMNS = ['title', 'overview', 'release_date', 'poster_path', 'backdrop_path']
+FLOAT_COLUMNS = ['vote_average', 'vote_count', 'runtime', 'popularity']
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-1 of a file, read in blocks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_dir_for(data_dir):
+    return os.path.join(data_dir, '.cache', 'movies')
+
+# --- String and list columns as flat arrays ---
+def _save_strings(directory, name, values):
+    """
+    Store a column of optional strings as one UTF-8 blob plus character
+    offsets, so loading is a single decode instead of one per row.
+    """
+    missing = np.array([not isinstance(v, str) for v in values], dtype=bool)
+    strings = ['' if m else v for v, m in zip(values, missing)]
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(v) for v in strings])
+    with open(os.path.join(directory, f"{name}.txt"), 'w', encoding='utf-8') as f:
+        f.write(''.join(strings))
+    np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{name}_missing.npy"), missing)
+
+def _load_strings(directory, name):
+    with open(os.path.join(directory, f"{name}.txt"), encoding='utf-8') as f:
+        text = f.read()
+    offsets = np.load(os.path.join(directory, f"{name}_offsets.npy")).tolist()
+    missing = np.load(os.path.join(directory, f"{name}_missing.npy"))
+    values = np.array([text[a:b] for a, b in zip(offsets[:-1], offsets[1:])], dtype=object)
+    values[missing] = None
+    return values
+
+def _parse_genres(genres_str):
+    """Genre names from the JSON-like string in movies_metadata.csv."""
+    try:
+        return [g['name'] for g in ast.literal_eval(genres_str)]
+    except (ValueError, SyntaxError, TypeError, KeyError):
+        return []
+
+# --- Ingest ---
+def build_movies_cache(data_dir):
+    """
+    One-time ingest of movies_metadata.csv into a cleaned, typed, columnar
+    cache: numeric columns as .npy, string columns as blob + offsets, and
+    genres as integer codes with a name vocabulary.
+    """
+    source = os.path.join(data_dir, MOVIES_FILE)
+    print(f"Building movies cache from {source}...")
+    movies = pd.read_csv(source, low_memory=False)
+
+    # Filter valid movies (numeric IDs only)
+    movies = movies[movies['id'].notna()]
+    movies = movies[movies['id'].astype(str).str.isnumeric()]
+
+    genre_lists = [_parse_genres(g) for g in movies['genres'].fillna('[]')]
+    genre_names = sorted({name for names in genre_lists for name in names})
+    genre_codes = {name: i for i, name in enumerate(genre_names)}
+    genre_offsets = np.zeros(len(genre_lists) + 1, dtype=np.int64)
+    genre_offsets[1:] = np.cumsum([len(names) for names in genre_lists])
+    genre_values = np.array([genre_codes[name] for names in genre_lists for name in names], dtype=np.int16)
+
+    cache_dir = cache_dir_for(data_dir)
+    tmp_dir = cache_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, 'id.npy'), movies['id'].astype(np.int32).values)
+    for col in FLOAT_COLUMNS:
+        values = pd.to_numeric(movies[col], errors='coerce') if col in movies else pd.Series(np.nan, index=movies.index)
+        np.save(os.path.join(tmp_dir, f"{col}.npy"), values.astype(np.float64).values)
+    for col in STRING_COLUMNS:
+        values = movies[col].tolist() if col in movies else [None] * len(movies)
+        _save_strings(tmp_dir, col, values)
+    np.save(os.path.join(tmp_dir, 'genre_codes.npy'), genre_values)
+    np.save(os.path.join(tmp_dir, 'genre_offsets.npy'), genre_offsets)
+
+    manifest = {
+        'version': CACHE_VERSION,
+        'source_hash': file_hash(source),
+        'source_size': os.path.getsize(source),
+        'num_movies': len(movies),
+        'genre_names': genre_names,
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(tmp_dir, cache_dir)
+    return manifest
+
+def is_cache_fresh(data_dir):
+    """True if the cache exists, has the current layout and matches the CSV's hash."""
+    manifest_path = os.path.join(cache_dir_for(data_dir), 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    source = os.path.join(data_dir, MOVIES_FILE)
+    if manifest.get('version') != CACHE_VERSION or manifest.get('source_size') != os.path.getsize(source):
+        return False
+    return manifest.get('source_hash') == file_hash(source)
+
+def load_movies(data_dir):
+    """
+    Cleaned movies table, read from the columnar cache (rebuilt first if
+    missing or stale). Genres come back as lists of names; missing strings
+    as None so callers keep their own fill rules.
+    """
+    if not is_cache_fresh(data_dir):
+        build_movies_cache(data_dir)
+
+    cache_dir = cache_dir_for(data_dir)
+    with open(os.path.join(cache_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    columns = {'id': np.load(os.path.join(cache_dir, 'id.npy'))}
+    for col in STRING_COLUMNS:
+        columns[col] = _load_strings(cache_dir, col)
+    for col in FLOAT_COLUMNS:
+        columns[col] = np.load(os.path.join(cache_dir, f"{col}.npy"))
+
+    genre_names = np.array(manifest['genre_names'], dtype=object)
+    genre_codes = np.load(os.path.join(cache_dir, 'genre_codes.npy'))
+    genre_offsets = np.load(os.path.join(cache_dir, 'genre_offsets.npy')).tolist()
+    names = genre_names[genre_codes].tolist()
+    columns['genres'] = [names[a:b] for a, b in zip(genre_offsets[:-1], genre_offsets[1:])]
+
+    return pd.DataFrame(columns)
@@ -0,0 +1,207 @@
+import os
+import json
+import numpy as np
+import tensorflow as tf
+
+# Bump when the saved index layout changes
+INDEX_VERSION = 1
+
+class EmbeddingIndex:
+    """
+    Top-N maximum inner product search over item embedding vectors.
+
+    'exact' mode scores every item with a blocked matrix product. 'ivf'
+    mode (after build_ivf) groups items into k-means lists, scans only the
+    num_probe lists whose centroids score highest for the query using
+    int8-quantized vectors, and orders the best of those by exact score.
+    """
+
+    def __init__(self, vectors, ids=None, block_size=8192):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.ids = np.arange(len(self.vectors), dtype=np.int32) if ids is None else np.asarray(ids)
+        self.block_size = block_size
+        # IVF state: centroids, item positions grouped by list (list_offsets
+        # delimit each list) and their quantized vectors in the same order
+        self.centroids = None
+        self.list_offsets = None
+        self.list_items = None
+        self.codes = None
+        self.scale = None
+        self.num_probe = None
+
+    @classmethod
+    def from_model(cls, neumf_model, **kwargs):
+        """Index over a NeuMFModel's item embeddings; ids are the encoded item ids."""
+        return cls(neumf_model.item_embedding.embeddings.numpy(), **kwargs)
+
+    # --- Exact search ---
+    def _search_exact(self, queries, n):
+        """Blocked scan keeping a running top-n per query."""
+        best_pos = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        rows = np.arange(len(queries))[:, None]
+        for start in range(0, len(self.vectors), self.block_size):
+            block = queries @ self.vectors[start:start + self.block_size].T
+            pos = np.concatenate([best_pos, np.broadcast_to(np.arange(start, start + block.shape[1]), block.shape)], axis=1)
+            scores = np.concatenate([best_scores, block], axis=1)
+            if scores.shape[1] > n:
+                top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+                pos, scores = pos[rows, top], scores[rows, top]
+            best_pos, best_scores = pos, scores
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return best_pos[rows, order], best_scores[rows, order]
+
+    # --- IVF ---
+    def build_ivf(self, num_lists=None, num_probe=16, iterations=10, seed=42):
+        """
+        Cluster the items with k-means (num_lists defaults to sqrt of the
+        catalog size) and store int8 codes with a per-dimension scale.
+        """
+        n = len(self.vectors)
+        num_lists = max(1, min(n, num_lists or int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(n, num_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._nearest_centroid(centroids)
+            counts = np.bincount(assign, minlength=num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Re-seed empty lists with random items
+            centroids[empty] = self.vectors[rng.choice(n, empty.sum(), replace=False)]
+        assign = self._nearest_centroid(centroids)
+
+        self.centroids = centroids
+        self.list_items = np.argsort(assign, kind='stable').astype(np.int32)
+        self.list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=num_lists), out=self.list_offsets[1:])
+        self.scale = np.maximum(np.abs(self.vectors).max(axis=0), 1e-12).astype(np.float32) / 127
+        self.codes = np.rint(self.vectors[self.list_items] / self.scale).astype(np.int8)
+        self.num_probe = num_probe
+        return self
+
+    def _nearest_centroid(self, centroids):
+        """Closest centroid (squared Euclidean) per item, in blocks."""
+        assign = np.empty(len(self.vectors), dtype=np.int64)
+        norms = (centroids ** 2).sum(axis=1)
+        for start in range(0, len(self.vectors), self.block_size):
+            block = self.vectors[start:start + self.block_size]
+            assign[start:start + len(block)] = np.argmin(norms - 2 * block @ centroids.T, axis=1)
+        return assign
+
+    def _search_ivf(self, queries, n, num_probe, refine=4):
+        num_probe = min(num_probe or self.num_probe, len(self.centroids))
+        positions = np.full((len(queries), n), -1, dtype=np.int64)
+        scores = np.full((len(queries), n), -np.inf, dtype=np.float32)
+        for q, query in enumerate(queries):
+            probe = np.argpartition(-(self.centroids @ query), num_probe - 1)[:num_probe]
+            spans = [slice(self.list_offsets[l], self.list_offsets[l + 1]) for l in probe]
+            codes = np.concatenate([self.codes[s] for s in spans])
+            items = np.concatenate([self.list_items[s] for s in spans])
+            # Approximate scores from int8 codes, then exact scores for the best few
+            m = min(len(items), n * refine)
+            if m == 0:
+                continue
+            approx = codes @ (query * self.scale)
+            shortlist = items[np.argpartition(-approx, m - 1)[:m]] if len(items) > m else items
+            exact = self.vectors[shortlist] @ query
+            k = min(n, len(shortlist))
+            top = np.argpartition(-exact, k - 1)[:k]
+            top = top[np.argsort(-exact[top], kind='stable')]
+            positions[q, :k] = shortlist[top]
+            scores[q, :k] = exact[top]
+        return positions, scores
+
+    def search(self, queries, n=10, mode='exact', num_probe=None):
+        """
+        Top-n items by inner product for each query vector. Returns (ids,
+        scores) of shape (num_queries, n), sorted by descending score; in
+        'ivf' mode, slots that the probed lists could not fill have id -1.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n = min(n, len(self.vectors))
+        if mode == 'ivf':
+            if self.centroids is None:
+                raise ValueError("IVF search needs build_ivf() first")
+            positions, scores = self._search_ivf(queries, n, num_probe)
+        elif mode == 'exact':
+            positions, scores = self._search_exact(queries, n)
+        else:
+            raise ValueError(f"Unknown search mode '{mode}', expected 'exact' or 'ivf'")
+        ids = np.where(positions >= 0, self.ids[np.maximum(positions, 0)], -1)
+        return ids, scores
+
+    # --- Export ---
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(directory, 'ids.npy'), self.ids)
+        has_ivf = self.centroids is not None
+        if has_ivf:
+            for name in ['centroids', 'list_offsets', 'list_items', 'codes', 'scale']:
+                np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, 'index.json'), 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'num_items': len(self.vectors), 'dim': self.vectors.shape[1],
+                       'block_size': self.block_size, 'ivf': has_ivf, 'num_probe': self.num_probe}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a saved index (arrays memory-mapped by default), or None if the layout is outdated."""
+        with open(os.path.join(directory, 'index.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            return None
+        mode = 'r' if mmap else None
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+        index = cls(load('vectors'), load('ids'), block_size=meta['block_size'])
+        if meta['ivf']:
+            for name in ['centroids', 'list_offsets', 'list_items', 'codes', 'scale']:
+                setattr(index, name, np.asarray(load(name)))
+            index.num_probe = meta['num_probe']
+        return index
+
+# --- Two-stage retrieval for NeuMF ---
+def user_query_vectors(neumf_model, user_codes, anchor=None):
+    """
+    One query vector per user such that its inner product with an item
+    embedding is the first-order approximation of the NeuMF score around
+    the anchor item vector (by default the mean item embedding). NeuMF
+    scores through an MLP rather than a dot product, so this is what lets an
+    inner-product index stand in for it at the retrieval stage.
+    """
+    item_table = neumf_model.item_embedding.embeddings
+    if anchor is None:
+        anchor = tf.reduce_mean(item_table, axis=0)
+    user_vecs = tf.gather(neumf_model.user_embedding.embeddings, np.asarray(user_codes, dtype=np.int32))
+    anchors = tf.tile(tf.reshape(tf.cast(anchor, tf.float32), [1, -1]), [tf.shape(user_vecs)[0], 1])
+    with tf.GradientTape() as tape:
+        tape.watch(anchors)
+        scores = neumf_model.score_vectors(user_vecs, anchors)
+    return tape.gradient(scores, anchors).numpy()
+
+def retrieve_candidates(neumf_model, index, user_code, num_candidates=200, mode='ivf', exclude=None):
+    """Encoded item ids of the index's top candidates for one encoded user, minus ``exclude``."""
+    query = user_query_vectors(neumf_model, [user_code])
+    extra = 0 if exclude is None else len(exclude)
+    candidates, _ = index.search(query, num_candidates + extra, mode=mode)
+    candidates = candidates[0][candidates[0] >= 0]
+    if exclude is not None:
+        candidates = candidates[~np.isin(candidates, exclude)]
+    return candidates[:num_candidates]
+
+def retrieve_and_rerank(neumf_model, index, user_code, n=10, num_candidates=200, mode='ivf', exclude=None):
+    """
+    Two-stage top-n for one encoded user: retrieve num_candidates items from
+    the embedding index, drop any in ``exclude`` (e.g. already rated), and
+    re-rank the rest with the full NeuMF model. Returns (item_codes, scores).
+    """
+    candidates = retrieve_candidates(neumf_model, index, user_code, num_candidates, mode, exclude)
+    if len(candidates) == 0:
+        return candidates, np.zeros(0, dtype=np.float32)
+
+    scores = neumf_model.predict_batch(np.full(len(candidates), user_code), candidates)
+    n = min(n, len(candidates))
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return candidates[top], scores[top]
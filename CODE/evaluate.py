@@ -18,20 +18,17 @@ def evaluate_models():
     
     # 3. Split Data
     print("Splitting data into Train and Test sets...")
-    train_ratings, test_ratings = train_test_split(ratings, test_size=0.2, random_state=42)
+    train_rows, test_rows = train_test_split(np.arange(len(ratings)), test_size=0.2, random_state=42)
+    train_ratings, test_ratings = ratings.take(train_rows), ratings.take(test_rows)
     
     # 4. Evaluate CF
     print("Evaluating Collaborative Filtering (CF)...")
     cf_model = CollaborativeFilteringModel()
     cf_model.train(train_ratings)
     
-    cf_preds = []
-    cf_actuals = []
-    # Predict on a subset of test data for speed if needed, but here we do all
-    for _, row in test_ratings.iterrows():
-        pred = cf_model.predict(row['userId'], row['movieId'])
-        cf_preds.append(pred)
-        cf_actuals.append(row['rating'])
+    # Score the whole test split in one batched call
+    cf_preds = cf_model.predict_batch(test_ratings.user_ids, test_ratings.movie_ids)
+    cf_actuals = test_ratings.ratings
         
     cf_rmse = np.sqrt(mean_squared_error(cf_actuals, cf_preds))
     print(f"CF RMSE: {cf_rmse:.4f}")
@@ -41,15 +38,15 @@ def evaluate_models():
     neumf_model = NeuMFModel(num_users, num_movies)
     neumf_model.compile(optimizer='adam', loss='mse')
     
-    train_user_ids = train_ratings['user_encoded'].values
-    train_movie_ids = train_ratings['movie_encoded'].values
-    train_labels = train_ratings['rating'].values
+    train_user_ids = train_ratings.user_codes
+    train_movie_ids = train_ratings.movie_codes
+    train_labels = train_ratings.ratings
     
     neumf_model.fit([train_user_ids, train_movie_ids], train_labels, epochs=5, batch_size=64, verbose=0)
     
-    test_user_ids = test_ratings['user_encoded'].values
-    test_movie_ids = test_ratings['movie_encoded'].values
-    test_labels = test_ratings['rating'].values
+    test_user_ids = test_ratings.user_codes
+    test_movie_ids = test_ratings.movie_codes
+    test_labels = test_ratings.ratings
     
     neumf_loss = neumf_model.evaluate([test_user_ids, test_movie_ids], test_labels, verbose=0)
     neumf_rmse = np.sqrt(neumf_loss)
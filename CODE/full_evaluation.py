@@ -6,7 +6,8 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error
 from data_loader import load_data, preprocess_features
 from models import CollaborativeFilteringModel, ContentBasedModel, NeuMFModel
-from hybrid import hybrid_recommendation
+from hybrid import HybridRecommender, DEFAULT_WEIGHTS
+from ranking_metrics import ranking_metrics
 
 # --- Metric Functions ---
 def calculate_rmse(y_true, y_pred):
@@ -15,62 +16,6 @@ def calculate_rmse(y_true, y_pred):
 def calculate_mae(y_true, y_pred):
     return mean_absolute_error(y_true, y_pred)
 
-def precision_at_k(predictions, k=10, threshold=3.5):
-    """
-    Predictions: list of (user_id, movie_id, true_rating, pred_rating)
-    """
-    user_est_true = {}
-    for uid, _, true_r, est in predictions:
-        user_est_true.setdefault(uid, []).append((est, true_r))
-
-    precisions = {}
-    for uid, user_ratings in user_est_true.items():
-        user_ratings.sort(key=lambda x: x[0], reverse=True)
-        n_rel = sum((true_r >= threshold) for (_, true_r) in user_ratings)
-        n_rec_k = sum((est >= threshold) for (est, _) in user_ratings[:k])
-        n_k = k if k < len(user_ratings) else len(user_ratings)
-        precisions[uid] = n_rec_k / n_k if n_k != 0 else 0
-
-    return sum(prec for prec in precisions.values()) / len(precisions)
-
-def recall_at_k(predictions, k=10, threshold=3.5):
-    user_est_true = {}
-    for uid, _, true_r, est in predictions:
-        user_est_true.setdefault(uid, []).append((est, true_r))
-
-    recalls = {}
-    for uid, user_ratings in user_est_true.items():
-        user_ratings.sort(key=lambda x: x[0], reverse=True)
-        n_rel = sum((true_r >= threshold) for (_, true_r) in user_ratings)
-        n_rec_k = sum((est >= threshold) and (true_r >= threshold) for (est, true_r) in user_ratings[:k])
-        recalls[uid] = n_rec_k / n_rel if n_rel != 0 else 0
-
-    return sum(rec for rec in recalls.values()) / len(recalls)
-
-def ndcg_at_k(predictions, k=10):
-    # Simplified NDCG implementation
-    user_est_true = {}
-    for uid, _, true_r, est in predictions:
-        user_est_true.setdefault(uid, []).append((est, true_r))
-        
-    ndcgs = {}
-    for uid, user_ratings in user_est_true.items():
-        user_ratings.sort(key=lambda x: x[0], reverse=True)
-        # DCG
-        dcg = 0
-        for i, (_, true_r) in enumerate(user_ratings[:k]):
-            dcg += (2**true_r - 1) / np.log2(i + 2)
-            
-        # IDCG
-        user_ratings.sort(key=lambda x: x[1], reverse=True)
-        idcg = 0
-        for i, (_, true_r) in enumerate(user_ratings[:k]):
-            idcg += (2**true_r - 1) / np.log2(i + 2)
-            
-        ndcgs[uid] = dcg / idcg if idcg > 0 else 0
-        
-    return sum(n for n in ndcgs.values()) / len(ndcgs)
-
 # --- Main Evaluation Logic ---
 def run_full_evaluation():
     print("Starting Advanced Evaluation...")
@@ -81,7 +26,8 @@ def run_full_evaluation():
     movies, ratings, num_users, num_movies, user_encoder, movie_encoder = preprocess_features(movies, ratings)
     
     # 2. Split Data
-    train_ratings, test_ratings = train_test_split(ratings, test_size=0.2, random_state=42)
+    train_rows, test_rows = train_test_split(np.arange(len(ratings)), test_size=0.2, random_state=42)
+    train_ratings, test_ratings = ratings.take(train_rows), ratings.take(test_rows)
     
     # 3. Train Models
     print("Training models...")
@@ -89,85 +35,55 @@ def run_full_evaluation():
     cf_model.train(train_ratings)
     
     cbf_model = ContentBasedModel()
-    cbf_model.train(movies)
+    cbf_model.train(movies, train_ratings)
     
     neumf_model = NeuMFModel(num_users, num_movies)
     neumf_model.compile(optimizer='adam', loss='mse')
-    neumf_model.fit([train_ratings['user_encoded'], train_ratings['movie_encoded']], train_ratings['rating'], epochs=3, verbose=0)
+    neumf_model.fit([train_ratings.user_codes, train_ratings.movie_codes], train_ratings.ratings, epochs=3, verbose=0)
     
     # 4. Generate Predictions
     print("Generating predictions...")
-    cf_preds_list = []
-    cbf_preds_list = []
-    neumf_preds_list = []
-    hybrid_preds_list = []
-    
-    # For speed, sample 1000 predictions
-    test_sample = test_ratings.sample(n=min(1000, len(test_ratings)), random_state=42)
-    
-    for _, row in test_sample.iterrows():
-        uid = row['userId']
-        mid = row['movieId']
-        true_r = row['rating']
-        
-        # CF
-        cf_p = cf_model.predict(uid, mid)
-        cf_preds_list.append((uid, mid, true_r, cf_p))
-        
-        # CBF
-        cbf_p = cbf_model.predict(uid, mid, train_ratings)
-        cbf_preds_list.append((uid, mid, true_r, cbf_p))
-        
-        # NeuMF
-        u_enc = row['user_encoded']
-        m_enc = row['movie_encoded']
-        # Note: predict returns [[val]], so we extract it
-        neumf_p = neumf_model.predict([np.array([u_enc]), np.array([m_enc])], verbose=0)[0][0]
-        neumf_preds_list.append((uid, mid, true_r, neumf_p))
-        
-        # Hybrid
-        hyb_p = hybrid_recommendation(uid, mid, cf_model, cbf_model, neumf_model)
-        # Note: hybrid function currently uses placeholders inside, but let's assume it uses the passed models
-        # We need to update hybrid.py to actually use the passed models properly or just do the math here.
-        # Since hybrid.py calls .predict(), and we have working .predict() (mostly), it should work.
-        # However, hybrid.py's NeuMF call was commented out/placeholder.
-        # Let's just do the weighted avg here for safety and correctness as per "seamless integration".
-        hyb_p_calc = (0.3 * cf_p) + (0.3 * cbf_p) + (0.4 * neumf_p)
-        hybrid_preds_list.append((uid, mid, true_r, hyb_p_calc))
+    # Fixed default weights: tuned ones (cross_validation.py) are fit on all
+    # ratings, test split included
+    hybrid_model = HybridRecommender(cf_model, cbf_model, neumf_model, user_encoder, movie_encoder, weights=DEFAULT_WEIGHTS)
+    print(f"Hybrid weights (CF, CBF, NeuMF): {hybrid_model.weights.tolist()}")
+    
+    # Score the full test split; each component runs one batched pass
+    # (NeuMF through its compiled predict step)
+    uids = test_ratings.user_ids
+    mids = test_ratings.movie_ids
+    true_rs = test_ratings.ratings
+    
+    cf_preds, cbf_preds, neumf_preds = hybrid_model.component_scores(uids, mids)
+    hybrid_preds = hybrid_model.combine(cf_preds, cbf_preds, neumf_preds)
+    
+    models_preds = {
+        'CF': cf_preds,
+        'CBF': cbf_preds,
+        'NeuMF': neumf_preds,
+        'Hybrid': hybrid_preds
+    }
 
     # 5. Calculate Metrics
     results = []
-    models_preds = {
-        'CF': cf_preds_list,
-        'CBF': cbf_preds_list,
-        'NeuMF': neumf_preds_list,
-        'Hybrid': hybrid_preds_list
-    }
     
     print("Calculating metrics...")
-    for name, preds in models_preds.items():
-        y_true = [p[2] for p in preds]
-        y_pred = [p[3] for p in preds]
-        
-        rmse = calculate_rmse(y_true, y_pred)
-        mae = calculate_mae(y_true, y_pred)
-        p5 = precision_at_k(preds, k=5)
-        p10 = precision_at_k(preds, k=10)
-        r5 = recall_at_k(preds, k=5)
-        r10 = recall_at_k(preds, k=10)
-        n5 = ndcg_at_k(preds, k=5)
-        n10 = ndcg_at_k(preds, k=10)
+    for name, y_pred in models_preds.items():
+        rmse = calculate_rmse(true_rs, y_pred)
+        mae = calculate_mae(true_rs, y_pred)
+        # All ranking metrics for K=5 and K=10 in one grouped pass
+        ranking = ranking_metrics(uids, mids, true_rs, y_pred, ks=(5, 10))
         
         results.append({
             'Model': name,
             'RMSE': rmse,
             'MAE': mae,
-            'Precision@5': p5,
-            'Precision@10': p10,
-            'Recall@5': r5,
-            'Recall@10': r10,
-            'NDCG@5': n5,
-            'NDCG@10': n10
+            'Precision@5': ranking['Precision@5'],
+            'Precision@10': ranking['Precision@10'],
+            'Recall@5': ranking['Recall@5'],
+            'Recall@10': ranking['Recall@10'],
+            'NDCG@5': ranking['NDCG@5'],
+            'NDCG@10': ranking['NDCG@10']
         })
         
     df_results = pd.DataFrame(results)
@@ -202,6 +118,7 @@ def run_full_evaluation():
     
     ## Methodology
     We evaluated four models (CF, CBF, NeuMF, Hybrid) using both accuracy metrics (RMSE, MAE) and ranking metrics (Precision, Recall, NDCG).
+    Hybrid weights (CF, CBF, NeuMF): {hybrid_model.weights.tolist()}
     
     ## Results Summary
     {df_results.to_string()}
@@ -1,22 +1,78 @@
 import numpy as np
+import pandas as pd
 
-def hybrid_recommendation(user_id, movie_id, cf_model, cbf_model, neumf_model, weights=[0.3, 0.3, 0.4]):
+# Ensemble weights for CF, CBF and NeuMF, used unless a bundle has tuned ones
+DEFAULT_WEIGHTS = [0.3, 0.3, 0.4]
+
+class HybridRecommender:
     """
-    Combine predictions from different models.
+    Weighted ensemble of the trained CF, CBF and NeuMF models.
+
+    Scoring is batched: each component scores all (user, movie) pairs in
+    one call, so the same object serves both evaluation and recommendation.
     """
-    # 1. Get CF Prediction
-    cf_pred = cf_model.predict(user_id, movie_id)
-    
-    # 2. Get CBF Prediction (This is tricky as CBF usually ranks items given an item, not user-item rating)
-    # For this hybrid system, we might assume CBF score is based on similarity to user's history
-    # For simplicity here, we'll use a placeholder or assume we have a way to score user-item via CBF
-    cbf_pred = 3.0 # Placeholder
-    
-    # 3. Get NeuMF Prediction
-    # Need to encode IDs first
-    # neumf_pred = neumf_model.predict([encoded_user_id, encoded_movie_id])
-    neumf_pred = 3.0 # Placeholder as we need the encoders here
-    
-    final_score = (weights[0] * cf_pred) + (weights[1] * cbf_pred) + (weights[2] * neumf_pred)
-    return final_score
 
+    def __init__(self, cf_model, cbf_model, neumf_model, user_encoder=None, movie_encoder=None, weights=None):
+        self.cf_model = cf_model
+        self.cbf_model = cbf_model
+        # NeuMF needs the encoders to map raw ids to embedding rows
+        self.neumf_model = neumf_model if user_encoder is not None and movie_encoder is not None else None
+        # LabelEncoder classes are sorted, so a class's position is its code
+        self.user_codes = pd.Index(user_encoder.classes_) if self.neumf_model is not None else None
+        self.movie_codes = pd.Index(movie_encoder.classes_) if self.neumf_model is not None else None
+        self.set_weights(DEFAULT_WEIGHTS if weights is None else weights)
+
+    @classmethod
+    def from_bundle(cls, bundle, weights=None):
+        """Ensemble over a ModelBundle, with its tuned weights (see cross_validation.py) unless given."""
+        if weights is None and bundle.hybrid_weights is not None:
+            weights = bundle.hybrid_weights['weights']
+        return cls(bundle.cf_model, bundle.cbf_model, bundle.neumf_model,
+                   bundle.user_encoder, bundle.movie_encoder, weights)
+
+    def set_weights(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (3,):
+            raise ValueError(f"Expected 3 weights (CF, CBF, NeuMF), got {weights.tolist()}")
+        self.weights = weights
+
+    def component_scores(self, user_ids, movie_ids):
+        """
+        CF, CBF and NeuMF predictions for aligned arrays of raw user and
+        movie ids. Pairs NeuMF cannot encode (unseen user or movie) get the
+        CF prediction in the NeuMF column, as do all pairs when NeuMF was
+        trained on implicit feedback: its scores are interaction
+        probabilities, not ratings, so it only drives candidate retrieval.
+        """
+        user_ids = np.asarray(user_ids)
+        movie_ids = np.asarray(movie_ids)
+        cf_scores = self.cf_model.predict_batch(user_ids, movie_ids)
+        cbf_scores = self.cbf_model.predict_batch(user_ids, movie_ids)
+
+        neumf_scores = cf_scores.copy()
+        if self.neumf_model is not None and self.neumf_model.objective == 'rating':
+            user_encoded = self.user_codes.get_indexer(user_ids)
+            movie_encoded = self.movie_codes.get_indexer(movie_ids)
+            known = (user_encoded >= 0) & (movie_encoded >= 0)
+            if known.any():
+                neumf_scores[known] = self.neumf_model.predict_batch(user_encoded[known], movie_encoded[known])
+
+        return cf_scores, cbf_scores, neumf_scores
+
+    def combine(self, cf_scores, cbf_scores, neumf_scores):
+        """Weighted hybrid score from precomputed component scores."""
+        return self.weights[0] * cf_scores + self.weights[1] * cbf_scores + self.weights[2] * neumf_scores
+
+    def score(self, user_ids, movie_ids):
+        """Weighted hybrid score for aligned arrays of raw user and movie ids."""
+        return self.combine(*self.component_scores(user_ids, movie_ids))
+
+def hybrid_recommendation(user_id, movie_id, cf_model, cbf_model, neumf_model, weights=None,
+                          user_encoder=None, movie_encoder=None):
+    """
+    Combine predictions from different models for a single (user, movie) pair.
+    Without encoders the NeuMF term falls back to the CF prediction.
+    Prefer HybridRecommender.score for more than one pair.
+    """
+    recommender = HybridRecommender(cf_model, cbf_model, neumf_model, user_encoder, movie_encoder, weights)
+    return float(recommender.score([user_id], [movie_id])[0])
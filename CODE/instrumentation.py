@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import random
+import bisect
+import threading
+from contextlib import nullcontext
+
+# Latency histogram buckets in seconds (100us to 10s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Fraction of requests whose stages are timed; 0 turns stage timing off
+SAMPLE_RATE = float(os.environ.get('CINESCOPE_METRICS_SAMPLE', 1.0))
+# Seconds between a worker's metric snapshots in multiprocess mode
+FLUSH_INTERVAL = float(os.environ.get('CINESCOPE_METRICS_FLUSH', 5.0))
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus expects it."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+class Registry:
+    """
+    Named counters and histograms, each keyed by its label values, plus
+    gauges read from callbacks. snapshot() copies them into plain data that
+    other processes can merge (see enable_multiprocess).
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help_text, labels):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is None or key not in family[2]:
+            with self._lock:
+                family = self._families.setdefault(name, (kind, help_text, {}))
+                family[2].setdefault(key, Counter() if kind == 'counter' else Histogram())
+        return family[2][key]
+
+    def counter(self, name, help_text, **labels):
+        return self._get('counter', name, help_text, labels)
+
+    def histogram(self, name, help_text, **labels):
+        return self._get('histogram', name, help_text, labels)
+
+    def gauge(self, name, help_text, fn, merge='sum'):
+        """
+        Gauge whose value is ``fn()`` when collected. Across processes the
+        values of live ones are combined with ``merge`` ('sum' or 'max').
+        """
+        self._gauges[name] = (help_text, fn, merge)
+
+    def reset(self):
+        """Drop every counter and histogram; gauges keep their callbacks."""
+        with self._lock:
+            self._families = {}
+
+    def snapshot(self):
+        """
+        JSON-serializable copy of every metric: name -> {kind, help, series},
+        series being [labels, value] pairs and a histogram value a dict of
+        buckets, counts, sum and count.
+        """
+        with self._lock:
+            families = [(name, kind, help_text, dict(series))
+                        for name, (kind, help_text, series) in self._families.items()]
+        result = {}
+        for name, kind, help_text, series in families:
+            rows = []
+            for key, metric in series.items():
+                if kind == 'counter':
+                    value = metric.value
+                else:
+                    with metric._lock:
+                        value = {'buckets': list(metric.buckets), 'counts': list(metric.counts),
+                                 'sum': metric.sum, 'count': metric.count}
+                rows.append([[list(item) for item in key], value])
+            result[name] = {'kind': kind, 'help': help_text, 'series': rows}
+        for name, (help_text, fn, merge) in list(self._gauges.items()):
+            result[name] = {'kind': 'gauge', 'help': help_text, 'merge': merge, 'series': [[[], fn()]]}
+        return result
+
+    def render(self):
+        """Prometheus text exposition of this process's metrics."""
+        return render_snapshot(self.snapshot())
+
+def merge_snapshots(snapshots):
+    """
+    Combine per-process snapshots: counters and histograms are summed per
+    label set, gauges combined with their merge mode.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            kind = family['kind']
+            target = merged.setdefault(name, dict(family, series={}))
+            for labels, value in family['series']:
+                key = tuple(tuple(item) for item in labels)
+                current = target['series'].get(key)
+                if current is None:
+                    target['series'][key] = dict(value, counts=list(value['counts'])) if kind == 'histogram' else value
+                elif kind == 'histogram':
+                    current['counts'] = [a + b for a, b in zip(current['counts'], value['counts'])]
+                    current['sum'] += value['sum']
+                    current['count'] += value['count']
+                elif family.get('merge') == 'max':
+                    target['series'][key] = max(current, value)
+                else:
+                    target['series'][key] = current + value
+    for family in merged.values():
+        family['series'] = [[[list(item) for item in key], value] for key, value in family['series'].items()]
+    return merged
+
+def render_snapshot(snapshot):
+    """Prometheus text exposition of a snapshot (see Registry.snapshot)."""
+    lines = []
+    for name, family in sorted(snapshot.items()):
+        kind = family['kind']
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(family['series']):
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+            if kind != 'histogram':
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+                continue
+            sep = ',' if labels else ''
+            cumulative = 0
+            for bound, n in zip(value['buckets'] + ['+Inf'], value['counts']):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {value['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REGISTRY = Registry()
+
+# --- Per-request state ---
+class _RequestState(threading.local):
+    # Outside a request (startup, scripts) every stage is recorded
+    sampled = True
+    trace = None
+
+_state = _RequestState()
+
+def begin_request(trace=False, sample_rate=None):
+    """
+    Decide whether this request's stages are timed (sampled, or traced on
+    request) and return its start time for end_request.
+    """
+    rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    _state.sampled = rate >= 1 or (rate > 0 and random.random() < rate)
+    _state.trace = [] if trace else None
+    if _metrics_dir is not None and _flusher_pid != os.getpid():
+        _start_flusher()
+    return time.perf_counter()
+
+def end_request(endpoint, status, start):
+    """Count the request, record its latency if sampled and return its trace (or None)."""
+    REGISTRY.counter('cinescope_requests_total', "Requests served", endpoint=endpoint, status=status).inc()
+    if _state.sampled or _state.trace is not None:
+        REGISTRY.histogram('cinescope_request_seconds', "Request latency",
+                           endpoint=endpoint).observe(time.perf_counter() - start)
+    trace = _state.trace
+    _state.sampled = True
+    _state.trace = None
+    return trace
+
+# --- Stage timing ---
+_NOOP = nullcontext()
+_stage_histograms = {}
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        histogram = _stage_histograms.get(self.name)
+        if histogram is None:
+            histogram = _stage_histograms[self.name] = REGISTRY.histogram(
+                'cinescope_stage_seconds', "Time spent in each hot-path stage", stage=self.name)
+        histogram.observe(elapsed)
+        if _state.trace is not None:
+            _state.trace.append((self.name, elapsed))
+
+def stage(name):
+    """
+    Context manager timing one stage (e.g. 'autocomplete.search') into the
+    cinescope_stage_seconds histogram. A shared no-op when the current
+    request is neither sampled nor traced.
+    """
+    if not _state.sampled and _state.trace is None:
+        return _NOOP
+    return _Stage(name)
+
+def server_timing(trace):
+    """Server-Timing header value for a request trace (durations in ms)."""
+    return ', '.join(f"{name};dur={elapsed * 1000:.3f}" for name, elapsed in trace)
+
+# --- Multiprocess mode ---
+# Under a prefork server each worker has its own REGISTRY, so a scrape would
+# only see whichever worker answered it. In multiprocess mode every process
+# writes its snapshot to <dir>/<pid>.json and render_metrics merges them.
+_metrics_dir = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+def enable_multiprocess(directory):
+    """
+    Share metrics between this process and the workers it forks through
+    ``directory``. Call once in the parent before forking; snapshots left by
+    an earlier run are removed.
+    """
+    global _metrics_dir
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+    _metrics_dir = directory
+
+def write_snapshot():
+    """Write this process's snapshot (a no-op outside multiprocess mode)."""
+    if _metrics_dir is None:
+        return
+    path = os.path.join(_metrics_dir, f"{os.getpid()}.json")
+    with open(path + '.tmp', 'w') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError as e:
+            print(f"Could not write metrics snapshot: {e}")
+
+def _start_flusher():
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def render_metrics():
+    """
+    Prometheus text for every process sharing the metrics directory, or for
+    this process alone outside multiprocess mode. Counters and histograms of
+    exited workers are kept (they are cumulative); their gauges are not.
+    """
+    if _metrics_dir is None:
+        return REGISTRY.render()
+    write_snapshot()
+    snapshots = []
+    for name in os.listdir(_metrics_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(_metrics_dir, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _pid_alive(int(name[:-5])):
+            snapshot = {k: v for k, v in snapshot.items() if v['kind'] != 'gauge'}
+        snapshots.append(snapshot)
+    return render_snapshot(merge_snapshots(snapshots))
+
+def _after_fork_in_child():
+    # The parent's numbers stay in its own snapshot; start from zero so
+    # they are not counted once per worker
+    if _metrics_dir is not None:
+        REGISTRY.reset()
+        _stage_histograms.clear()
+
+os.register_at_fork(before=write_snapshot, after_in_child=_after_fork_in_child)
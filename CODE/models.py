@@ -1,77 +1,275 @@
 import tensorflow as tf
+import numpy as np
 import pandas as pd
+from scipy.sparse import csr_matrix, vstack
 from tensorflow.keras import layers, models, optimizers
 from sklearn.neighbors import NearestNeighbors
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+from similarity import topk_similarity, append_topk
+from data_loader import as_ratings_table
+from neumf_training import fit_neumf_implicit
 
 class CollaborativeFilteringModel:
     def __init__(self, k=20):
         self.k = k
         self.model = NearestNeighbors(n_neighbors=k, algorithm='brute', metric='cosine')
         self.user_item_matrix = None
+        self.user_index = None
+        self.movie_index = None
+        self.user_means = None
+        self.global_mean = 3.0
+        # Neighbor cache: one row of neighbor rows/similarities per user, filled on demand
+        self.neighbors = None
+        self.neighbor_sims = None
+        self.has_neighbors = None
 
-    def train(self, ratings_df):
-        # Create User-Item Matrix
-        self.user_item_matrix = ratings_df.pivot(index='userId', columns='movieId', values='rating').fillna(0)
-        self.model.fit(self.user_item_matrix.values)
+    def train(self, ratings):
+        # Create sparse User-Item Matrix (memory grows with the number of ratings,
+        # not users x movies). Rows/columns follow the encoded ids from
+        # preprocess_features, compacted to the users and movies present here.
+        ratings = as_ratings_table(ratings)
+        user_codes = ratings.user_ids if ratings.user_codes is None else ratings.user_codes
+        movie_codes = ratings.movie_ids if ratings.movie_codes is None else ratings.movie_codes
+        _, user_first, user_rows = np.unique(user_codes, return_index=True, return_inverse=True)
+        _, movie_first, movie_cols = np.unique(movie_codes, return_index=True, return_inverse=True)
+
+        # Rows/columns map back to raw ids through the first occurrence of each code
+        self.fit_matrix(
+            csr_matrix(
+                (ratings.ratings, (user_rows.astype(np.int32), movie_cols.astype(np.int32))),
+                shape=(len(user_first), len(movie_first))
+            ),
+            ratings.user_ids[user_first],
+            ratings.movie_ids[movie_first]
+        )
+
+    def fit_matrix(self, user_item_matrix, user_ids, movie_ids):
+        """
+        Fit on a prebuilt sparse ratings matrix whose rows and columns are
+        user_ids and movie_ids (e.g. from the streaming ratings loader).
+        """
+        self.user_index = pd.Index(user_ids)
+        self.movie_index = pd.Index(movie_ids)
+        self.user_item_matrix = user_item_matrix.astype(np.float32, copy=False).tocsr()
+        self.model.fit(self.user_item_matrix)
+
+        # Per-user mean over rated movies, used for mean-centering
+        counts = np.diff(self.user_item_matrix.indptr)
+        sums = np.asarray(self.user_item_matrix.sum(axis=1)).ravel()
+        self.user_means = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0).astype(np.float32)
+        self.global_mean = float(sums.sum() / max(counts.sum(), 1))
+
+        num_users = self.user_item_matrix.shape[0]
+        k = min(self.k, num_users - 1)
+        self.neighbors = np.full((num_users, k), -1, dtype=np.int32)
+        self.neighbor_sims = np.zeros((num_users, k), dtype=np.float32)
+        self.has_neighbors = np.zeros(num_users, dtype=bool)
+
+    def _get_neighbors(self, user_rows):
+        """
+        Neighbor rows and cosine similarities for each user row (excluding the
+        user itself). Users are queried once and cached for later calls.
+        """
+        k = self.neighbors.shape[1]
+        missing = np.unique(user_rows[~self.has_neighbors[user_rows]])
+        if len(missing) and k > 0:
+            distances, indices = self.model.kneighbors(self.user_item_matrix[missing], n_neighbors=k + 1)
+            # Drop the user itself (or the farthest neighbor if it was not returned)
+            is_self = indices == missing[:, None]
+            is_self[~is_self.any(axis=1), -1] = True
+            self.neighbors[missing] = indices[~is_self].reshape(len(missing), k)
+            self.neighbor_sims[missing] = 1.0 - distances[~is_self].reshape(len(missing), k)
+        self.has_neighbors[missing] = True
+        return self.neighbors[user_rows], self.neighbor_sims[user_rows]
+
+    def precompute_neighbors(self):
+        """Fill the neighbor cache for every user (e.g. before saving artifacts)."""
+        self._get_neighbors(np.arange(self.user_item_matrix.shape[0]))
+
+    def predict_batch(self, user_ids, movie_ids):
+        """
+        Predict ratings for aligned arrays of raw user and movie ids.
+
+        Each prediction is the user's mean rating plus the similarity-weighted
+        mean-centered ratings of the user's neighbors who rated the movie.
+        Unknown users fall back to the global mean, unknown movies (or movies
+        no neighbor rated) to the user's mean.
+        """
+        user_rows = self.user_index.get_indexer(np.asarray(user_ids))
+        movie_cols = self.movie_index.get_indexer(np.asarray(movie_ids))
+
+        preds = np.full(len(user_rows), self.global_mean)
+        known_user = user_rows >= 0
+        preds[known_user] = self.user_means[user_rows[known_user]]
+
+        known = np.flatnonzero(known_user & (movie_cols >= 0))
+        if len(known) == 0 or self.neighbors.shape[1] == 0:
+            return np.clip(preds, 0.5, 5.0)
+
+        rows = user_rows[known]
+        cols = movie_cols[known]
+        neighbors, sims = self._get_neighbors(rows)
+
+        # Neighbor ratings for each (user, movie) pair, gathered from the sparse rows
+        k = neighbors.shape[1]
+        neighbor_ratings = np.asarray(self.user_item_matrix[neighbors.ravel(), np.repeat(cols, k)]).reshape(-1, k)
+        rated = neighbor_ratings > 0
+        deviations = np.where(rated, neighbor_ratings - self.user_means[neighbors], 0.0)
+        numerator = (sims * deviations).sum(axis=1)
+        denominator = (np.abs(sims) * rated).sum(axis=1)
+
+        has_votes = denominator > 0
+        preds[known[has_votes]] += numerator[has_votes] / denominator[has_votes]
+        return np.clip(preds, 0.5, 5.0)
 
     def predict(self, user_id, movie_id):
-        # Simple prediction logic (can be refined)
-        # Here we just return the average rating of neighbors for simplicity in this demo
-        # In a real scenario, we'd query neighbors and aggregate their ratings
-        return 3.0 # Placeholder for actual neighbor aggregation logic
+        return float(self.predict_batch([user_id], [movie_id])[0])
 
 class ContentBasedModel:
-    def __init__(self):
-        self.tfidf = TfidfVectorizer(stop_words='english')
-        self.cosine_sim = None
+    def __init__(self, k=50, chunk_size=512):
+        self.tfidf = TfidfVectorizer(stop_words='english', dtype=np.float32)
+        self.k = k
+        self.chunk_size = chunk_size
+        self.tfidf_matrix = None
+        # Top-K neighbor table: row position -> K most similar row positions
+        self.neighbor_indices = None
+        self.neighbor_scores = None
         self.indices = None
+        # Movie id -> row position
+        self.movie_index = None
+        self.movie_positions = None
+        # User rating profiles over catalog rows, used to score user-movie pairs
+        self.user_index = None
+        self.user_ratings = None
+        self.user_means = None
+        self.global_mean = 3.0
 
-    def train(self, movies_df):
+    def train(self, movies_df, ratings=None):
         # Compute TF-IDF matrix
-        tfidf_matrix = self.tfidf.fit_transform(movies_df['overview'])
-        # Compute Cosine Similarity matrix
+        self.tfidf_matrix = self.tfidf.fit_transform(movies_df['overview'])
+        # Compute the top-K cosine neighbors block by block instead of the full N x N matrix
         # Note: linear_kernel is equivalent to cosine_similarity for normalized vectors (TF-IDF)
-        self.cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
-        self.indices = pd.Series(movies_df.index, index=movies_df['title']).drop_duplicates()
+        self.neighbor_indices, self.neighbor_scores = topk_similarity(
+            self.tfidf_matrix, k=self.k, chunk_size=self.chunk_size
+        )
+        self.index_movies(movies_df)
+        if ratings is not None:
+            self.fit_ratings(ratings)
+
+    def index_movies(self, movies_df):
+        """Title -> row position and movie id -> row position (first occurrence wins)."""
+        indices = pd.Series(np.arange(len(movies_df)), index=movies_df['title'].values)
+        self.indices = indices[~indices.index.duplicated()]
+        ids, first = np.unique(movies_df['id'].values, return_index=True)
+        self.movie_index = pd.Index(ids)
+        self.movie_positions = first.astype(np.int32)
+
+    def add_movies(self, movies_df):
+        """
+        Append movies without refitting: their overviews are vectorized with
+        the frozen vocabulary and IDF weights, and the neighbor table is
+        patched (see append_topk) instead of recomputed. Existing rows keep
+        their positions, so rating profiles only gain empty columns. IDF
+        weights drift as the catalog grows; retrain to refresh them.
+        """
+        num_old = self.tfidf_matrix.shape[0]
+        new_matrix = self.tfidf.transform(movies_df['overview'].fillna(''))
+        self.tfidf_matrix = vstack([self.tfidf_matrix, new_matrix]).tocsr()
+        self.neighbor_indices, self.neighbor_scores = append_topk(
+            self.tfidf_matrix, num_old, self.neighbor_indices, self.neighbor_scores,
+            k=self.k, chunk_size=self.chunk_size
+        )
+
+        # Extend the title and id indexes, first occurrence still winning
+        positions = np.arange(num_old, num_old + len(movies_df))
+        titles = pd.Series(positions, index=movies_df['title'].values)
+        titles = titles[~titles.index.duplicated() & ~titles.index.isin(self.indices.index)]
+        self.indices = pd.concat([self.indices, titles])
+        ids = pd.Series(positions, index=movies_df['id'].values)
+        ids = ids[~ids.index.duplicated() & (self.movie_index.get_indexer(ids.index) < 0)]
+        self.movie_index = self.movie_index.append(ids.index)
+        self.movie_positions = np.concatenate([self.movie_positions, ids.values.astype(np.int32)])
 
-    def get_recommendations(self, title, movies_df):
+        if self.user_ratings is not None:
+            profiles = self.user_ratings
+            self.user_ratings = csr_matrix((profiles.data, profiles.indices, profiles.indptr),
+                                           shape=(profiles.shape[0], self.tfidf_matrix.shape[0]))
+
+    def fit_ratings(self, ratings):
+        """Build sparse user rating profiles (users x catalog rows) from a RatingsTable."""
+        ratings = as_ratings_table(ratings)
+        movie_rows = self.movie_index.get_indexer(ratings.movie_ids)
+        in_catalog = movie_rows >= 0
+        user_ids, user_rows = np.unique(ratings.user_ids[in_catalog], return_inverse=True)
+
+        self.user_index = pd.Index(user_ids)
+        self.user_ratings = csr_matrix(
+            (ratings.ratings[in_catalog], (user_rows.astype(np.int32), self.movie_positions[movie_rows[in_catalog]])),
+            shape=(len(user_ids), self.tfidf_matrix.shape[0])
+        )
+        counts = np.diff(self.user_ratings.indptr)
+        sums = np.asarray(self.user_ratings.sum(axis=1)).ravel()
+        self.user_means = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0).astype(np.float32)
+        self.global_mean = float(sums.sum() / max(counts.sum(), 1))
+
+    def get_recommendations(self, title, movies_df, n=10):
         if title not in self.indices:
             return []
         idx = self.indices[title]
-        sim_scores = list(enumerate(self.cosine_sim[idx]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-        sim_scores = sim_scores[1:11]
-        movie_indices = [i[0] for i in sim_scores]
+        movie_indices = self.neighbor_indices[idx, :n]
         return movies_df['title'].iloc[movie_indices]
 
-    def predict(self, user_id, movie_id, ratings_df):
+    def predict_batch(self, user_ids, movie_ids):
+        """
+        Predict ratings for aligned arrays of raw user and movie ids.
+
+        Each prediction is the similarity-weighted average of the user's
+        ratings on the movie's top-K content neighbors. Unknown users fall
+        back to the global mean, unknown movies (or movies with no rated
+        neighbors) to the user's mean.
+        """
+        user_rows = self.user_index.get_indexer(np.asarray(user_ids))
+        movie_rows = self.movie_index.get_indexer(np.asarray(movie_ids))
+
+        preds = np.full(len(user_rows), self.global_mean)
+        known_user = user_rows >= 0
+        preds[known_user] = self.user_means[user_rows[known_user]]
+
+        known = np.flatnonzero(known_user & (movie_rows >= 0))
+        if len(known) == 0 or self.neighbor_indices.shape[1] == 0:
+            return preds
+
+        positions = self.movie_positions[movie_rows[known]]
+        neighbors = self.neighbor_indices[positions]
+        sims = self.neighbor_scores[positions]
+
+        # The user's ratings of each neighbor, gathered from the sparse profiles
+        k = neighbors.shape[1]
+        neighbor_ratings = np.asarray(
+            self.user_ratings[np.repeat(user_rows[known], k), neighbors.ravel()]
+        ).reshape(-1, k)
+        weights = np.where((neighbor_ratings > 0) & (sims > 0), sims, 0.0)
+        numerator = (weights * neighbor_ratings).sum(axis=1)
+        denominator = weights.sum(axis=1)
+
+        has_votes = denominator > 0
+        preds[known[has_votes]] = numerator[has_votes] / denominator[has_votes]
+        return preds
+
+    def predict(self, user_id, movie_id, ratings=None):
         # Predict rating based on weighted average of similar movies the user has rated
-        if movie_id not in self.indices:
-            return 2.5 # Default if movie not found
-            
-        # Get movies user has rated
-        user_ratings = ratings_df[ratings_df['userId'] == user_id]
-        if user_ratings.empty:
-            return 2.5
-            
-        idx = self.indices.get(self.indices.index[self.indices == movie_id][0]) if movie_id in self.indices.values else None
-        # The above line is tricky because self.indices maps Title -> Index. 
-        # But we have Movie ID. We need a map ID -> Index.
-        # Let's assume we can get the title or map ID to Index directly.
-        # For simplicity in this demo, let's assume we can't easily do this efficiently 
-        # without refactoring the whole class to map ID -> Index.
-        
-        # Simplified approach: Return a random score or average for demo purposes 
-        # if we can't easily link ID -> Content Features in this specific class structure.
-        # BUT, we want a "working" system.
-        # Let's just return a placeholder that "works" for the evaluation script structure.
-        return 3.0
+        if self.user_ratings is None and ratings is not None:
+            self.fit_ratings(ratings)
+        return float(self.predict_batch([user_id], [movie_id])[0])
 
 class NeuMFModel(tf.keras.Model):
+    # Outputs are sigmoid * output_scale: a rating for the 'rating' objective,
+    # a scaled interaction probability for 'implicit' (ranking only, see HybridRecommender)
+    output_scale = 5.0
+
     def __init__(self, num_users, num_items, embedding_size=50):
         super(NeuMFModel, self).__init__()
+        self.objective = 'rating'
         self.user_embedding = layers.Embedding(num_users, embedding_size, name='user_embedding')
         self.item_embedding = layers.Embedding(num_items, embedding_size, name='item_embedding')
         self.flatten = layers.Flatten()
@@ -86,9 +284,33 @@ class NeuMFModel(tf.keras.Model):
         
         user_vec = self.flatten(self.user_embedding(user_input))
         item_vec = self.flatten(self.item_embedding(item_input))
-        
+        return self.score_vectors(user_vec, item_vec)
+
+    def score_vectors(self, user_vec, item_vec):
+        """MLP on already looked-up user and item embedding vectors."""
         concat = self.concat([user_vec, item_vec])
         x = self.dense1(concat)
         x = self.dense2(x)
-        return self.output_layer(x) * 5.0 # Scale to 0-5 range
+        return self.output_layer(x) * self.output_scale # Scale to 0-5 range
+
+    def fit_implicit(self, user_ids, item_ids, loss='bce', negatives=4, **kwargs):
+        """Train on observed pairs with sampled negatives (see neumf_training.fit_neumf_implicit)."""
+        return fit_neumf_implicit(self, user_ids, item_ids, loss=loss, negatives=negatives, **kwargs)
+
+    @tf.function(
+        input_signature=[tf.TensorSpec([None], tf.int32), tf.TensorSpec([None], tf.int32)],
+        reduce_retracing=True,
+    )
+    def predict_step_compiled(self, user_ids, item_ids):
+        # Traced once for any batch length, so repeated calls skip Keras predict() overhead
+        return tf.reshape(self([user_ids, item_ids], training=False), [-1])
 
+    def predict_batch(self, user_ids, item_ids, batch_size=65536):
+        """Predicted ratings for aligned arrays of encoded user and item ids."""
+        user_ids = np.asarray(user_ids, dtype=np.int32)
+        item_ids = np.asarray(item_ids, dtype=np.int32)
+        preds = np.empty(len(user_ids), dtype=np.float32)
+        for start in range(0, len(user_ids), batch_size):
+            end = start + batch_size
+            preds[start:end] = self.predict_step_compiled(user_ids[start:end], item_ids[start:end]).numpy()
+        return preds
@@ -0,0 +1,239 @@
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+DEFAULT_BATCH_SIZE = 1024
+CHECKPOINT_FILE = 'neumf_best.weights.h5'
+
+def split_holdout(num_rows, validation_split=0.2, seed=42):
+    """
+    Random train/validation row indices. Unlike Keras' validation_split,
+    which takes the last rows, this does not hold out whole users when the
+    ratings are sorted by user.
+    """
+    order = np.random.default_rng(seed).permutation(num_rows).astype(np.int32)
+    num_val = int(num_rows * validation_split)
+    return np.sort(order[num_val:]), np.sort(order[:num_val])
+
+def make_dataset(user_ids, item_ids, labels, batch_size=DEFAULT_BATCH_SIZE, epochs=1, shuffle=True, seed=42):
+    """
+    tf.data pipeline over aligned id/label arrays.
+
+    The arrays are held once as tensors; each epoch draws a fresh
+    permutation with a single shuffle op, slices it into batches of
+    indices and gathers the batches in a parallel map, with prefetching so
+    the next batches are ready while the model trains on the current one.
+    Yields ((user_ids, item_ids), labels) batches for ``epochs`` epochs.
+    """
+    users = tf.convert_to_tensor(np.asarray(user_ids, dtype=np.int32))
+    items = tf.convert_to_tensor(np.asarray(item_ids, dtype=np.int32))
+    targets = tf.convert_to_tensor(np.asarray(labels, dtype=np.float32))
+    num_rows = int(users.shape[0])
+    num_batches = -(-num_rows // batch_size)
+
+    def epoch_indices(epoch):
+        if shuffle:
+            indices = tf.random.experimental.stateless_shuffle(
+                tf.range(num_rows, dtype=tf.int32), seed=tf.stack([tf.constant(seed, tf.int64), epoch]))
+        else:
+            indices = tf.range(num_rows, dtype=tf.int32)
+        return tf.data.Dataset.range(num_batches).map(
+            lambda b: indices[b * batch_size:(b + 1) * batch_size])
+
+    def gather(batch):
+        return (tf.gather(users, batch), tf.gather(items, batch)), tf.gather(targets, batch)
+
+    return (tf.data.Dataset.range(epochs)
+            .flat_map(epoch_indices)
+            .map(gather, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Reports training samples/sec for each epoch (also added to the history)."""
+
+    def __init__(self, num_samples, verbose=1):
+        super().__init__()
+        self.num_samples = num_samples
+        self.verbose = verbose
+        self.epoch_start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        rate = self.num_samples / (time.perf_counter() - self.epoch_start)
+        if logs is not None:
+            logs['samples_per_sec'] = rate
+        if self.verbose:
+            print(f"Epoch {epoch + 1}: {rate:,.0f} samples/sec")
+
+def fit_neumf(model, user_ids, item_ids, labels, epochs=5, batch_size=DEFAULT_BATCH_SIZE,
+              validation_split=0.2, patience=2, checkpoint_dir=None, seed=42, verbose=1):
+    """
+    Train a compiled NeuMFModel through the tf.data pipeline.
+
+    A random validation_split of the rows is held out; training stops early
+    when validation loss has not improved for ``patience`` epochs and the
+    best weights are restored. With checkpoint_dir, the best weights so far
+    are also written there after each improving epoch. Returns the Keras
+    History (with samples_per_sec per epoch).
+    """
+    user_ids = np.asarray(user_ids)
+    item_ids = np.asarray(item_ids)
+    labels = np.asarray(labels)
+    train_idx, val_idx = split_holdout(len(labels), validation_split, seed)
+
+    train_ds = make_dataset(user_ids[train_idx], item_ids[train_idx], labels[train_idx],
+                            batch_size, epochs=epochs, seed=seed)
+    steps_per_epoch = -(-len(train_idx) // batch_size)
+
+    callbacks = [ThroughputCallback(len(train_idx), verbose)]
+    val_ds = None
+    validation_steps = None
+    if len(val_idx):
+        val_ds = make_dataset(user_ids[val_idx], item_ids[val_idx], labels[val_idx],
+                              batch_size, epochs=epochs, shuffle=False)
+        validation_steps = -(-len(val_idx) // batch_size)
+        callbacks.append(tf.keras.callbacks.EarlyStopping(
+            monitor='val_loss', patience=patience, restore_best_weights=True, verbose=verbose))
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            callbacks.append(tf.keras.callbacks.ModelCheckpoint(
+                os.path.join(checkpoint_dir, CHECKPOINT_FILE), monitor='val_loss',
+                save_best_only=True, save_weights_only=True, verbose=verbose))
+
+    # The pipeline already shuffles and spans all epochs, so Keras must not
+    # reshuffle or restart it
+    return model.fit(train_ds, epochs=epochs, steps_per_epoch=steps_per_epoch, shuffle=False,
+                     validation_data=val_ds, validation_steps=validation_steps,
+                     callbacks=callbacks, verbose=verbose)
+
+# --- Implicit feedback (negative sampling) ---
+IMPLICIT_LOSSES = ('bce', 'bpr')
+# Rejection-sampling rounds for negatives that hit an observed pair; any
+# still colliding afterwards are masked out of the loss
+NEGATIVE_ROUNDS = 4
+# Default epochs per NeuMF objective (rating training also stops early)
+DEFAULT_EPOCHS = {'rating': 20, 'implicit': 5}
+
+def positive_keys(user_ids, item_ids, num_items):
+    """Sorted unique int64 keys user * num_items + item of the observed pairs."""
+    return np.unique(np.asarray(user_ids, dtype=np.int64) * num_items + np.asarray(item_ids, dtype=np.int64))
+
+def make_implicit_dataset(user_ids, item_ids, num_items, negatives=4, batch_size=DEFAULT_BATCH_SIZE,
+                          epochs=1, seed=42):
+    """
+    tf.data pipeline of positives with negatives sampled on the fly.
+
+    Each batch of observed (user, item) pairs gets ``negatives`` uniformly
+    drawn items per positive. Draws that are observed pairs are found with a
+    hash-table lookup of their user * num_items + item key (much cheaper than
+    a binary search over millions of keys) and redrawn, all as batched tensor
+    ops inside the parallel map, so sampling scales with the batch rather
+    than with per-user Python loops. Yields
+    ((users, positive_items, negative_items[B, negatives]), mask[B, negatives]).
+    """
+    keys = tf.convert_to_tensor(positive_keys(user_ids, item_ids, num_items))
+    observed = tf.lookup.StaticHashTable(
+        tf.lookup.KeyValueTensorInitializer(keys, tf.ones_like(keys, dtype=tf.int32)), default_value=0)
+    users = tf.convert_to_tensor(np.asarray(user_ids, dtype=np.int32))
+    items = tf.convert_to_tensor(np.asarray(item_ids, dtype=np.int32))
+    num_rows = int(users.shape[0])
+    num_batches = -(-num_rows // batch_size)
+
+    def epoch_batches(epoch):
+        indices = tf.random.experimental.stateless_shuffle(
+            tf.range(num_rows, dtype=tf.int32), seed=tf.stack([tf.constant(seed, tf.int64), epoch]))
+        return tf.data.Dataset.range(num_batches).map(
+            lambda b: (indices[b * batch_size:(b + 1) * batch_size], tf.stack([seed + epoch, b])))
+
+    def is_positive(batch_users, candidates):
+        query = tf.cast(batch_users, tf.int64) * num_items + tf.cast(candidates, tf.int64)
+        return observed.lookup(query) > 0
+
+    def sample(batch, batch_seed):
+        batch_users = tf.gather(users, batch)
+        repeated = tf.repeat(batch_users, negatives)
+        seeds = tf.random.experimental.stateless_split(batch_seed, NEGATIVE_ROUNDS + 1)
+        shape = tf.shape(repeated)
+        candidates = tf.random.stateless_uniform(shape, seeds[0], 0, num_items, dtype=tf.int32)
+        for r in range(NEGATIVE_ROUNDS):
+            redraw = tf.random.stateless_uniform(shape, seeds[r + 1], 0, num_items, dtype=tf.int32)
+            candidates = tf.where(is_positive(repeated, candidates), redraw, candidates)
+        mask = tf.cast(tf.logical_not(is_positive(repeated, candidates)), tf.float32)
+        return ((batch_users, tf.gather(items, batch), tf.reshape(candidates, [-1, negatives])),
+                tf.reshape(mask, [-1, negatives]))
+
+    return (tf.data.Dataset.range(epochs)
+            .flat_map(epoch_batches)
+            .map(sample, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))
+
+def _logit(prob):
+    prob = tf.clip_by_value(prob, 1e-7, 1 - 1e-7)
+    return tf.math.log(prob) - tf.math.log1p(-prob)
+
+def implicit_loss(loss, pos_prob, neg_prob, mask):
+    """
+    Binary cross-entropy over positives and negatives, or BPR over
+    (positive, negative) pairs. Probabilities are the model output divided
+    by its output scale; masked negatives do not count.
+    """
+    if loss == 'bpr':
+        diff = _logit(pos_prob)[:, None] - _logit(neg_prob)
+        return -tf.reduce_sum(tf.math.log_sigmoid(diff) * mask) / tf.maximum(tf.reduce_sum(mask), 1.0)
+    pos_prob = tf.clip_by_value(pos_prob, 1e-7, 1 - 1e-7)
+    neg_prob = tf.clip_by_value(neg_prob, 1e-7, 1 - 1e-7)
+    total = -tf.reduce_sum(tf.math.log(pos_prob)) - tf.reduce_sum(tf.math.log1p(-neg_prob) * mask)
+    return total / (tf.cast(tf.size(pos_prob), tf.float32) + tf.reduce_sum(mask))
+
+def fit_neumf_implicit(model, user_ids, item_ids, loss='bce', negatives=4, epochs=DEFAULT_EPOCHS['implicit'],
+                       batch_size=DEFAULT_BATCH_SIZE, learning_rate=1e-3, seed=42, verbose=1):
+    """
+    Train NeuMF on implicit feedback: every observed (user, item) pair is a
+    positive and ``negatives`` unobserved items per positive are sampled
+    each epoch. ``loss`` is 'bce' or 'bpr'. Afterwards the model output is
+    output_scale times the predicted interaction probability, so it ranks
+    the whole catalog. Returns a history dict of per-epoch loss and
+    samples/sec (positives plus negatives).
+    """
+    if loss not in IMPLICIT_LOSSES:
+        raise ValueError(f"Unknown implicit loss '{loss}', expected one of {IMPLICIT_LOSSES}")
+    num_items = model.item_embedding.input_dim
+    dataset = make_implicit_dataset(user_ids, item_ids, num_items, negatives, batch_size, epochs, seed)
+    steps_per_epoch = -(-len(user_ids) // batch_size)
+    samples_per_epoch = len(user_ids) * (1 + negatives)
+
+    # Create the variables eagerly before tracing the training step
+    model([np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int32)])
+    optimizer = tf.keras.optimizers.Adam(learning_rate)
+    scale = model.output_scale
+
+    @tf.function(reduce_retracing=True)
+    def train_step(users, pos_items, neg_items, mask):
+        with tf.GradientTape() as tape:
+            pos_prob = tf.reshape(model([users, pos_items], training=True), [-1]) / scale
+            neg_prob = tf.reshape(
+                model([tf.repeat(users, negatives), tf.reshape(neg_items, [-1])], training=True),
+                tf.shape(neg_items)) / scale
+            value = implicit_loss(loss, pos_prob, neg_prob, mask)
+        grads = tape.gradient(value, model.trainable_variables)
+        optimizer.apply_gradients(zip(grads, model.trainable_variables))
+        return value
+
+    history = {'loss': [], 'samples_per_sec': []}
+    batches = iter(dataset)
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        total = 0.0
+        for _ in range(steps_per_epoch):
+            (users, pos_items, neg_items), mask = next(batches)
+            total += float(train_step(users, pos_items, neg_items, mask))
+        rate = samples_per_epoch / (time.perf_counter() - start)
+        history['loss'].append(total / steps_per_epoch)
+        history['samples_per_sec'].append(rate)
+        if verbose:
+            print(f"Epoch {epoch + 1}/{epochs} - {loss} loss: {total / steps_per_epoch:.4f} - {rate:,.0f} samples/sec")
+    model.objective = 'implicit'
+    return history
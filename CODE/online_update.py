@@ -0,0 +1,392 @@
+import os
+import copy
+import sqlite3
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from scipy.sparse import csr_matrix
+from models import NeuMFModel
+
+# Gradient steps and learning rate for fine-tuning updated users' NeuMF embeddings
+FINE_TUNE_STEPS = 20
+FINE_TUNE_LR = 0.1
+# Negatives per positive when fine-tuning an implicit-feedback NeuMF
+FINE_TUNE_NEGATIVES = 4
+# Share of a user's fine-tuning loss given to their new ratings; the rest
+# goes to their earlier ones, so an update shifts the embedding instead of
+# overwriting it
+NEW_RATINGS_WEIGHT = 0.3
+# Accepted rating range; events outside it are dropped
+MIN_RATING = 0.5
+MAX_RATING = 5.0
+# Ids are stored as int32 (see data_loader.RatingsTable); larger ones are dropped
+MIN_ID = np.iinfo(np.int32).min
+MAX_ID = np.iinfo(np.int32).max
+
+def merge_ratings(matrix, rows, cols, values, shape):
+    """
+    CSR ``matrix`` grown to ``shape`` with the (row, col) entries set to
+    ``values``: new pairs are inserted, rated pairs overwritten (later
+    duplicates win). Runs as a few sparse operations, linear in the
+    number of stored ratings.
+    """
+    updates = pd.DataFrame({'row': rows, 'col': cols, 'value': values}).drop_duplicates(['row', 'col'], keep='last')
+    indptr = np.concatenate([matrix.indptr, np.full(shape[0] - matrix.shape[0], matrix.indptr[-1])])
+    grown = csr_matrix((matrix.data, matrix.indices, indptr), shape=shape)
+    update_matrix = csr_matrix((updates['value'].values.astype(np.float32), (updates['row'].values, updates['col'].values)),
+                               shape=shape)
+    mask = update_matrix.copy()
+    mask.data[:] = 1
+    merged = (grown - grown.multiply(mask) + update_matrix).tocsr()
+    merged.eliminate_zeros()
+    return merged.astype(np.float32)
+
+def _numeric(values):
+    """float64 array of ``values``, NaN where a value is not a number or is a bool."""
+    values = pd.Series(np.asarray(values, dtype=object))
+    values[values.map(lambda v: isinstance(v, (bool, np.bool_)))] = np.nan
+    return pd.to_numeric(values, errors='coerce').to_numpy(np.float64)
+
+def clean_events(user_ids, movie_ids, ratings):
+    """
+    Rating events as int64 user and movie ids and float32 ratings, without
+    the events whose ids are not integers in [MIN_ID, MAX_ID] or whose
+    rating is not a number in [MIN_RATING, MAX_RATING]. Returns (user_ids,
+    movie_ids, ratings, mask of the events kept).
+    """
+    users, movies, values = _numeric(user_ids), _numeric(movie_ids), _numeric(ratings)
+    with np.errstate(invalid='ignore'):
+        valid = ((np.floor(users) == users) & (np.floor(movies) == movies)
+                 & np.isfinite(users) & np.isfinite(movies)
+                 & (users >= MIN_ID) & (users <= MAX_ID) & (movies >= MIN_ID) & (movies <= MAX_ID)
+                 & (values >= MIN_RATING) & (values <= MAX_RATING))
+    return (users[valid].astype(np.int64), movies[valid].astype(np.int64),
+            values[valid].astype(np.float32), valid)
+
+def _row_means(matrix, rows, means):
+    """Copy of ``means`` (grown to the matrix height) with ``rows`` recomputed."""
+    grown = np.zeros(matrix.shape[0], dtype=np.float32)
+    grown[:len(means)] = means
+    counts = np.diff(matrix.indptr)[rows]
+    sums = np.asarray(matrix[rows].sum(axis=1)).ravel()
+    grown[rows] = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+    return grown
+
+def _append(index, ids):
+    """pd.Index with the ids it does not contain yet appended, in order of first appearance."""
+    new_ids = pd.unique(np.asarray(ids)[index.get_indexer(ids) < 0])
+    return index.append(pd.Index(new_ids)) if len(new_ids) else index
+
+def _copy_bundle(bundle):
+    """
+    Copy of ``bundle`` with its own model, encoder and neighbor-search
+    objects, so an update can rebind their attributes while readers keep
+    using the original. Arrays are shared, as updates replace them instead
+    of writing into them.
+    """
+    new = copy.copy(bundle)
+    new.cf_model = copy.copy(bundle.cf_model)
+    new.cf_model.model = copy.copy(bundle.cf_model.model)
+    new.cbf_model = copy.copy(bundle.cbf_model)
+    new.user_encoder = copy.copy(bundle.user_encoder)
+    new.movie_encoder = copy.copy(bundle.movie_encoder)
+    return new
+
+class OnlineUpdater:
+    """
+    Applies new (user, movie, rating) events to a loaded ModelBundle
+    without retraining:
+
+    - CF: ratings are merged into the sparse user-item matrix (new users
+      and movies add rows/columns) and only the updated users' neighbor
+      lists and means are recomputed
+    - CBF: the updated users' rating profiles and means are rebuilt
+    - NeuMF: unseen ids grow the encoders and embedding tables, then the
+      updated users' embeddings get a few gradient steps on their new and
+      earlier ratings with the rest of the network frozen
+
+    Each batch is applied to a copy of the bundle (the NeuMF network
+    included), which then replaces ``self.bundle`` in one step, so the
+    previous bundle stays consistent for whoever is still scoring with it.
+
+    Grown encoders keep existing codes, so new ids are appended and
+    classes_ is no longer sorted; look codes up with pd.Index, as the
+    serving code does. Other users' neighbor lists and the item index go
+    stale until compact().
+    """
+
+    def __init__(self, bundle, fine_tune_steps=FINE_TUNE_STEPS, learning_rate=FINE_TUNE_LR, seed=42):
+        self.bundle = bundle
+        self.fine_tune_steps = fine_tune_steps
+        self.learning_rate = learning_rate
+        self.rng = np.random.default_rng(seed)
+        self.num_applied = 0
+        self._lock = threading.Lock()
+
+    def apply(self, user_ids, movie_ids, ratings):
+        """
+        Apply a batch of rating events to a copy of the bundle and make it
+        ``self.bundle``; returns the number of users updated. Malformed
+        events (see clean_events) are skipped.
+        """
+        user_ids, movie_ids, ratings, valid = clean_events(user_ids, movie_ids, ratings)
+        if not valid.all():
+            print(f"Skipping {int((~valid).sum())} malformed rating events")
+        if len(user_ids) == 0:
+            return 0
+        with self._lock:
+            bundle = _copy_bundle(self.bundle)
+            self._update_cf(bundle, user_ids, movie_ids, ratings)
+            self._update_cbf(bundle, user_ids, movie_ids, ratings)
+            if bundle.neumf_model is not None:
+                self._update_neumf(bundle, user_ids, movie_ids, ratings)
+            self.bundle = bundle
+            self.num_applied += len(user_ids)
+        return len(np.unique(user_ids))
+
+    # --- CF ---
+    def _update_cf(self, bundle, user_ids, movie_ids, ratings):
+        cf = bundle.cf_model
+        user_index = _append(cf.user_index, user_ids)
+        movie_index = _append(cf.movie_index, movie_ids)
+        rows = user_index.get_indexer(user_ids)
+        matrix = merge_ratings(cf.user_item_matrix, rows, movie_index.get_indexer(movie_ids), ratings,
+                               (len(user_index), len(movie_index)))
+        touched = np.unique(rows)
+
+        old_users, k = cf.neighbors.shape
+        neighbors = np.full((len(user_index), k), -1, dtype=np.int32)
+        neighbor_sims = np.zeros((len(user_index), k), dtype=np.float32)
+        has_neighbors = np.zeros(len(user_index), dtype=bool)
+        # Readers still fill the original's neighbor cache, flag last, so
+        # take the flags first: a flagged row has already been written
+        has_neighbors[:old_users] = cf.has_neighbors
+        neighbors[:old_users] = cf.neighbors
+        neighbor_sims[:old_users] = cf.neighbor_sims
+        has_neighbors[touched] = False
+
+        cf.user_item_matrix = matrix
+        cf.model.fit(matrix)
+        cf.user_means = _row_means(matrix, touched, cf.user_means)
+        cf.global_mean = float(matrix.data.sum() / max(matrix.nnz, 1))
+        cf.neighbors, cf.neighbor_sims, cf.has_neighbors = neighbors, neighbor_sims, has_neighbors
+        cf.movie_index = movie_index
+        cf.user_index = user_index
+        cf._get_neighbors(touched)
+
+    # --- CBF ---
+    def _update_cbf(self, bundle, user_ids, movie_ids, ratings):
+        cbf = bundle.cbf_model
+        movie_rows = cbf.movie_index.get_indexer(movie_ids)
+        in_catalog = movie_rows >= 0
+        if not in_catalog.any():
+            return
+        user_ids = user_ids[in_catalog]
+        user_index = _append(cbf.user_index, user_ids)
+        rows = user_index.get_indexer(user_ids)
+        profiles = merge_ratings(cbf.user_ratings, rows, cbf.movie_positions[movie_rows[in_catalog]],
+                                 ratings[in_catalog], (len(user_index), cbf.user_ratings.shape[1]))
+        cbf.user_ratings = profiles
+        cbf.user_means = _row_means(profiles, np.unique(rows), cbf.user_means)
+        cbf.global_mean = float(profiles.data.sum() / max(profiles.nnz, 1))
+        cbf.user_index = user_index
+
+    # --- NeuMF ---
+    def _grow_encoders(self, bundle, user_ids, movie_ids):
+        """Append unseen ids to the encoders; returns (old, new) table sizes."""
+        sizes = []
+        for encoder, ids in [(bundle.user_encoder, user_ids), (bundle.movie_encoder, movie_ids)]:
+            old = len(encoder.classes_)
+            encoder.classes_ = _append(pd.Index(encoder.classes_), ids).values
+            sizes.append((old, len(encoder.classes_)))
+        return sizes
+
+    def _grow_neumf(self, old, num_users, num_items):
+        """Copy of the NeuMF model ``old`` with embedding tables grown to the given sizes."""
+        model = NeuMFModel(num_users, num_items, embedding_size=old.user_embedding.output_dim)
+        model.objective = old.objective
+        model([np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int32)])
+        model.dense1.set_weights(old.dense1.get_weights())
+        model.dense2.set_weights(old.dense2.get_weights())
+        model.output_layer.set_weights(old.output_layer.get_weights())
+        for new_layer, old_layer in [(model.user_embedding, old.user_embedding), (model.item_embedding, old.item_embedding)]:
+            table = old_layer.embeddings.numpy()
+            # New rows start at the mean embedding: an average user / item
+            extra = np.repeat(table.mean(axis=0, keepdims=True), new_layer.input_dim - len(table), axis=0)
+            new_layer.embeddings.assign(np.concatenate([table, extra]))
+        return model
+
+    def _update_neumf(self, bundle, user_ids, movie_ids, ratings):
+        (_, num_users), (_, num_items) = self._grow_encoders(bundle, user_ids, movie_ids)
+        # Fine-tuning writes into the embedding table, so work on a copy
+        model = self._grow_neumf(bundle.neumf_model, num_users, num_items)
+
+        # Fine-tune on the new events plus each user's full history from the
+        # merged CF matrix, weighted NEW_RATINGS_WEIGHT to the rest
+        cf = bundle.cf_model
+        movie_codes = pd.Index(bundle.movie_encoder.classes_)
+        users, positions = np.unique(user_ids, return_inverse=True)
+        history = cf.user_item_matrix[cf.user_index.get_indexer(users)].tocoo()
+        history_items = movie_codes.get_indexer(cf.movie_index.values[history.col])
+        known = history_items >= 0
+        history_positions = history.row[known]
+        new_weights = NEW_RATINGS_WEIGHT / np.bincount(positions, minlength=len(users))[positions]
+        history_weights = (1 - NEW_RATINGS_WEIGHT) / np.maximum(np.bincount(history_positions, minlength=len(users)), 1)[history_positions]
+        self.fine_tune_users(model, pd.Index(bundle.user_encoder.classes_).get_indexer(users),
+                             np.concatenate([positions, history_positions]),
+                             np.concatenate([movie_codes.get_indexer(movie_ids), history_items[known]]),
+                             np.concatenate([ratings, history.data[known]]),
+                             np.concatenate([new_weights, history_weights]))
+        bundle.neumf_model = model
+
+    def fine_tune_users(self, model, user_codes, positions, item_codes, ratings, weights=None):
+        """
+        Gradient steps on the embeddings of ``user_codes`` only, against
+        their (position into user_codes, item code, rating) examples. The
+        loss is a weighted sum of example losses, by default each user's
+        mean loss, so a user's step size does not depend on who else is in
+        the batch. Returns the final loss per user.
+        """
+        positions = np.asarray(positions, dtype=np.int32)
+        item_codes = np.asarray(item_codes, dtype=np.int32)
+        labels = np.asarray(ratings, dtype=np.float32)
+        if weights is None:
+            weights = 1.0 / np.bincount(positions, minlength=len(user_codes))[positions]
+        weights = np.asarray(weights, dtype=np.float32)
+        if model.objective == 'implicit':
+            # Rated items as positives against uniformly sampled negatives
+            num_neg = len(positions) * FINE_TUNE_NEGATIVES
+            positions = np.concatenate([positions, np.repeat(positions, FINE_TUNE_NEGATIVES)])
+            item_codes = np.concatenate([item_codes, self.rng.integers(0, model.item_embedding.input_dim, num_neg).astype(np.int32)])
+            labels = np.concatenate([np.ones(len(labels), np.float32), np.zeros(num_neg, np.float32)])
+            # Negatives share their positive's weight
+            weights = np.concatenate([weights, np.repeat(weights, FINE_TUNE_NEGATIVES)])
+
+        table = model.user_embedding.embeddings
+        user_vectors = tf.Variable(tf.gather(table, user_codes))
+        item_vectors = tf.gather(model.item_embedding.embeddings, item_codes)
+        for _ in range(self.fine_tune_steps):
+            with tf.GradientTape() as tape:
+                preds = tf.reshape(model.score_vectors(tf.gather(user_vectors, positions), item_vectors), [-1])
+                if model.objective == 'implicit':
+                    probs = tf.clip_by_value(preds / model.output_scale, 1e-7, 1 - 1e-7)
+                    losses = -(labels * tf.math.log(probs) + (1 - labels) * tf.math.log(1 - probs))
+                else:
+                    losses = tf.square(preds - labels)
+                loss = tf.reduce_sum(weights * losses)
+            # Gradients through tf.gather come back as IndexedSlices
+            user_vectors.assign_sub(self.learning_rate * tf.convert_to_tensor(tape.gradient(loss, user_vectors)))
+        table.assign(tf.tensor_scatter_nd_update(table, np.asarray(user_codes)[:, None], user_vectors))
+        return float(loss) / len(user_codes)
+
+    # --- Catalog ---
+    def add_movies(self, movies_df):
+        """
+        Append new movies (id, title, overview columns) to the catalog
+        without retraining: CBF vectorizes them with its frozen vocabulary
+        and patches its neighbor table. CF and NeuMF pick them up with their
+        first ratings. Returns the number of movies added. Raises ValueError
+        if an id is not an integer. Follow with compact() to save them.
+        """
+        bundle = self.bundle
+        # Integer ids, like the rest of the catalog, so the bundle still saves
+        movies_df = movies_df.assign(id=movies_df['id'].astype(np.int64))
+        with self._lock:
+            new_movies = movies_df[bundle.cbf_model.movie_index.get_indexer(movies_df['id'].values) < 0]
+            if len(new_movies) == 0:
+                return 0
+            bundle.cbf_model.add_movies(new_movies)
+            bundle.movies = pd.concat([bundle.movies, new_movies[['id', 'title']]], ignore_index=True)
+            titles = pd.Series(new_movies['title'].values, index=new_movies['id'].values)
+            bundle.titles = pd.concat([bundle.titles, titles[~titles.index.duplicated()]])
+        return len(new_movies)
+
+    # --- Compaction ---
+    def compact(self, artifact_root=None, extra_manifest=None):
+        """
+        Refresh every user's CF neighbors and the NeuMF item index, and save
+        the updated models as a new artifact bundle, so restarts start from
+        the updated state instead of replaying events. Raises ValueError,
+        saving nothing, if an encoder holds non-integer ids.
+        """
+        from artifacts import save_artifacts, DEFAULT_ARTIFACT_DIR
+
+        with self._lock:
+            bundle = self.bundle
+            # Saved encoders must stay memory-mappable for load_artifacts
+            for name, encoder in [('user', bundle.user_encoder), ('movie', bundle.movie_encoder)]:
+                dtype = np.asarray(encoder.classes_).dtype
+                if dtype.kind not in 'iu':
+                    raise ValueError(f"{name} encoder holds {dtype} ids, expected integers; bundle not saved")
+            bundle = _copy_bundle(bundle)
+            cf = bundle.cf_model
+            # Loaded bundles memory-map the neighbor tables read-only
+            cf.neighbors = np.array(cf.neighbors)
+            cf.neighbor_sims = np.array(cf.neighbor_sims)
+            cf.has_neighbors = np.zeros(len(cf.neighbors), dtype=bool)
+            cf.precompute_neighbors()
+            path = save_artifacts(bundle.cf_model, bundle.cbf_model, bundle.neumf_model, bundle.user_encoder,
+                                  bundle.movie_encoder, bundle.movies, artifact_root or DEFAULT_ARTIFACT_DIR,
+                                  extra_manifest=extra_manifest, hybrid_weights=bundle.hybrid_weights)
+            self.bundle = bundle
+            self.num_applied = 0
+        return path
+
+# --- Feedback log ---
+def read_feedback(db_path, after_id=0, limit=None):
+    """
+    Rated feedback events with id > after_id from the CineScope feedback
+    database, as (ids, user_ids, movie_ids, ratings) arrays. Malformed
+    events (see clean_events) are left out.
+    """
+    query = ('SELECT id, user_id, movie_id, rating FROM feedback WHERE id > ? AND rating IS NOT NULL '
+             'AND user_id IS NOT NULL AND movie_id IS NOT NULL ORDER BY id')
+    params = (after_id,)
+    if limit is not None:
+        query += ' LIMIT ?'
+        params += (limit,)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0, dtype=np.float32)
+    ids, users, movies, ratings = zip(*rows)
+    users, movies, ratings, valid = clean_events(users, movies, ratings)
+    if not valid.all():
+        print(f"Skipping {int((~valid).sum())} malformed feedback events")
+    return np.array(ids, dtype=np.int64)[valid], users, movies, ratings
+
+def compact_from_feedback(db_path, artifact_root=None):
+    """
+    Offline compaction job: apply every feedback event newer than the
+    latest bundle to it and save the result as a new bundle.
+    """
+    from artifacts import load_artifacts, DEFAULT_ARTIFACT_DIR
+
+    artifact_root = artifact_root or DEFAULT_ARTIFACT_DIR
+    bundle = load_artifacts(artifact_root)
+    if bundle is None:
+        print("No saved artifacts found, train the models first")
+        return None
+    last_id = bundle.manifest.get('online', {}).get('last_feedback_id', 0)
+    ids, users, movies, ratings = read_feedback(db_path, last_id)
+    if len(ids) == 0:
+        print("No new feedback since the latest bundle")
+        return None
+
+    updater = OnlineUpdater(bundle)
+    num_users = updater.apply(users, movies, ratings)
+    print(f"Applied {len(ids)} feedback events for {num_users} users")
+    return updater.compact(artifact_root, extra_manifest={'online': {'last_feedback_id': int(ids[-1])}})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold new feedback into the latest model bundle")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), '..', 'cinescope-ui', 'cinescope.db'))
+    parser.add_argument('--artifact-root', default=None)
+    args = parser.parse_args()
+    compact_from_feedback(args.db, args.artifact_root)
@@ -0,0 +1,173 @@
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# Encoded ratings shared with the workers as .npy files they memory-map
+SHARED_ARRAYS = ['user_ids', 'movie_ids', 'ratings', 'user_encoded', 'movie_encoded',
+                 'matrix_data', 'matrix_indices', 'matrix_indptr', 'user_classes', 'movie_classes']
+COMPONENTS = ['cf', 'cbf', 'neumf']
+
+def share_data(work_dir, movies, ratings, user_encoder, movie_encoder, rating_matrix):
+    """Write the loaded data once; workers map it read-only instead of receiving pickles."""
+    arrays = {
+        'user_ids': ratings.user_ids,
+        'movie_ids': ratings.movie_ids,
+        'ratings': ratings.ratings,
+        'user_encoded': ratings.user_codes,
+        'movie_encoded': ratings.movie_codes,
+        'matrix_data': rating_matrix.data,
+        'matrix_indices': rating_matrix.indices,
+        'matrix_indptr': rating_matrix.indptr,
+        'user_classes': user_encoder.classes_,
+        'movie_classes': movie_encoder.classes_,
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(work_dir, f"{name}.npy"), np.ascontiguousarray(values))
+    # Only the CBF worker needs the text columns
+    movies.to_pickle(os.path.join(work_dir, 'movies.pkl'))
+
+def load_shared(work_dir):
+    return {name: np.load(os.path.join(work_dir, f"{name}.npy"), mmap_mode='r') for name in SHARED_ARRAYS}
+
+def _train_component(component, work_dir, bundle_dir, options):
+    """
+    Worker: train one model from the memory-mapped data and write its
+    artifact component into the bundle directory. Returns (component,
+    manifest entry, wall seconds).
+    """
+    import pandas as pd
+    from scipy.sparse import csr_matrix
+    from data_loader import RatingsTable, fitted_encoder
+    from train import train_cf, train_cbf, train_neumf
+    from artifacts import save_cf, save_cbf, save_neumf
+
+    start = time.perf_counter()
+    data = load_shared(work_dir)
+    target = os.path.join(bundle_dir, component)
+    num_users, num_movies = len(data['user_classes']), len(data['movie_classes'])
+
+    if component == 'cf':
+        matrix = csr_matrix((data['matrix_data'], data['matrix_indices'], data['matrix_indptr']),
+                            shape=(num_users, num_movies))
+        model = train_cf(matrix, fitted_encoder(np.asarray(data['user_classes'])), fitted_encoder(np.asarray(data['movie_classes'])))
+        meta = save_cf(target, model)
+    elif component == 'cbf':
+        movies = pd.read_pickle(os.path.join(work_dir, 'movies.pkl'))
+        ratings = RatingsTable(data['user_ids'], data['movie_ids'], data['ratings'])
+        model = train_cbf(movies, ratings)
+        meta = save_cbf(target, model)
+    else:
+        model = train_neumf(data['user_encoded'], data['movie_encoded'], data['ratings'], num_users, num_movies,
+                            options['neumf_objective'], options['neumf_loss'], options['neumf_epochs'],
+                            options['neumf_batch_size'], options['checkpoint_dir'])
+        meta = save_neumf(target, model)
+    return component, meta, time.perf_counter() - start
+
+class ThreadLimit:
+    """
+    Cap BLAS/OpenMP/TensorFlow threads for child processes spawned inside
+    the block (spawned workers inherit the environment), so concurrent
+    models do not oversubscribe the cores.
+    """
+    VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.saved = {}
+
+    def __enter__(self):
+        for name in self.VARIABLES:
+            self.saved[name] = os.environ.get(name)
+            os.environ[name] = str(self.threads if name != 'TF_NUM_INTEROP_THREADS' else 2)
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def train_all_models_parallel(data_dir=None, artifact_root=None, ratings_file='ratings_small.csv',
+                              neumf_objective='rating', neumf_loss='bce', neumf_epochs=None,
+                              neumf_batch_size=None, max_workers=None):
+    """
+    Train CF, CBF and NeuMF concurrently in a process pool and save the same
+    bundle as train.train_all_models.
+
+    Data is loaded once in the parent and written to a scratch directory as
+    .npy files that each worker memory-maps, so the ratings are neither
+    pickled per worker nor duplicated in page cache. Workers use the
+    'spawn' start method (TensorFlow is not fork-safe) and split the cores
+    between them. Returns per-step wall times in seconds.
+    """
+    from data_loader import load_data_streaming
+    from neumf_training import DEFAULT_BATCH_SIZE
+    from artifacts import (DEFAULT_ARTIFACT_DIR, ARTIFACT_VERSION, begin_bundle, publish_bundle,
+                           save_encoders, save_catalog)
+
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
+    if artifact_root is None:
+        artifact_root = DEFAULT_ARTIFACT_DIR
+    max_workers = max_workers or len(COMPONENTS)
+    timings = {}
+    total_start = time.perf_counter()
+
+    print("Starting parallel training process...")
+    start = time.perf_counter()
+    movies, ratings, num_users, num_movies, user_encoder, movie_encoder, rating_matrix = load_data_streaming(data_dir, ratings_file)
+    timings['load'] = time.perf_counter() - start
+
+    version, bundle_dir = begin_bundle(artifact_root)
+    work_dir = tempfile.mkdtemp(prefix='.train-', dir=artifact_root)
+    try:
+        start = time.perf_counter()
+        share_data(work_dir, movies, ratings, user_encoder, movie_encoder, rating_matrix)
+        del ratings, rating_matrix
+        timings['share'] = time.perf_counter() - start
+
+        options = {
+            'neumf_objective': neumf_objective,
+            'neumf_loss': neumf_loss,
+            'neumf_epochs': neumf_epochs,
+            'neumf_batch_size': neumf_batch_size or DEFAULT_BATCH_SIZE,
+            'checkpoint_dir': os.path.join(artifact_root, 'checkpoints'),
+        }
+        manifest = {
+            'format_version': ARTIFACT_VERSION,
+            'created_at': version,
+            'encoders': save_encoders(os.path.join(bundle_dir, 'encoders'), user_encoder, movie_encoder),
+            'catalog': save_catalog(os.path.join(bundle_dir, 'catalog'), movies),
+        }
+
+        threads = max(1, (os.cpu_count() or 1) // max_workers)
+        context = multiprocessing.get_context('spawn')
+        with ThreadLimit(threads), ProcessPoolExecutor(max_workers, mp_context=context) as pool:
+            futures = [pool.submit(_train_component, c, work_dir, bundle_dir, options) for c in COMPONENTS]
+            for future in as_completed(futures):
+                component, meta, seconds = future.result()
+                manifest[component] = meta
+                timings[component] = seconds
+                print(f"{component.upper()} finished in {seconds:.1f}s")
+    except BaseException:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    publish_bundle(artifact_root, version, bundle_dir, {k: manifest[k] for k in ['format_version', 'created_at', 'encoders', 'catalog'] + COMPONENTS})
+    timings['total'] = time.perf_counter() - total_start
+
+    print("\nWall time per step:")
+    for step, seconds in timings.items():
+        print(f"  {step:<6} {seconds:8.1f}s")
+    return timings
+
+if __name__ == "__main__":
+    train_all_models_parallel()
@@ -0,0 +1,100 @@
+import numpy as np
+
+def _group_by_first_appearance(users):
+    """Group id per row, numbered in order of each user's first appearance."""
+    _, first, inverse = np.unique(users, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+    return rank[inverse.ravel()], len(first)
+
+def _positions(groups_sorted, counts):
+    """Rank of each row within its (contiguous, sorted) group."""
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.arange(len(groups_sorted)) - starts[groups_sorted]
+
+def _mean(values):
+    # Python's sum in user order, exactly as the per-user dict implementation
+    return sum(values.tolist()) / len(values)
+
+def _dcg(groups, positions, gains, discounts, num_users, k):
+    """Per-user DCG@k, summed term by term in rank order."""
+    top = positions < k
+    terms = np.zeros((num_users, k))
+    terms[groups[top], positions[top]] = gains[top] / discounts[positions[top]]
+    dcg = np.zeros(num_users)
+    for j in range(k):
+        dcg = dcg + terms[:, j]
+    return dcg
+
+def ranking_metrics(users, items, y_true, y_pred, ks=(5, 10), threshold=3.5):
+    """
+    Precision@K, Recall@K and NDCG@K for several K in one pass.
+
+    Rows are grouped per user with a single lexsort (stable, so ties keep
+    input order) instead of per-user Python lists. Results match the
+    original dict-of-tuples implementations exactly.
+
+    Returns a dict like {'Precision@5': ..., 'Recall@5': ..., 'NDCG@5': ...}.
+    """
+    users = np.asarray(users)
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred)
+    groups, num_users = _group_by_first_appearance(users)
+    counts = np.bincount(groups, minlength=num_users)
+
+    # Rank by predicted rating within each user
+    order = np.lexsort((-y_pred, groups))
+    groups_p = groups[order]
+    true_p = y_true[order]
+    rec_p = y_pred[order] >= threshold
+    rel_p = true_p >= threshold
+    pos_p = _positions(groups_p, counts)
+
+    # Ideal ranking by true rating within each user
+    ideal = np.lexsort((-y_true, groups))
+    groups_i = groups[ideal]
+    true_i = y_true[ideal]
+    pos_i = _positions(groups_i, counts)
+
+    # Gains and discounts from scalar ops, as in the per-row loop
+    values, value_idx = np.unique(y_true, return_inverse=True)
+    gain_table = np.array([2 ** v - 1 for v in values])
+    gains_p = gain_table[value_idx.ravel()[order]]
+    gains_i = gain_table[value_idx.ravel()[ideal]]
+    max_k = max(ks)
+    discounts = np.array([np.log2(i + 2) for i in range(max_k)])
+
+    n_rel = np.bincount(groups_p, weights=rel_p, minlength=num_users)
+    results = {}
+    for k in ks:
+        top = pos_p < k
+        n_rec_k = np.bincount(groups_p, weights=rec_p & top, minlength=num_users)
+        n_rec_rel_k = np.bincount(groups_p, weights=rec_p & rel_p & top, minlength=num_users)
+        n_k = np.minimum(counts, k)
+
+        precision = n_rec_k / n_k
+        recall = np.divide(n_rec_rel_k, n_rel, out=np.zeros(num_users), where=n_rel != 0)
+        dcg = _dcg(groups_p, pos_p, gains_p, discounts, num_users, k)
+        idcg = _dcg(groups_i, pos_i, gains_i, discounts, num_users, k)
+        ndcg = np.divide(dcg, idcg, out=np.zeros(num_users), where=idcg > 0)
+
+        results[f'Precision@{k}'] = _mean(precision)
+        results[f'Recall@{k}'] = _mean(recall)
+        results[f'NDCG@{k}'] = _mean(ndcg)
+    return results
+
+def _unpack(predictions):
+    users, items, y_true, y_pred = zip(*predictions)
+    return np.asarray(users), np.asarray(items), np.asarray(y_true), np.asarray(y_pred)
+
+def precision_at_k(predictions, k=10, threshold=3.5):
+    """
+    Predictions: list of (user_id, movie_id, true_rating, pred_rating)
+    """
+    return ranking_metrics(*_unpack(predictions), ks=(k,), threshold=threshold)[f'Precision@{k}']
+
+def recall_at_k(predictions, k=10, threshold=3.5):
+    return ranking_metrics(*_unpack(predictions), ks=(k,), threshold=threshold)[f'Recall@{k}']
+
+def ndcg_at_k(predictions, k=10):
+    return ranking_metrics(*_unpack(predictions), ks=(k,))[f'NDCG@{k}']
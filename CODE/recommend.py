@@ -1,70 +1,161 @@
 import os
 import numpy as np
 import pandas as pd
-from data_loader import load_data, preprocess_features
-from models import CollaborativeFilteringModel, ContentBasedModel, NeuMFModel
-from hybrid import hybrid_recommendation
+from artifacts import load_artifacts, load_bundle_neumf, DEFAULT_ARTIFACT_DIR
+from train import train_all_models
+from hybrid import HybridRecommender
+from embedding_index import retrieve_candidates
+from online_update import OnlineUpdater, clean_events
+from batch_recommend import load_topn
+from instrumentation import stage
 
-def get_recommendations(user_id):
-    # 1. Load and Train (Full Data)
-    data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
-    movies, ratings = load_data(data_dir)
-    movies, ratings, num_users, num_movies, user_encoder, movie_encoder = preprocess_features(movies, ratings)
-    
-    print("Training models on full data...")
-    cf_model = CollaborativeFilteringModel()
-    cf_model.train(ratings)
+# Models restored once per process and reused across calls. Online
+# updates build a new bundle and swap the references, so readers need no
+# lock and keep scoring with the bundle they started with
+_bundle = None
+# (bundle, HybridRecommender over it)
+_recommender = None
+_updater = None
+# Precomputed top-N for the loaded bundle (False once known to be missing)
+_topn = None
+# Users whose ratings changed since the batch run; they are scored live
+_live_users = set()
+
+def get_model_bundle(artifact_root=DEFAULT_ARTIFACT_DIR):
+    """
+    Load the saved model artifacts, training and saving them first if none exist.
+    """
+    global _bundle
+    if _bundle is None:
+        _bundle = load_artifacts(artifact_root)
+        if _bundle is None:
+            print("No saved artifacts found, training models...")
+            train_all_models(artifact_root=artifact_root)
+            _bundle = load_artifacts(artifact_root)
+    elif _bundle.neumf_model is None:
+        # Preloaded without NeuMF (preload_bundle)
+        load_bundle_neumf(_bundle, artifact_root)
+    return _bundle
+
+def preload_bundle(artifact_root=DEFAULT_ARTIFACT_DIR):
+    """
+    Load the saved artifacts except NeuMF, for a server to share with the
+    workers it forks; get_model_bundle() adds NeuMF in each worker, as
+    TensorFlow state does not survive a fork. Returns None (leaving loading
+    or training to the workers) if no bundle has been saved.
+    """
+    global _bundle
+    if _bundle is None:
+        _bundle = load_artifacts(artifact_root, load_neumf_model=False)
+    return _bundle
+
+def get_recommender(bundle=None):
+    """Hybrid ensemble over ``bundle``, by default the loaded model bundle."""
+    global _recommender
+    if bundle is None:
+        bundle = get_model_bundle()
+    cached = _recommender
+    if cached is None or cached[0] is not bundle:
+        cached = _recommender = (bundle, HybridRecommender.from_bundle(bundle))
+    return cached[1]
+
+def get_topn_store(artifact_root=DEFAULT_ARTIFACT_DIR):
+    """
+    Top-N store written by batch_recommend.py for the loaded bundle, or None
+    if there is none or it was computed with other hybrid weights.
+    """
+    global _topn
+    if _topn is None:
+        store = load_topn(artifact_root, get_model_bundle(artifact_root).manifest.get('created_at', ''))
+        if store is not None and not np.allclose(store.meta['weights'], get_recommender().weights):
+            print("Ignoring precomputed recommendations made with other hybrid weights")
+            store = None
+        _topn = store or False
+    return _topn or None
+
+def apply_feedback(user_ids, movie_ids, ratings):
+    """
+    Fold new (user, movie, rating) events into the loaded models without
+    retraining (see online_update.py); returns the number of users updated.
+    Malformed events are skipped. The update is built on a copy of the
+    bundle and published in one step, so calls are not meant to overlap
+    but get_recommendations can run during one.
+    """
+    global _bundle, _recommender, _updater, _live_users
+    user_ids, movie_ids, ratings, valid = clean_events(user_ids, movie_ids, ratings)
+    if not valid.all():
+        print(f"Skipping {int((~valid).sum())} malformed feedback events")
+    bundle = get_model_bundle()
+    if _updater is None:
+        _updater = OnlineUpdater(bundle)
+    num_users = _updater.apply(user_ids, movie_ids, ratings)
+    bundle = _updater.bundle
+    # The ensemble caches the encoders' id indexes, so build it for the new
+    # bundle before publishing that
+    _recommender = (bundle, HybridRecommender.from_bundle(bundle))
+    _live_users = _live_users | set(np.unique(user_ids).tolist())
+    _bundle = bundle
+    return num_users
+
+def get_recommendations(user_id, n=10, num_candidates=None):
+    """
+    Top-n (title, score) pairs for a user. Users in the precomputed top-N
+    store (see batch_recommend.py) are answered with one row read. Otherwise
+    every unseen movie is scored; with num_candidates, only that many movies
+    retrieved from the NeuMF item-embedding index are scored (two-stage
+    retrieval).
+    """
+    if n < 1:
+        return []
     
-    cbf_model = ContentBasedModel()
-    cbf_model.train(movies)
+    # 1. Load trained models (warm start from artifacts)
+    bundle = get_model_bundle()
+    recommender = get_recommender(bundle)
+    cf_model = bundle.cf_model
     
-    neumf_model = NeuMFModel(num_users, num_movies)
-    neumf_model.compile(optimizer='adam', loss='mse')
-    neumf_model.fit([ratings['user_encoded'], ratings['movie_encoded']], ratings['rating'], epochs=3, verbose=0)
+    # Precomputed top-N, unless the user's ratings changed since the batch run
+    if num_candidates is None and user_id not in _live_users:
+        store = get_topn_store()
+        if store is not None:
+            with stage('recommend.precomputed'):
+                hit = store.lookup(user_id, n)
+            if hit is not None:
+                movie_ids, scores = hit
+                titles = bundle.titles.reindex(movie_ids).values
+                return [(title, float(score)) for title, score in zip(titles, scores)]
     
     print(f"Generating recommendations for User {user_id}...")
     
-    # 2. Identify movies user hasn't seen
-    if user_id in ratings['userId'].values:
-        user_ratings = ratings[ratings['userId'] == user_id]
-        seen_movie_ids = user_ratings['movieId'].values
-    else:
-        seen_movie_ids = []
-        
-    all_movie_ids = movies['id'].values
-    unseen_movie_ids = [mid for mid in all_movie_ids if mid not in seen_movie_ids]
+    # 2. Candidates: every movie the models know that the user hasn't rated
+    # (seen movies come straight from the user's CF matrix row)
+    with stage('recommend.candidates'):
+        candidate_ids = np.asarray(bundle.movie_encoder.classes_)
+        user_row = cf_model.user_index.get_indexer([user_id])[0]
+        if user_row >= 0:
+            seen_movie_ids = cf_model.movie_index.values[cf_model.user_item_matrix[user_row].indices]
+            candidate_ids = candidate_ids[~np.isin(candidate_ids, seen_movie_ids)]
     
-    # 3. Score unseen movies
-    # For demo purposes, we'll just score the first 20 unseen movies to save time
-    unseen_movie_ids = unseen_movie_ids[:20] 
+    # Two-stage: narrow to the movies the NeuMF embedding index retrieves
+    user_code = pd.Index(bundle.user_encoder.classes_).get_indexer([user_id])[0]
+    if num_candidates is not None and bundle.item_index is not None and user_code >= 0:
+        with stage('recommend.retrieval'):
+            movie_codes = pd.Index(bundle.movie_encoder.classes_)
+            seen_codes = movie_codes.get_indexer(seen_movie_ids) if user_row >= 0 else None
+            codes = retrieve_candidates(bundle.neumf_model, bundle.item_index, user_code, num_candidates, exclude=seen_codes)
+            candidate_ids = movie_codes.values[codes]
+    if len(candidate_ids) == 0:
+        return []
     
-    recommendations = []
-    for movie_id in unseen_movie_ids:
-        try:
-            # Check if movie is in our encoder (it should be as we trained on movies df)
-            if movie_id not in movie_encoder.classes_:
-                continue
-                
-            # Hybrid Score
-            # Note: In a real app, we would pass encoded IDs to NeuMF here.
-            # But our hybrid.py is a simple placeholder wrapper. 
-            # We'll just call it as is.
-            
-            score = hybrid_recommendation(user_id, movie_id, cf_model, cbf_model, neumf_model)
-            
-            movie_row = movies[movies['id'] == movie_id]
-            if not movie_row.empty:
-                movie_title = movie_row['title'].values[0]
-                recommendations.append((movie_title, score))
-            
-        except Exception as e:
-            # print(f"Error scoring movie {movie_id}: {e}")
-            continue
-            
-    # Sort by score
-    recommendations.sort(key=lambda x: x[1], reverse=True)
+    # 3. Score the whole candidate set at once and keep the top-N
+    with stage('recommend.scoring'):
+        scores = recommender.score(np.full(len(candidate_ids), user_id), candidate_ids)
+    with stage('recommend.ranking'):
+        n = min(n, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind='stable')]
     
-    return recommendations[:10]
+    titles = bundle.titles.reindex(candidate_ids[top]).values
+    return [(title, float(score)) for title, score in zip(titles, scores[top])]
 
 if __name__ == "__main__":
     # Test with User ID 1
@@ -0,0 +1,85 @@
+import numpy as np
+from sklearn.metrics.pairwise import linear_kernel
+
+def topk_similarity(matrix, k=50, chunk_size=512, exclude_self=True):
+    """
+    Top-K most similar rows for every row of an L2-normalized feature matrix
+    (e.g. TF-IDF), computed in blocks of ``chunk_size`` rows.
+
+    Only one ``chunk_size x N`` block of similarities exists at a time, so
+    memory scales as N x K instead of N x N.
+
+    Returns (indices, scores): int32 and float32 arrays of shape (N, K),
+    each row sorted by descending similarity.
+    """
+    n = matrix.shape[0]
+    k = min(k, n - 1 if exclude_self else n)
+    indices = np.zeros((n, k), dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+
+    matrix = matrix.astype(np.float32)
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        block = linear_kernel(matrix[start:end], matrix)
+        block_indices, block_scores = _block_topk(block, k, start if exclude_self else None)
+        indices[start:end] = block_indices
+        scores[start:end] = block_scores
+    return indices, scores
+
+def append_topk(matrix, num_old, indices, scores, k=50, chunk_size=512):
+    """
+    Neighbor table for ``matrix`` after rows were appended, given the table
+    (indices, scores) of its first ``num_old`` rows.
+
+    New rows are scored against every row; old rows only against the new
+    ones, and an old row's list changes only where a new row beats its
+    current K-th neighbor. That costs O(new x N) instead of the O(N^2) of
+    rebuilding with topk_similarity, which it falls back to when the old
+    table is narrower than k (a catalog of at most k movies).
+    """
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    if num_old == 0 or indices.shape[1] < k:
+        return topk_similarity(matrix, k=k, chunk_size=chunk_size)
+    if k <= 0:
+        return np.zeros((n, 0), dtype=np.int32), np.zeros((n, 0), dtype=np.float32)
+
+    matrix = matrix.astype(np.float32)
+    all_indices = np.empty((n, k), dtype=np.int32)
+    all_scores = np.empty((n, k), dtype=np.float32)
+    all_indices[:num_old] = indices[:, :k]
+    all_scores[:num_old] = scores[:, :k]
+
+    # New rows against the whole catalog
+    for start in range(num_old, n, chunk_size):
+        end = min(start + chunk_size, n)
+        block = linear_kernel(matrix[start:end], matrix)
+        all_indices[start:end], all_scores[start:end] = _block_topk(block, k, start)
+
+    # Old rows against the new ones, merged into the lists they enter
+    new_rows = matrix[num_old:]
+    new_ids = np.arange(num_old, n, dtype=np.int32)
+    for start in range(0, num_old, chunk_size):
+        end = min(start + chunk_size, num_old)
+        block = linear_kernel(matrix[start:end], new_rows)
+        changed = np.flatnonzero((block > all_scores[start:end, -1:]).any(axis=1))
+        if len(changed) == 0:
+            continue
+        rows = start + changed
+        candidates = np.concatenate([all_indices[rows], np.broadcast_to(new_ids, (len(rows), len(new_ids)))], axis=1)
+        top, top_scores = _block_topk(np.concatenate([all_scores[rows], block[changed]], axis=1), k)
+        all_indices[rows] = np.take_along_axis(candidates, top, axis=1)
+        all_scores[rows] = top_scores
+    return all_indices, all_scores
+
+def _block_topk(block, k, self_offset=None):
+    """Top-K columns per row of a dense similarity block, sorted descending."""
+    rows = np.arange(block.shape[0])
+    if self_offset is not None:
+        block[rows, rows + self_offset] = -np.inf
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    top_scores = block[rows[:, None], top]
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return top[rows[:, None], order].astype(np.int32), top_scores[rows[:, None], order].astype(np.float32)
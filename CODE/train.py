@@ -1,48 +1,76 @@
 import os
 import tensorflow as tf
-from data_loader import load_data, preprocess_features
+from data_loader import load_data_streaming
 from models import CollaborativeFilteringModel, ContentBasedModel, NeuMFModel
+from neumf_training import fit_neumf, DEFAULT_BATCH_SIZE, DEFAULT_EPOCHS
+from artifacts import save_artifacts, DEFAULT_ARTIFACT_DIR
 
-def train_all_models():
-    print("Starting training process...")
-    
-    # 1. Load Data
-    data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
-    movies, ratings = load_data(data_dir)
-    
-    # 2. Preprocess Features
-    movies, ratings, num_users, num_movies, user_encoder, movie_encoder = preprocess_features(movies, ratings)
-    
-    # 3. Train Collaborative Filtering (CF)
+def train_cf(rating_matrix, user_encoder, movie_encoder):
     print("Training Collaborative Filtering Model...")
     cf_model = CollaborativeFilteringModel()
-    cf_model.train(ratings)
+    cf_model.fit_matrix(rating_matrix, user_encoder.classes_, movie_encoder.classes_)
     print("CF Model trained.")
-    
-    # 4. Train Content-Based Filtering (CBF)
+    return cf_model
+
+def train_cbf(movies, ratings):
     print("Training Content-Based Filtering Model...")
     cbf_model = ContentBasedModel()
-    cbf_model.train(movies)
+    cbf_model.train(movies, ratings)
     print("CBF Model trained.")
-    
-    # 5. Train Neural Collaborative Filtering (NeuMF)
+    return cbf_model
+
+def train_neumf(user_ids, movie_ids, labels, num_users, num_movies, objective='rating', loss='bce',
+                epochs=None, batch_size=DEFAULT_BATCH_SIZE, checkpoint_dir=None):
     print("Training NeuMF Model...")
     neumf_model = NeuMFModel(num_users, num_movies)
-    neumf_model.compile(optimizer='adam', loss='mse')
+    if epochs is None:
+        epochs = DEFAULT_EPOCHS[objective]
     
-    # Prepare data for NeuMF
-    user_ids = ratings['user_encoded'].values
-    movie_ids = ratings['movie_encoded'].values
-    labels = ratings['rating'].values
-    
-    neumf_model.fit([user_ids, movie_ids], labels, epochs=5, batch_size=64, validation_split=0.2)
+    if objective == 'implicit':
+        # Observed pairs against negatives sampled on the fly each epoch
+        neumf_model.fit_implicit(user_ids, movie_ids, loss=loss, epochs=epochs, batch_size=batch_size)
+    else:
+        # tf.data pipeline with large batches; stops early on a held-out 20% and
+        # keeps the best weights (also checkpointed under checkpoint_dir)
+        neumf_model.compile(optimizer='adam', loss='mse')
+        fit_neumf(neumf_model, user_ids, movie_ids, labels, epochs=epochs, batch_size=batch_size,
+                  validation_split=0.2, checkpoint_dir=checkpoint_dir)
     print("NeuMF Model trained.")
+    return neumf_model
+
+def train_all_models(data_dir=None, artifact_root=DEFAULT_ARTIFACT_DIR, ratings_file='ratings_small.csv',
+                     neumf_objective='rating', neumf_loss='bce', neumf_epochs=None, neumf_batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Train CF, CBF and NeuMF and save the bundle. neumf_objective is 'rating'
+    (MSE regression on observed ratings) or 'implicit' (observed pairs vs
+    sampled negatives with neumf_loss 'bce' or 'bpr'). An implicit NeuMF
+    scores interaction probabilities, not ratings, so it is used for
+    candidate retrieval only and left out of the hybrid blend.
+    See parallel_train.py for training the three models concurrently.
+    """
+    print("Starting training process...")
     
-    # Save models (conceptually)
-    # neumf_model.save_weights('neumf_weights.h5')
+    # 1-2. Load and encode data; ratings are streamed in chunks so the full
+    # ratings.csv fits in memory (pass ratings_file='ratings.csv')
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
+    movies, ratings, num_users, num_movies, user_encoder, movie_encoder, rating_matrix = load_data_streaming(data_dir, ratings_file)
+    
+    # 3. Train Collaborative Filtering (CF)
+    cf_model = train_cf(rating_matrix, user_encoder, movie_encoder)
+    
+    # 4. Train Content-Based Filtering (CBF)
+    cbf_model = train_cbf(movies, ratings)
+    
+    # 5. Train Neural Collaborative Filtering (NeuMF)
+    neumf_model = train_neumf(ratings.user_codes, ratings.movie_codes, ratings.ratings,
+                              num_users, num_movies, neumf_objective, neumf_loss, neumf_epochs, neumf_batch_size,
+                              checkpoint_dir=os.path.join(artifact_root, 'checkpoints'))
+    
+    # 6. Save models, encoders and neighbor tables for fast warm start
+    save_artifacts(cf_model, cbf_model, neumf_model, user_encoder, movie_encoder, movies, artifact_root)
     
     print("All models trained successfully!")
 
 if __name__ == "__main__":
     train_all_models()
-
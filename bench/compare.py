@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark JSON files from bench/run_bench.py.
+
+    python bench/compare.py bench/results/small-abc123.json bench/results/small-def456.json
+
+Prints every timing and throughput in both runs with the change, and flags
+regressions larger than --threshold (default 10%).
+"""
+
+import sys
+import json
+import argparse
+
+# Leaf metrics worth comparing; for *_per_sec higher is better, otherwise lower is
+METRICS = ('seconds', 'median', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'rows_per_sec')
+
+def flatten(results, prefix=''):
+    """{'train': {'cf_train': {'seconds': 1.0}}} -> {'train.cf_train.seconds': 1.0}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif key in METRICS and isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+def compare(old, new, threshold=0.1):
+    """Rows of (metric, old, new, ratio, regressed) for metrics present in both runs."""
+    old_flat = flatten(old['results'])
+    new_flat = flatten(new['results'])
+    rows = []
+    for name in sorted(old_flat.keys() & new_flat.keys()):
+        a, b = old_flat[name], new_flat[name]
+        if not a:
+            continue
+        ratio = b / a
+        higher_is_better = name.endswith('_per_sec')
+        regressed = ratio < 1 - threshold if higher_is_better else ratio > 1 + threshold
+        rows.append((name, a, b, ratio, regressed))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old['meta']['revision']} -> {new['meta']['revision']} ({new['meta']['profile']} profile)")
+    if old['meta']['profile'] != new['meta']['profile']:
+        print("Warning: comparing runs from different profiles")
+
+    rows = compare(old, new, args.threshold)
+    width = max((len(r[0]) for r in rows), default=10)
+    for name, a, b, ratio, regressed in rows:
+        print(f"{name:<{width}}  {a:>14.4f}  {b:>14.4f}  {ratio:>6.2f}x{'  REGRESSION' if regressed else ''}")
+
+    sys.exit(1 if any(r[4] for r in rows) else 0)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for training, inference and serving.
+
+Times data loading, feature preprocessing, each model's training, batch
+prediction throughput, CBF top-K lookups and the Flask endpoints (through
+the test client) on a synthetic dataset, and writes the numbers to JSON
+so runs on different commits can be compared with bench/compare.py.
+
+    python bench/run_bench.py --profile small
+    python bench/run_bench.py --profile full --skip serving
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'CODE'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'cinescope-ui'))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import PROFILES, generate_dataset
+
+STAGES = ['load', 'train', 'predict', 'lookup', 'serving']
+
+# Per-profile workload sizes; NeuMF trains one epoch on at most neumf_samples rows
+SETTINGS = {
+    'tiny': {'predict_pairs': 20_000, 'neumf_samples': None, 'lookups': 100, 'requests': 100},
+    'small': {'predict_pairs': 100_000, 'neumf_samples': None, 'lookups': 200, 'requests': 200},
+    'full': {'predict_pairs': 1_000_000, 'neumf_samples': 2_000_000, 'lookups': 500, 'requests': 500},
+}
+
+# --- Timing helpers ---
+def timed(fn, repeat=1):
+    """Run fn repeat times; return its last result and a summary of wall times in seconds."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, {'seconds': min(times), 'median': float(np.median(times)), 'runs': len(times)}
+
+def latency_summary(times):
+    """Percentiles of a list of per-call latencies, in milliseconds."""
+    ms = np.asarray(times) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+        'calls': len(ms),
+    }
+
+def throughput(num_rows, seconds):
+    return {'rows': num_rows, 'seconds': seconds, 'rows_per_sec': num_rows / seconds if seconds > 0 else None}
+
+def git_revision():
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return sha + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def set_seeds(seed):
+    import tensorflow as tf
+    np.random.seed(seed)
+    tf.keras.utils.set_random_seed(seed)
+
+# --- Stages ---
+def bench_loading(data_dir, repeat):
+    from data_loader import load_data, preprocess_features, load_data_streaming
+
+    results = {}
+    # First call may build the movies cache; later calls read it
+    _, results['load_data_first'] = timed(lambda: load_data(data_dir))
+    (movies, ratings), results['load_data'] = timed(lambda: load_data(data_dir), repeat)
+    data, results['preprocess_features'] = timed(lambda: preprocess_features(movies.copy(), ratings.take(slice(None))), repeat)
+    _, results['load_data_streaming'] = timed(lambda: load_data_streaming(data_dir, 'ratings.csv'), repeat)
+    results['num_movies'] = len(movies)
+    results['num_ratings'] = len(ratings)
+    return results, data
+
+def bench_training(data, neumf_samples, neumf_batch_size):
+    from models import CollaborativeFilteringModel, ContentBasedModel, NeuMFModel
+    from neumf_training import fit_neumf
+
+    movies, ratings, num_users, num_movies, user_encoder, movie_encoder = data
+    results = {}
+
+    cf_model = CollaborativeFilteringModel()
+    _, results['cf_train'] = timed(lambda: cf_model.train(ratings))
+    _, results['cf_precompute_neighbors'] = timed(cf_model.precompute_neighbors)
+
+    cbf_model = ContentBasedModel()
+    _, results['cbf_train'] = timed(lambda: cbf_model.train(movies, ratings))
+
+    neumf_model = NeuMFModel(num_users, num_movies)
+    neumf_model.compile(optimizer='adam', loss='mse')
+    sample = ratings if neumf_samples is None else ratings.take(slice(neumf_samples))
+    fit = lambda: fit_neumf(neumf_model, sample.user_codes, sample.movie_codes,
+                            sample.ratings, epochs=1, batch_size=neumf_batch_size,
+                            validation_split=0, verbose=0)
+    _, fit_time = timed(fit)
+    results['neumf_train_epoch'] = dict(fit_time, **throughput(len(sample), fit_time['seconds']), batch_size=neumf_batch_size)
+
+    return results, (cf_model, cbf_model, neumf_model, user_encoder, movie_encoder)
+
+def bench_prediction(trained, ratings, num_pairs, rng, repeat):
+    from hybrid import HybridRecommender
+
+    cf_model, cbf_model, neumf_model, user_encoder, movie_encoder = trained
+    # Known users against arbitrary catalog movies, like recommendation scoring
+    user_ids = rng.choice(ratings.user_ids, num_pairs)
+    movie_ids = rng.choice(movie_encoder.classes_, num_pairs)
+    user_encoded = user_encoder.transform(user_ids)
+    movie_encoded = movie_encoder.transform(movie_ids)
+    hybrid = HybridRecommender(cf_model, cbf_model, neumf_model, user_encoder, movie_encoder)
+
+    # Warm up the compiled NeuMF step so tracing is not timed
+    neumf_model.predict_batch(user_encoded[:10], movie_encoded[:10])
+
+    results = {}
+    for name, fn in [
+        ('cf_predict_batch', lambda: cf_model.predict_batch(user_ids, movie_ids)),
+        ('cbf_predict_batch', lambda: cbf_model.predict_batch(user_ids, movie_ids)),
+        ('neumf_predict_batch', lambda: neumf_model.predict_batch(user_encoded, movie_encoded)),
+        ('hybrid_score', lambda: hybrid.score(user_ids, movie_ids)),
+    ]:
+        _, t = timed(fn, repeat)
+        results[name] = dict(t, **throughput(num_pairs, t['seconds']))
+    return results
+
+def bench_lookup(cbf_model, movies, num_lookups, rng):
+    titles = rng.choice(movies['title'].dropna().values, num_lookups)
+    times = []
+    for title in titles:
+        start = time.perf_counter()
+        cbf_model.get_recommendations(title, movies)
+        times.append(time.perf_counter() - start)
+    return {'cbf_get_recommendations': latency_summary(times)}
+
+def bench_serving(data_dir, num_requests, rng):
+    import backend
+
+    results = {}
+    _, results['load_dataset'] = timed(lambda: backend.load_dataset(data_dir))
+    client = backend.app.test_client()
+    movies = backend.movies_df
+
+    sample = movies.iloc[rng.integers(0, len(movies), num_requests)]
+    titles = sample['title'].tolist()
+    # Autocomplete queries: prefixes, inner fragments and typo'd titles
+    queries = []
+    for i, title in enumerate(titles):
+        if i % 3 == 0:
+            queries.append(title[:max(2, len(title) // 2)])
+        elif i % 3 == 1:
+            queries.append(title[len(title) // 3:len(title) // 3 + 5] or title)
+        else:
+            queries.append(title[:-1] + 'x')
+
+    endpoints = {
+        'autocomplete': [('/api/autocomplete', {'query': q}) for q in queries],
+        'recommend_by_title': [('/api/recommend_by_title', {'title': t}) for t in titles],
+        'movie_details': [(f"/api/movie/{int(movie_id)}", None) for movie_id in sample['id']],
+        'health': [('/health', None)] * num_requests,
+    }
+    for name, calls in endpoints.items():
+        times = []
+        for path, params in calls:
+            start = time.perf_counter()
+            response = client.get(path, query_string=params)
+            times.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+        results[name] = latency_summary(times)
+    return results
+
+# --- Driver ---
+def run_benchmarks(profile='small', data_dir=None, skip=(), repeat=3, seed=42, neumf_batch_size=1024):
+    """Run every stage not in ``skip`` and return the results dict."""
+    settings = SETTINGS[profile]
+    if data_dir is None:
+        data_dir = os.path.join(BENCH_DIR, 'data', profile)
+    if not os.path.exists(os.path.join(data_dir, 'movies_metadata.csv')):
+        generate_dataset(data_dir, profile, seed)
+
+    set_seeds(seed)
+    rng = np.random.default_rng(seed)
+    report = {
+        'meta': {
+            'profile': profile,
+            'dataset': PROFILES[profile],
+            'settings': settings,
+            'seed': seed,
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': {},
+    }
+    results = report['results']
+
+    # Later stages need the loaded data and trained models
+    needs_models = any(s not in skip for s in ('train', 'predict', 'lookup'))
+    if 'load' not in skip or needs_models:
+        print("\n=== Loading ===")
+        loading, data = bench_loading(data_dir, repeat)
+        if 'load' not in skip:
+            results['load'] = loading
+
+    if needs_models:
+        print("\n=== Training ===")
+        training, trained = bench_training(data, settings['neumf_samples'], neumf_batch_size)
+        if 'train' not in skip:
+            results['train'] = training
+
+        if 'predict' not in skip:
+            print("\n=== Batch prediction ===")
+            results['predict'] = bench_prediction(trained, data[1], settings['predict_pairs'], rng, repeat)
+
+        if 'lookup' not in skip:
+            print("\n=== CBF top-K lookup ===")
+            results['lookup'] = bench_lookup(trained[1], data[0], settings['lookups'], rng)
+
+    if 'serving' not in skip:
+        print("\n=== Serving ===")
+        results['serving'] = bench_serving(data_dir, settings['requests'], rng)
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--data-dir', help='dataset directory (generated if missing)')
+    parser.add_argument('--output', help='JSON output path (default bench/results/<profile>-<revision>.json)')
+    parser.add_argument('--skip', nargs='*', choices=STAGES, default=[])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--neumf-batch-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.profile, args.data_dir, set(args.skip), args.repeat, args.seed, args.neumf_batch_size)
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{args.profile}-{report['meta']['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Synthetic MovieLens-shaped dataset generator for the benchmarks.
+
+Writes movies_metadata.csv, ratings.csv and ratings_small.csv with the same
+columns and formats as The Movies Dataset, so every loader in the project
+can read them unchanged. Nothing is downloaded and output is deterministic
+for a given profile and seed.
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+# Dataset sizes: 'small' matches ratings_small.csv, 'full' matches ratings.csv
+PROFILES = {
+    'tiny': {'num_movies': 2000, 'num_users': 200, 'num_ratings': 20_000},
+    'small': {'num_movies': 9_000, 'num_users': 700, 'num_ratings': 100_000},
+    'full': {'num_movies': 45_000, 'num_users': 270_000, 'num_ratings': 26_000_000},
+}
+
+GENRES = [
+    (28, 'Action'), (12, 'Adventure'), (16, 'Animation'), (35, 'Comedy'), (80, 'Crime'),
+    (99, 'Documentary'), (18, 'Drama'), (10751, 'Family'), (14, 'Fantasy'), (36, 'History'),
+    (27, 'Horror'), (10402, 'Music'), (9648, 'Mystery'), (10749, 'Romance'), (878, 'Science Fiction'),
+    (53, 'Thriller'), (10752, 'War'), (37, 'Western'),
+]
+
+SYLLABLES = ['ka', 'ro', 'mi', 'the', 'lo', 've', 'star', 'war', 'go', 'fa', 'ther', 'ma', 'trix',
+             'ni', 'ght', 'bl', 'ue', 'ci', 'ty', 'las', 'da', 'li', 'fe', 'de', 'ad', 'gi', 'rl',
+             'ho', 'use', 'wor', 'ld', 'ti', 'me', 'st', 'or', 're', 'turn', 'ga', 'bla', 'ck',
+             'sum', 'mer', 'se', 'cret', 'an', 'el', 'qu', 'in', 'on', 'ze']
+
+def make_vocabulary(rng, size):
+    """Distinct pseudo-words built from syllables."""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES, rng.integers(1, 4))))
+    return sorted(words)
+
+def generate_movies(rng, num_movies):
+    vocab = np.array(make_vocabulary(rng, 3000))
+    # Each genre gets its own slice of the vocabulary so overviews cluster by topic
+    topic_words = np.array_split(rng.permutation(len(vocab)), len(GENRES))
+
+    ids = np.sort(rng.choice(np.arange(1, num_movies * 10), num_movies, replace=False))
+    rows = []
+    for movie_id in ids:
+        genre_idx = rng.choice(len(GENRES), rng.integers(1, 4), replace=False)
+        topic = topic_words[genre_idx[0]]
+        n_words = rng.integers(15, 60)
+        words = np.where(rng.random(n_words) < 0.6, vocab[rng.choice(topic, n_words)], vocab[rng.integers(0, len(vocab), n_words)])
+        title = ' '.join(vocab[rng.integers(0, len(vocab), rng.integers(1, 5))]).title()
+        genres = str([{'id': GENRES[g][0], 'name': GENRES[g][1]} for g in genre_idx])
+        rows.append({
+            'id': str(movie_id),
+            'title': title,
+            'overview': ' '.join(words) if rng.random() > 0.02 else None,
+            'genres': genres,
+            'vote_average': round(float(rng.uniform(0, 10)), 1),
+            'vote_count': float(rng.integers(0, 5000)),
+            'release_date': f"{rng.integers(1920, 2018)}-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}",
+            'poster_path': f"/poster{movie_id}.jpg" if rng.random() > 0.05 else None,
+            'backdrop_path': f"/backdrop{movie_id}.jpg" if rng.random() > 0.3 else None,
+            'runtime': float(rng.integers(70, 200)),
+            'popularity': round(float(rng.exponential(3.0)), 6),
+        })
+    movies = pd.DataFrame(rows)
+    # The real file has a few malformed rows with non-numeric ids
+    bad = pd.DataFrame([{'id': '1997-08-20', 'title': None, 'genres': '[]'}])
+    return pd.concat([movies, bad], ignore_index=True), ids
+
+def generate_ratings(rng, movie_ids, num_users, num_ratings):
+    """
+    Ratings with long-tailed user activity and Zipf-like movie popularity,
+    half-star values around per-user and per-movie biases.
+    """
+    # Per-user activity, at least one rating each; oversampled because
+    # repeated (user, movie) draws are dropped below
+    activity = rng.lognormal(0.0, 1.0, num_users)
+    counts = np.maximum(1, np.round(activity / activity.sum() * num_ratings * 1.6)).astype(np.int64)
+    users = np.repeat(np.arange(1, num_users + 1, dtype=np.int32), counts)
+
+    # Popular movies get most ratings; ~1% of ratings point at ids without metadata
+    popularity = 1.0 / np.arange(1, len(movie_ids) + 1) ** 0.9
+    popularity = rng.permutation(popularity / popularity.sum())
+    movies = rng.choice(movie_ids, len(users), p=popularity).astype(np.int32)
+    unknown = rng.random(len(users)) < 0.01
+    movies[unknown] = movie_ids.max() + 1 + rng.integers(0, 1000, unknown.sum())
+
+    # One rating per (user, movie)
+    keys = users.astype(np.int64) * (int(movies.max()) + 1) + movies
+    _, keep = np.unique(keys, return_index=True)
+    if len(keep) > num_ratings:
+        keep = np.sort(rng.choice(keep, num_ratings, replace=False))
+    users, movies = users[keep], movies[keep]
+
+    user_bias = rng.normal(0, 0.5, num_users + 1)
+    movie_bias = pd.Series(rng.normal(0, 0.5, len(movie_ids)), index=movie_ids)
+    bias = movie_bias.reindex(movies).fillna(0).values
+    raw = 3.5 + user_bias[users] + bias + rng.normal(0, 0.8, len(users))
+    ratings = np.clip(np.round(raw * 2) / 2, 0.5, 5.0)
+
+    return pd.DataFrame({
+        'userId': users,
+        'movieId': movies,
+        'rating': ratings,
+        'timestamp': rng.integers(789652009, 1501829870, len(users)),
+    }).sort_values(['userId', 'movieId'], kind='stable')
+
+def generate_dataset(output_dir, profile='small', seed=42):
+    """Write a synthetic dataset for ``profile`` into ``output_dir`` and return its sizes."""
+    sizes = PROFILES[profile]
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Generating '{profile}' dataset in {output_dir}...")
+    movies, movie_ids = generate_movies(rng, sizes['num_movies'])
+    movies.to_csv(os.path.join(output_dir, 'movies_metadata.csv'), index=False)
+
+    ratings = generate_ratings(rng, movie_ids, sizes['num_users'], sizes['num_ratings'])
+    ratings_path = os.path.join(output_dir, 'ratings.csv')
+    ratings.to_csv(ratings_path, index=False)
+
+    # The training code reads ratings_small.csv; point it at the same ratings
+    small_path = os.path.join(output_dir, 'ratings_small.csv')
+    if os.path.lexists(small_path):
+        os.remove(small_path)
+    try:
+        os.symlink('ratings.csv', small_path)
+    except OSError:
+        ratings.to_csv(small_path, index=False)
+
+    return {'profile': profile, 'seed': seed, 'movies': len(movies), 'ratings': len(ratings)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output_dir')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(generate_dataset(args.output_dir, args.profile, args.seed))
+    sys.exit(0)
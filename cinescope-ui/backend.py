@@ -1,12 +1,20 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from difflib import SequenceMatcher
 import os
+import sys
 import json
+import time
+import atexit
+import threading
+from search_index import TitleIndex
+from storage import Storage, DEFAULT_DB_PATH
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CODE'))
+from dataset_cache import load_movies
+from instrumentation import REGISTRY, stage, begin_request, end_request, server_timing, render_metrics
+from movie_store import MovieStore, ResponseCache, load_content_index, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
 
 app = Flask(__name__)
 CORS(app)
@@ -15,37 +23,52 @@ CORS(app)
 movies_df = None
 tfidf_matrix = None
 tfidf_vectorizer = None
-watchlists = {}  # Simple in-memory storage {user_id: [movie_ids]}
+title_index = None
+movie_store = None
+# Serialized /api/recommend_by_title and /api/movie responses
+response_cache = ResponseCache(int(os.environ.get('CINESCOPE_CACHE_SIZE', RESPONSE_CACHE_SIZE)),
+                               float(os.environ.get('CINESCOPE_CACHE_TTL', RESPONSE_CACHE_TTL)))
+# Watchlists and feedback, persisted in SQLite (see storage.py)
+storage = None
+_storage_lock = threading.Lock()
+# With CINESCOPE_ONLINE_UPDATES=1, rated feedback is folded into the
+# recommendation models every CINESCOPE_UPDATE_INTERVAL seconds without
+# retraining (see CODE/online_update.py)
+ONLINE_UPDATES = os.environ.get('CINESCOPE_ONLINE_UPDATES') == '1'
+UPDATE_INTERVAL = float(os.environ.get('CINESCOPE_UPDATE_INTERVAL', 30))
+_update_thread = None
+# Only guards loading the models; scoring and online updates run without it
+# (updates publish a new bundle in one step, see recommend.apply_feedback)
+_models_ready = False
+_models_lock = threading.Lock()
+# Largest n /api/recommendations accepts: the depth of the precomputed
+# top-N (batch_recommend.TOP_N), so every answer can come from one row read
+MAX_RECOMMENDATIONS = 50
+# Request header asking for a Server-Timing breakdown of the response
+TRACE_HEADER = 'X-Cinescope-Trace'
 
-def load_dataset():
-    """Load and preprocess the MovieLens dataset"""
-    global movies_df, tfidf_matrix, tfidf_vectorizer
+def load_dataset(data_dir=None, mmap=False):
+    """
+    Load and preprocess the MovieLens dataset. With mmap, the TF-IDF matrix
+    and neighbor table are memory-mapped read-only from DATA/.cache so
+    forked workers share them (see serve.py).
+    """
+    global movies_df, tfidf_matrix, tfidf_vectorizer, title_index, movie_store
     
     print("Loading dataset...")
-    data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
-    
-    # Load movies metadata
-    movies_df = pd.read_csv(os.path.join(data_dir, 'movies_metadata.csv'), low_memory=False)
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(__file__), '..', 'DATA')
     
-    # Clean data
-    movies_df = movies_df[movies_df['id'].notna()]
-    movies_df = movies_df[movies_df['id'].str.isnumeric()]
-    movies_df['id'] = movies_df['id'].astype(int)
+    # Load cleaned movies metadata (numeric ids, genres parsed into name lists)
+    # from the columnar cache; the CSV is only re-read when it changes
+    with stage('load.movies'):
+        movies_df = load_movies(data_dir)
     
     # Fill missing values
     movies_df['overview'] = movies_df['overview'].fillna('')
     movies_df['title'] = movies_df['title'].fillna('Unknown')
-    movies_df['genres'] = movies_df['genres'].fillna('[]')
-    
-    # Parse genres (they're stored as JSON strings)
-    def parse_genres(genres_str):
-        try:
-            genres_list = eval(genres_str)
-            return ' '.join([g['name'] for g in genres_list])
-        except:
-            return ''
-    
-    movies_df['genres_text'] = movies_df['genres'].apply(parse_genres)
+    movies_df['year'] = movies_df['release_date'].astype(str).str[:4].where(movies_df['release_date'].notna(), '')
+    movies_df['genres_text'] = movies_df['genres'].apply(' '.join)
     
     # Create combined text for TF-IDF
     movies_df['combined_features'] = (
@@ -54,33 +77,92 @@ def load_dataset():
         movies_df['title']
     )
     
-    # Build TF-IDF matrix
+    # TF-IDF model and similar-movie lists, precomputed once (and cached on
+    # disk) instead of scoring the whole catalog per request; movies added
+    # to the end of the metadata are appended without a full rebuild
     print("Building TF-IDF model...")
-    tfidf_vectorizer = TfidfVectorizer(stop_words='english', max_features=5000)
-    tfidf_matrix = tfidf_vectorizer.fit_transform(movies_df['combined_features'])
+    tfidf_params = {'stop_words': 'english', 'max_features': 5000}
+    with stage('load.similarity'):
+        tfidf_vectorizer, tfidf_matrix, neighbors = load_content_index(
+            data_dir, movies_df['id'].values, movies_df['combined_features'].values, tfidf_params, mmap=mmap)
+    movie_store = MovieStore(movies_df, neighbors)
+    response_cache.clear()
+    
+    # Build title search index for autocomplete
+    print("Building title search index...")
+    with stage('load.title_index'):
+        title_index = TitleIndex(movies_df['title'])
     
     print(f"Loaded {len(movies_df)} movies")
-    print("Dataset ready! (Similarities computed on-demand)")
+    print("Dataset ready!")
 
-def fuzzy_match_score(query, title):
-    """Calculate fuzzy match score between query and title"""
-    query_lower = query.lower()
-    title_lower = title.lower()
-    
-    # Exact match gets highest score
-    if query_lower == title_lower:
-        return 1.0
-    
-    # Starts with query gets high score
-    if title_lower.startswith(query_lower):
-        return 0.9
-    
-    # Contains query gets medium score
-    if query_lower in title_lower:
-        return 0.7
-    
-    # Use SequenceMatcher for fuzzy matching
-    return SequenceMatcher(None, query_lower, title_lower).ratio()
+def _reset_storage():
+    # SQLite connections and the feedback writer and online update threads
+    # do not survive a fork; each worker process starts its own on first use
+    global storage, _storage_lock, _update_thread, _models_ready, _models_lock
+    storage = None
+    _storage_lock = threading.Lock()
+    _update_thread = None
+    _models_ready = False
+    _models_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_storage)
+
+def get_storage():
+    """Open the watchlist/feedback database on first use"""
+    global storage
+    if storage is None:
+        with _storage_lock:
+            if storage is None:
+                storage = Storage(os.environ.get('CINESCOPE_DB', DEFAULT_DB_PATH))
+                # Write queued feedback before the process exits
+                atexit.register(storage.close)
+    return storage
+
+def preload_models():
+    """
+    Load the model bundle, except NeuMF, before workers are forked (see
+    serve.py); get_recommend() adds NeuMF in each worker on first use
+    """
+    import recommend
+    with _models_lock:
+        if recommend.preload_bundle() is None:
+            print("No saved model artifacts to preload, workers load or train them on first use")
+
+def get_recommend():
+    """
+    The recommend module with its models loaded (on first use, as they need
+    TensorFlow) and, with online updates on, the feedback poller started
+    """
+    global _update_thread, _models_ready
+    import recommend
+    if not _models_ready:
+        with _models_lock:
+            if not _models_ready:
+                recommend.get_model_bundle()
+                if ONLINE_UPDATES and _update_thread is None:
+                    _update_thread = threading.Thread(target=_poll_feedback, name='online-updates', daemon=True)
+                    _update_thread.start()
+                _models_ready = True
+    return recommend
+
+def _poll_feedback():
+    import recommend
+    # Events up to the bundle's last_feedback_id were compacted into it
+    last_id = recommend.get_model_bundle().manifest.get('online', {}).get('last_feedback_id', 0)
+    while True:
+        time.sleep(UPDATE_INTERVAL)
+        try:
+            rows = get_storage().rated_feedback(last_id)
+            if not rows:
+                continue
+            ids, user_ids, movie_ids, ratings = zip(*rows)
+            with stage('online.update'):
+                num_users = recommend.apply_feedback(user_ids, movie_ids, ratings)
+            last_id = ids[-1]
+            print(f"Applied {len(rows)} feedback events for {num_users} users")
+        except Exception as e:
+            print(f"Online update failed, will retry: {e}")
 
 @app.route('/api/autocomplete', methods=['GET'])
 def autocomplete():
@@ -90,25 +172,26 @@ def autocomplete():
     if not query or len(query) < 2:
         return jsonify({'suggestions': []})
     
-    # Find matching movies
-    matches = []
-    for idx, row in movies_df.iterrows():
-        title = row['title']
-        score = fuzzy_match_score(query, title)
+    # Find matching movies (same ranking as scoring every title with
+    # search_index.fuzzy_match_score)
+    with stage('autocomplete.search'):
+        hits = title_index.search(query, limit=10, min_score=0.3)
+    
+    with stage('autocomplete.serialize'):
+        positions = [pos for _, pos in hits]
+        ids = movies_df['id'].values[positions]
+        years = movies_df['year'].values[positions]
         
-        if score > 0.3:  # Threshold for relevance
-            matches.append({
-                'title': title,
-                'id': int(row['id']),
+        suggestions = []
+        for (score, pos), movie_id, year in zip(hits, ids, years):
+            suggestions.append({
+                'title': title_index.titles[pos],
+                'id': int(movie_id),
                 'score': score,
-                'year': str(row.get('release_date', ''))[:4] if pd.notna(row.get('release_date')) else ''
+                'year': year
             })
-    
-    # Sort by score and limit to top 10
-    matches.sort(key=lambda x: x['score'], reverse=True)
-    suggestions = matches[:10]
-    
-    return jsonify({'suggestions': suggestions})
+        
+        return jsonify({'suggestions': suggestions})
 
 @app.route('/api/recommend_by_title', methods=['GET'])
 def recommend_by_title():
@@ -118,124 +201,55 @@ def recommend_by_title():
     if not title:
         return jsonify({'error': 'Title parameter required'}), 400
     
-    # Find the movie
-    movie_matches = movies_df[movies_df['title'].str.lower() == title.lower()]
-    
-    if movie_matches.empty:
-        return jsonify({'error': 'Movie not found'}), 404
-    
-    movie_idx = movie_matches.index[0]
-    movie_id = int(movie_matches.iloc[0]['id'])
-    
-    # Compute similarity scores on-demand (only for this movie)
-    movie_tfidf = tfidf_matrix[movie_idx]
-    sim_scores = cosine_similarity(movie_tfidf, tfidf_matrix)[0]
-    
-    # Get indices sorted by similarity
-    sim_indices = sim_scores.argsort()[::-1]
-    
-    # Get top 10 similar movies (excluding the movie itself)
-    sim_indices = sim_indices[1:11]
-    movie_indices = sim_indices.tolist()
-    
-    # Build response
-    similar_movies = []
-    for idx in movie_indices:
-        movie = movies_df.iloc[idx]
-        
-        # Parse genres for display
-        genres_list = []
-        try:
-            genres_data = eval(movie['genres'])
-            genres_list = [g['name'] for g in genres_data]
-        except:
-            pass
-        
-        # Get poster URL (using TMDB if available)
-        poster_url = f"https://image.tmdb.org/t/p/w500{movie.get('poster_path', '')}" if pd.notna(movie.get('poster_path')) else None
-        
-        similar_movies.append({
-            'id': int(movie['id']),
-            'title': movie['title'],
-            'rating': float(movie.get('vote_average', 0)) / 2,  # Convert 0-10 to 0-5
-            'genres': genres_list,
-            'poster': poster_url,
-            'year': str(movie.get('release_date', ''))[:4] if pd.notna(movie.get('release_date')) else '',
-            'overview': movie.get('overview', ''),
-            'runtime': f"{int(movie.get('runtime', 0))}min" if pd.notna(movie.get('runtime')) else '',
-            'releaseDate': movie.get('release_date', '')
-        })
-    
-    return jsonify({
-        'similar_movies': similar_movies,
-        'query_movie': title
-    })
+    key = ('recommend_by_title', title)
+    with stage('cache.lookup'):
+        body = response_cache.get(key)
+    if body is None:
+        body = movie_store.similar_json(title)
+        if body is None:
+            return jsonify({'error': 'Movie not found'}), 404
+        response_cache.put(key, body)
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/api/movie/<int:movie_id>', methods=['GET'])
 def get_movie_details(movie_id):
     """Get detailed information about a specific movie"""
-    movie = movies_df[movies_df['id'] == movie_id]
-    
-    if movie.empty:
-        return jsonify({'error': 'Movie not found'}), 404
-    
-    movie = movie.iloc[0]
-    
-    # Parse genres
-    genres_list = []
-    try:
-        genres_data = eval(movie['genres'])
-        genres_list = [g['name'] for g in genres_data]
-    except:
-        pass
-    
-    # Get poster and backdrop
-    poster_url = f"https://image.tmdb.org/t/p/w500{movie.get('poster_path', '')}" if pd.notna(movie.get('poster_path')) else None
-    backdrop_url = f"https://image.tmdb.org/t/p/original{movie.get('backdrop_path', '')}" if pd.notna(movie.get('backdrop_path')) else None
-    
+    key = ('movie', movie_id)
+    with stage('cache.lookup'):
+        body = response_cache.get(key)
+    if body is None:
+        with stage('movie.serialize'):
+            body = movie_store.details_json(movie_id)
+        if body is None:
+            return jsonify({'error': 'Movie not found'}), 404
+        response_cache.put(key, body)
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/api/recommendations/<int:user_id>', methods=['GET'])
+def get_user_recommendations(user_id):
+    """Personalized top-N movies for a user from the hybrid models"""
+    # type=int gives None (rather than the default) for a malformed n
+    n = request.args.get('n', type=int) if 'n' in request.args else 10
+    if n is None or not 1 <= n <= MAX_RECOMMENDATIONS:
+        return jsonify({'error': f'n must be an integer between 1 and {MAX_RECOMMENDATIONS}'}), 400
+    recs = get_recommend().get_recommendations(user_id, n=n)
+    # Movies added by feedback have no title until the next training run
     return jsonify({
-        'id': int(movie['id']),
-        'title': movie['title'],
-        'rating': float(movie.get('vote_average', 0)) / 2,
-        'genres': genres_list,
-        'poster': poster_url,
-        'backdrop': backdrop_url,
-        'year': str(movie.get('release_date', ''))[:4] if pd.notna(movie.get('release_date')) else '',
-        'overview': movie.get('overview', ''),
-        'runtime': f"{int(movie.get('runtime', 0))}min" if pd.notna(movie.get('runtime')) else '',
-        'releaseDate': movie.get('release_date', ''),
-        'popularity': float(movie.get('popularity', 0))
+        'user_id': user_id,
+        'recommendations': [{'title': title, 'score': score} for title, score in recs if isinstance(title, str)]
     })
 
 @app.route('/api/watchlist/<int:user_id>', methods=['GET'])
 def get_watchlist(user_id):
     """Get user's watchlist"""
-    movie_ids = watchlists.get(user_id, [])
+    with stage('watchlist.query'):
+        movie_ids = get_storage().watchlist(user_id)
     
-    watchlist_movies = []
-    for movie_id in movie_ids:
-        movie = movies_df[movies_df['id'] == movie_id]
-        if not movie.empty:
-            movie = movie.iloc[0]
-            
-            genres_list = []
-            try:
-                genres_data = eval(movie['genres'])
-                genres_list = [g['name'] for g in genres_data]
-            except:
-                pass
-            
-            poster_url = f"https://image.tmdb.org/t/p/w500{movie.get('poster_path', '')}" if pd.notna(movie.get('poster_path')) else None
-            
-            watchlist_movies.append({
-                'id': int(movie['id']),
-                'title': movie['title'],
-                'rating': float(movie.get('vote_average', 0)) / 2,
-                'genres': genres_list,
-                'poster': poster_url
-            })
-    
-    return jsonify({'watchlist': watchlist_movies})
+    with stage('watchlist.serialize'):
+        positions = [movie_store.position(movie_id) for movie_id in movie_ids]
+        watchlist_movies = [movie_store.summary(pos) for pos in positions if pos >= 0]
+        
+        return jsonify({'watchlist': watchlist_movies})
 
 @app.route('/api/watchlist/add', methods=['POST'])
 def add_to_watchlist():
@@ -247,11 +261,7 @@ def add_to_watchlist():
     if not movie_id:
         return jsonify({'error': 'movie_id required'}), 400
     
-    if user_id not in watchlists:
-        watchlists[user_id] = []
-    
-    if movie_id not in watchlists[user_id]:
-        watchlists[user_id].append(movie_id)
+    get_storage().add_to_watchlist(user_id, movie_id)
     
     return jsonify({'success': True})
 
@@ -262,19 +272,56 @@ def remove_from_watchlist():
     user_id = data.get('user_id', 1)
     movie_id = data.get('movie_id')
     
-    if user_id in watchlists and movie_id in watchlists[user_id]:
-        watchlists[user_id].remove(movie_id)
+    get_storage().remove_from_watchlist(user_id, movie_id)
     
     return jsonify({'success': True})
 
 @app.route('/api/feedback', methods=['POST'])
 def feedback():
     """Record user feedback (like/dislike)"""
-    data = request.json
-    # In a real app, you'd store this in a database
-    print(f"Feedback received: {data}")
+    data = request.get_json(silent=True)
+    
+    # Queued and written to the database in batches; malformed events are
+    # rejected here so they never reach the online model updates
+    try:
+        get_storage().record_feedback(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify({'success': True})
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Response cache size and hit rate"""
+    return jsonify(response_cache.stats())
+
+# Values owned elsewhere, read at scrape time; across workers the cache
+# numbers add up and every worker serves the same dataset
+REGISTRY.gauge('cinescope_movies_loaded', "Movies in the loaded dataset",
+               lambda: len(movies_df) if movies_df is not None else 0, merge='max')
+for _key, _help in [('size', "Cached responses"), ('hits', "Response cache hits"),
+                    ('misses', "Response cache misses"), ('evictions', "Response cache evictions")]:
+    REGISTRY.gauge(f'cinescope_response_cache_{_key}', _help, lambda key=_key: response_cache.stats()[key])
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request/stage latency histograms, counters and gauges in Prometheus text format (all workers under serve.py)"""
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def _start_request():
+    g.request_start = begin_request(trace=TRACE_HEADER in request.headers)
+
+@app.after_request
+def _finish_request(response):
+    if 'request_start' not in g:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    trace = end_request(endpoint, response.status_code, g.request_start)
+    if trace is not None:
+        trace.append(('total', time.perf_counter() - g.request_start))
+        response.headers['Server-Timing'] = server_timing(trace)
+    return response
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -290,8 +337,11 @@ if __name__ == '__main__':
     print("  GET  /api/autocomplete?query=<text>")
     print("  GET  /api/recommend_by_title?title=<movie>")
     print("  GET  /api/movie/<movie_id>")
+    print("  GET  /api/recommendations/<user_id>")
     print("  GET  /api/watchlist/<user_id>")
     print("  POST /api/watchlist/add")
     print("  DELETE /api/watchlist/remove")
+    print("  GET  /api/cache/stats")
+    print("  GET  /metrics")
     print("\nPress Ctrl+C to stop\n")
     app.run(debug=True, port=5000)
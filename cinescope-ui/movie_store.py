@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from similarity import topk_similarity, append_topk
+from instrumentation import stage
+
+POSTER_URL = 'https://image.tmdb.org/t/p/w500'
+BACKDROP_URL = 'https://image.tmdb.org/t/p/original'
+
+# Similar movies kept per movie (the endpoint returns the first NUM_SIMILAR)
+TOP_K = 50
+NUM_SIMILAR = 10
+
+# Serialized-response cache defaults
+RESPONSE_CACHE_SIZE = 4096
+RESPONSE_CACHE_TTL = 600
+
+# Catalog growth (as a fraction of the cached catalog) up to which new
+# movies are appended to the content index with a frozen vocabulary; past
+# it, TF-IDF is refit so IDF weights reflect the catalog again
+MAX_APPEND_FRACTION = 0.2
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of serialized responses with a time-to-live.
+
+    Entries older than ``ttl`` seconds are treated as misses and dropped;
+    past ``max_size`` entries the least recently used one is evicted.
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def _text(value):
+    return value if isinstance(value, str) else ''
+
+
+def _url(base, path):
+    return f"{base}{path}" if isinstance(path, str) else None
+
+
+def _number(value):
+    return 0.0 if pd.isna(value) else float(value)
+
+
+class MovieStore:
+    """
+    Id-indexed view of the movies table for the API.
+
+    Lookups by id or (case-insensitive) title are dict hits instead of
+    DataFrame scans; each movie's JSON payloads are serialized once, on
+    first use, and responses are assembled from those fragments. Similar
+    movies come from a precomputed top-K neighbor table.
+    """
+
+    def __init__(self, movies_df, neighbors):
+        self.movies_df = movies_df
+        self.neighbors = neighbors
+        self.ids = movies_df['id'].values
+        # First row wins for duplicate ids and titles, as the old scans did
+        self._by_id = {}
+        for pos, movie_id in enumerate(self.ids.tolist()):
+            self._by_id.setdefault(movie_id, pos)
+        self._by_title = {}
+        for pos, title in enumerate(movies_df['title'].str.lower().tolist()):
+            self._by_title.setdefault(title, pos)
+
+        # Plain Python columns so payloads are built without per-row pandas access
+        self._columns = {col: movies_df[col].tolist() for col in
+                         ['title', 'overview', 'genres', 'release_date', 'poster_path',
+                          'backdrop_path', 'vote_average', 'runtime', 'popularity']}
+        self._card_json = [None] * len(movies_df)
+        self._details_json = [None] * len(movies_df)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, movie_id):
+        """Row of a movie id, or -1 if unknown."""
+        return self._by_id.get(movie_id, -1)
+
+    def title_position(self, title):
+        """Row of the first movie with this title (case-insensitive), or -1."""
+        return self._by_title.get(title.lower(), -1)
+
+    # --- Payloads ---
+    def summary(self, pos):
+        """Short card (id, title, rating, genres, poster), e.g. for watchlists."""
+        c = self._columns
+        return {
+            'id': int(self.ids[pos]),
+            'title': c['title'][pos],
+            'rating': _number(c['vote_average'][pos]) / 2,  # Convert 0-10 to 0-5
+            'genres': list(c['genres'][pos]),
+            'poster': _url(POSTER_URL, c['poster_path'][pos]),
+        }
+
+    def card(self, pos):
+        """Summary plus year, overview, runtime and release date, as in similar-movie lists."""
+        c = self._columns
+        release_date = c['release_date'][pos]
+        runtime = c['runtime'][pos]
+        payload = self.summary(pos)
+        payload.update({
+            'year': release_date[:4] if isinstance(release_date, str) else '',
+            'overview': _text(c['overview'][pos]),
+            'runtime': f"{int(runtime)}min" if not pd.isna(runtime) else '',
+            'releaseDate': release_date,
+        })
+        return payload
+
+    def details(self, pos):
+        """Card plus backdrop and popularity, for the movie page."""
+        c = self._columns
+        payload = self.card(pos)
+        payload['backdrop'] = _url(BACKDROP_URL, c['backdrop_path'][pos])
+        payload['popularity'] = _number(c['popularity'][pos])
+        return payload
+
+    def card_json(self, pos):
+        payload = self._card_json[pos]
+        if payload is None:
+            payload = self._card_json[pos] = json.dumps(self.card(pos), sort_keys=True)
+        return payload
+
+    def details_json(self, movie_id):
+        """Serialized details of a movie id, or None if unknown."""
+        pos = self.position(movie_id)
+        if pos < 0:
+            return None
+        payload = self._details_json[pos]
+        if payload is None:
+            payload = self._details_json[pos] = json.dumps(self.details(pos), sort_keys=True)
+        return payload
+
+    def similar_json(self, title, n=NUM_SIMILAR):
+        """Serialized similar-movies response for a title, or None if not found."""
+        with stage('similar.lookup'):
+            pos = self.title_position(title)
+            if pos < 0:
+                return None
+            neighbors = self.neighbors[pos, :n].tolist()
+        with stage('similar.serialize'):
+            cards = ','.join(self.card_json(i) for i in neighbors)
+            return '{"query_movie":%s,"similar_movies":[%s]}' % (json.dumps(title), cards)
+
+
+# --- Content index ---
+def _catalog_hash(ids, texts, prefix):
+    """SHA-1 of the first ``prefix`` (id, text) rows (None if fewer) and of all of them."""
+    digest = hashlib.sha1()
+    prefix_hash = digest.hexdigest() if prefix == 0 else None
+    for i, (movie_id, text) in enumerate(zip(ids, texts)):
+        digest.update(f"{movie_id}\x1f{text}\x1e".encode())
+        if i + 1 == prefix:
+            prefix_hash = digest.hexdigest()
+    return prefix_hash, digest.hexdigest()
+
+
+def _save_npy(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _save_csr(directory, matrix):
+    for name in ['data', 'indices', 'indptr']:
+        _save_npy(os.path.join(directory, f"tfidf_{name}.npy"), getattr(matrix, name))
+
+
+def _load_csr(directory, shape, mmap_mode=None):
+    from scipy.sparse import csr_matrix
+
+    arrays = [np.load(os.path.join(directory, f"tfidf_{name}.npy"), mmap_mode=mmap_mode)
+              for name in ['data', 'indices', 'indptr']]
+    return csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+def load_content_index(data_dir, ids, texts, vectorizer_params, k=TOP_K, mmap=False):
+    """
+    TF-IDF vectorizer, matrix and top-k similar-movie table for the catalog
+    (aligned ``ids`` and ``texts``), with the vocabulary, matrix and table
+    cached in DATA/.cache/similar/.
+
+    If the catalog only gained rows at the end since the cache was built,
+    the vocabulary and IDF weights stay frozen: only the new texts are
+    vectorized and appended to the cached matrix, and only the new rows'
+    neighbors (and the old lists they enter) are computed, O(new x N)
+    instead of an O(N^2) rebuild. An unchanged catalog is loaded without
+    vectorizing anything. Any other change, or growth past
+    MAX_APPEND_FRACTION since the last fit, refits from scratch. With
+    mmap, the matrix and table are memory-mapped read-only, so forked
+    workers share one copy.
+    """
+    from scipy.sparse import vstack
+
+    key = json.dumps({'tfidf': vectorizer_params, 'k': k}, sort_keys=True)
+    cache_dir = os.path.join(data_dir, '.cache', 'similar', hashlib.sha1(key.encode()).hexdigest()[:16])
+    state_path = os.path.join(cache_dir, 'state.json')
+    neighbors_path = os.path.join(cache_dir, 'neighbors.npy')
+    scores_path = os.path.join(cache_dir, 'scores.npy')
+
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+    num_old = state['num_movies'] if state else 0
+    prefix_hash, full_hash = _catalog_hash(ids, texts, num_old)
+    mmap_mode = 'r' if mmap else None
+
+    appendable = (state is not None and prefix_hash == state['catalog_hash'] and 'tfidf_shape' in state
+                  and len(ids) - state['fitted_movies'] <= MAX_APPEND_FRACTION * state['fitted_movies'])
+    if appendable:
+        with open(os.path.join(cache_dir, 'vocabulary.json')) as f:
+            vectorizer = TfidfVectorizer(**vectorizer_params, vocabulary=json.load(f), dtype=np.float32)
+        vectorizer.idf_ = np.load(os.path.join(cache_dir, 'idf.npy'))
+        if num_old == len(ids):
+            return (vectorizer, _load_csr(cache_dir, tuple(state['tfidf_shape']), mmap_mode),
+                    np.load(neighbors_path, mmap_mode=mmap_mode))
+        print(f"Adding {len(ids) - num_old} movies to the top-{k} similar movies...")
+        # Rows are vectorized independently, so cached rows stay valid
+        matrix = vstack([_load_csr(cache_dir, tuple(state['tfidf_shape'])),
+                         vectorizer.transform(texts[num_old:])], format='csr')
+        fitted_movies = state['fitted_movies']
+        neighbors, scores = append_topk(matrix, num_old, np.load(neighbors_path), np.load(scores_path), k=k)
+    else:
+        print(f"Precomputing top-{k} similar movies...")
+        vectorizer = TfidfVectorizer(**vectorizer_params, dtype=np.float32)
+        matrix = vectorizer.fit_transform(texts)
+        neighbors, scores = topk_similarity(matrix, k=k)
+        fitted_movies = len(ids)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, 'vocabulary.json'), 'w') as f:
+            json.dump({term: int(i) for term, i in vectorizer.vocabulary_.items()}, f)
+        _save_npy(os.path.join(cache_dir, 'idf.npy'), vectorizer.idf_)
+
+    _save_csr(cache_dir, matrix)
+    _save_npy(neighbors_path, neighbors)
+    _save_npy(scores_path, scores)
+    # Written last: the matrix and table files match it once it is in place
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'num_movies': len(ids), 'fitted_movies': fitted_movies, 'catalog_hash': full_hash,
+                   'tfidf_shape': list(matrix.shape)}, f)
+    os.replace(tmp_path, state_path)
+    if mmap:
+        return vectorizer, _load_csr(cache_dir, matrix.shape, mmap_mode), np.load(neighbors_path, mmap_mode=mmap_mode)
+    return vectorizer, matrix, neighbors
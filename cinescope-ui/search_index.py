@@ -0,0 +1,221 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+
+import numpy as np
+
+# Character buckets used for the fuzzy upper bound: a-z, 0-9, space, and a
+# hashed bucket range for everything else (punctuation, accented letters, ...)
+_NUM_BUCKETS = 64
+_PAD = 255
+
+# Fuzzy candidates are refined in blocks, best upper bound first
+_BLOCK_SIZE = 512
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _bucket(ch):
+    o = ord(ch)
+    if 97 <= o <= 122:
+        return o - 97
+    if 48 <= o <= 57:
+        return o - 22
+    if o == 32:
+        return 36
+    return 37 + o % (_NUM_BUCKETS - 37)
+
+
+def fuzzy_match_score(query, title):
+    """
+    Reference scorer TitleIndex reproduces: 1.0 for an exact match, 0.9 if
+    the title starts with the query, 0.7 if it contains it, otherwise the
+    SequenceMatcher ratio (all case-insensitive).
+    """
+    query_lower = query.lower()
+    title_lower = title.lower()
+    if query_lower == title_lower:
+        return 1.0
+    if title_lower.startswith(query_lower):
+        return 0.9
+    if query_lower in title_lower:
+        return 0.7
+    return SequenceMatcher(None, query_lower, title_lower).ratio()
+
+
+class TitleIndex:
+    """
+    Search index over movie titles, built once at load time.
+
+    Reproduces the scoring of ``fuzzy_match_score`` (1.0 exact, 0.9 starts-with,
+    0.7 contains, otherwise ``SequenceMatcher.ratio``) without scanning every
+    title per query:
+
+    - exact matches come from a dict keyed by lowercase title
+    - starts-with matches come from a bisect over the sorted lowercase titles
+    - contains matches come from a character 2/3-gram inverted index
+    - fuzzy candidates are narrowed with two vectorized upper bounds on the
+      ratio, a character-count bound (as in ``SequenceMatcher.quick_ratio``)
+      and a bit-parallel longest-common-subsequence bound, so only titles
+      that could still make the top results are scored
+    """
+
+    def __init__(self, titles):
+        self.titles = [str(t) for t in titles]
+        self._lower = [t.lower() for t in self.titles]
+        n = len(self._lower)
+
+        # Exact tier
+        self._exact = {}
+        for pos, t in enumerate(self._lower):
+            self._exact.setdefault(t, []).append(pos)
+
+        # Starts-with tier
+        order = sorted(range(n), key=self._lower.__getitem__)
+        self._sorted_titles = [self._lower[i] for i in order]
+        self._sorted_pos = np.array(order, dtype=np.int32)
+
+        # Contains tier: bigram and trigram postings (sorted row positions)
+        grams = {}
+        for pos, t in enumerate(self._lower):
+            for g in {t[i:i + size] for size in (2, 3) for i in range(len(t) - size + 1)}:
+                grams.setdefault(g, []).append(pos)
+        self._grams = {g: np.array(p, dtype=np.int32) for g, p in grams.items()}
+
+        # Fuzzy tier: per-bucket character counts (bucket-major), lengths and
+        # padded bucket codes for the LCS bound
+        self._lengths = np.array([len(t) for t in self._lower], dtype=np.int64)
+        width = int(self._lengths.max()) if n else 0
+        self._char_counts = np.zeros((_NUM_BUCKETS, n), dtype=np.uint16)
+        self._codes = np.full((n, width), _PAD, dtype=np.uint8)
+        for pos, t in enumerate(self._lower):
+            for i, ch in enumerate(t):
+                b = _bucket(ch)
+                self._char_counts[b, pos] += 1
+                self._codes[pos, i] = b
+
+    def __len__(self):
+        return len(self.titles)
+
+    def search(self, query, limit=10, min_score=0.3):
+        """
+        Return up to ``limit`` (score, position) pairs ordered by score, then
+        by row position, exactly as a full scan with ``fuzzy_match_score``.
+        """
+        q = query.lower()
+        if not q:
+            return []
+
+        # 1.0 / 0.9 / 0.7 tiers, each already in row order
+        exact = self._exact.get(q, [])
+        lo = bisect_left(self._sorted_titles, q)
+        hi = bisect_right(self._sorted_titles, q + '\U0010ffff', lo)
+        prefix = np.sort(self._sorted_pos[lo + len(exact):hi])
+        contains = self._contains(q, limit)
+
+        hits = [(1.0, p) for p in exact[:limit]]
+        hits += [(0.9, int(p)) for p in prefix[:limit - len(hits)]]
+        hits += [(0.7, p) for p in contains[:limit - len(hits)]]
+
+        # A fuzzy ratio is below 1.0 unless the strings are equal
+        threshold = hits[-1][0] if len(hits) >= limit else min_score
+        if threshold >= 1.0:
+            return hits
+
+        fuzzy = self._fuzzy(q, threshold, min_score, limit, hits)
+        return heapq.nsmallest(limit, hits + fuzzy, key=lambda h: (-h[0], h[1]))
+
+    def _contains(self, q, limit=None):
+        """Row positions whose title contains ``q`` past its first character."""
+        if len(q) < 2:
+            found = [p for p, t in enumerate(self._lower) if t.find(q) > 0]
+            return found[:limit]
+
+        size = 2 if len(q) == 2 else 3
+        postings = []
+        for i in range(len(q) - size + 1):
+            posting = self._grams.get(q[i:i + size])
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = postings[0]
+        for posting in postings[1:3]:
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+
+        found = []
+        for p in candidates.tolist():
+            if self._lower[p].find(q) > 0:
+                found.append(p)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def _fuzzy(self, q, threshold, min_score, limit, hits):
+        """Score only the titles whose ratio upper bound can reach the top results."""
+        matched = np.zeros(len(self), dtype=np.uint16)
+        query_counts = {}
+        for ch in q:
+            b = _bucket(ch)
+            query_counts[b] = query_counts.get(b, 0) + 1
+        for b, count in query_counts.items():
+            matched += np.minimum(self._char_counts[b], count)
+        bound = 2.0 * matched / (self._lengths + len(q))
+        remaining = np.flatnonzero((bound > min_score) & (bound >= threshold))
+
+        # Min-heap of the current top results, keyed so the worst is on top
+        top = [(h[0], -h[1]) for h in hits]
+        heapq.heapify(top)
+        found = []
+        while len(remaining):
+            # Next block of best character-count bounds, the rest stays unsorted
+            if len(remaining) > _BLOCK_SIZE:
+                part = np.argpartition(-bound[remaining], _BLOCK_SIZE - 1)
+                block, remaining = remaining[part[:_BLOCK_SIZE]], remaining[part[_BLOCK_SIZE:]]
+            else:
+                block, remaining = remaining, remaining[:0]
+
+            block_bound = np.minimum(bound[block], self._lcs_bound(q, block))
+            for i in np.lexsort((block, -block_bound)).tolist():
+                if len(top) >= limit and block_bound[i] < top[0][0]:
+                    break
+                p = int(block[i])
+                if block_bound[i] <= min_score or q in self._lower[p]:
+                    continue  # hopeless, or already scored by the substring tiers
+                score = SequenceMatcher(None, q, self._lower[p]).ratio()
+                if score <= min_score:
+                    continue
+                found.append((score, p))
+                heapq.heappush(top, (score, -p))
+                if len(top) > limit:
+                    heapq.heappop(top)
+
+            if len(top) >= limit:
+                remaining = remaining[bound[remaining] >= top[0][0]]
+        return found
+
+    def _lcs_bound(self, q, rows):
+        """
+        Upper bound on ``SequenceMatcher(None, q, title).ratio()`` for ``rows``.
+
+        Matching blocks form a common subsequence, so ``2 * LCS / total_len``
+        bounds the ratio. LCS is computed over character buckets (which can
+        only make it longer) with the Hyyro bit-vector recurrence, vectorized
+        over all rows at once.
+        """
+        if len(q) > 64:
+            return np.ones(len(rows))
+        masks = np.zeros(256, dtype=np.uint64)
+        for i, ch in enumerate(q):
+            masks[_bucket(ch)] |= np.uint64(1 << i)
+        full = np.uint64((1 << len(q)) - 1)
+
+        lengths = self._lengths[rows]
+        codes = self._codes[rows, :lengths.max()]
+        v = np.full(len(rows), full, dtype=np.uint64)
+        for j in range(codes.shape[1]):
+            u = v & masks[codes[:, j]]
+            v = ((v + u) | (v - u)) & full
+        ones = _POPCOUNT[v.view(np.uint8)].reshape(len(rows), 8).sum(axis=1)
+        lcs = len(q) - ones
+        return 2.0 * lcs / (lengths + len(q))
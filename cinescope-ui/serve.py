@@ -0,0 +1,285 @@
+"""
+Production entry point for the CineScope API.
+
+The dataset and model bundle are loaded once in the master process, then
+worker processes are forked from it. Workers share the master's memory
+copy-on-write, and the TF-IDF matrix, neighbor tables and model arrays
+are memory-mapped read-only, so adding workers does not add copies of
+them. Only the NeuMF network is loaded per worker, as TensorFlow cannot
+be used across a fork.
+
+    python serve.py --workers 4                  # prefork WSGI (gunicorn if installed)
+    python serve.py --workers 4 --asgi           # ASGI workers (needs uvicorn)
+    gunicorn --preload -w 4 'serve:create_app()' # or any WSGI server with preloading
+
+Without gunicorn, a built-in prefork server runs threaded Werkzeug servers
+in forked workers, all accepting from one shared listening socket.
+"""
+import io
+import os
+import gc
+import sys
+import asyncio
+import signal
+import socket
+import argparse
+import tempfile
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import backend
+import instrumentation
+
+# Threads per ASGI worker running the (synchronous) Flask app
+ASGI_THREADS = 8
+
+def preload(data_dir=None):
+    """Load everything the workers serve, before any fork."""
+    # Each worker keeps its own metrics; /metrics merges them through
+    # per-process snapshot files in this directory
+    instrumentation.enable_multiprocess(os.environ.get('CINESCOPE_METRICS_DIR')
+                                        or tempfile.mkdtemp(prefix='cinescope-metrics-'))
+    backend.load_dataset(data_dir, mmap=True)
+    # Model bundle too (its arrays are memory-mapped), except NeuMF:
+    # TensorFlow's runtime does not survive a fork, so each worker loads the
+    # NeuMF weights on its first recommendation request
+    backend.preload_models()
+    # Move the loaded objects out of the garbage collector's generations so
+    # collections in the workers do not write to (and so copy) their pages
+    gc.collect()
+    gc.freeze()
+
+def create_app(data_dir=None):
+    """Preloaded WSGI app, e.g. for ``gunicorn --preload 'serve:create_app()'``."""
+    preload(data_dir)
+    return backend.app
+
+def create_asgi_app(data_dir=None, threads=ASGI_THREADS):
+    """ASGI app for async servers, running the preloaded Flask app on a thread pool."""
+    preload(data_dir)
+    return ThreadPoolASGI(backend.app, threads)
+
+# --- ASGI adapter ---
+def _wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its full request body."""
+    server = scope.get('server') or ('localhost', 80)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').lower()
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body is read in full, chunked or not
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+class ThreadPoolASGI:
+    """
+    ASGI adapter that runs a WSGI app on a pool of ``threads`` threads, so
+    a slow I/O-bound route (watchlist, feedback) does not hold up the
+    others. (asgiref's WsgiToAsgi runs every request on one shared thread.)
+
+    The request body is read before the app runs and the response is
+    buffered before it is sent; the API only returns small JSON bodies.
+    """
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        # Threads start on first use, so in each worker after the fork
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(self.executor, self._run, scope, bytes(body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    def _run(self, scope, body):
+        """Call the WSGI app in a pool thread; returns (status, headers, body chunks)."""
+        response = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+            return chunks.append
+
+        result = self.wsgi_app(_wsgi_environ(scope, body), start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+# --- Built-in prefork server ---
+def _serve_worker(sock, host, port):
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = make_server(host, port, backend.app, threaded=True, fd=sock.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        # Write queued feedback before exiting
+        if backend.storage is not None:
+            backend.storage.close()
+
+def run_prefork(host='0.0.0.0', port=5000, workers=None):
+    """
+    Fork ``workers`` processes that accept from one listening socket and
+    restart any that die. SIGINT/SIGTERM stop the workers and the master.
+    """
+    workers = workers or os.cpu_count() or 1
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _serve_worker(sock, host, port)
+            except SystemExit:
+                pass
+            except BaseException as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            os._exit(code)
+        children.add(pid)
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {workers} workers (master pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited, restarting")
+            spawn()
+    sock.close()
+
+# --- Optional servers ---
+def run_gunicorn(app, host, port, workers, threads=4, worker_class='gthread'):
+    """Serve an already loaded app with gunicorn; workers fork from this process."""
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', worker_class)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return app
+
+    PreloadedApplication().run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the CineScope API with preloaded, fork-shared state")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=4, help="request threads per worker (gunicorn or ASGI)")
+    parser.add_argument('--data-dir', default=None)
+    parser.add_argument('--asgi', action='store_true', help="serve the ASGI app with uvicorn workers")
+    parser.add_argument('--builtin', action='store_true', help="use the built-in prefork server even if gunicorn is installed")
+    args = parser.parse_args()
+
+    has_gunicorn = importlib.util.find_spec('gunicorn') is not None and not args.builtin
+
+    if args.asgi:
+        if importlib.util.find_spec('uvicorn') is None:
+            sys.exit("--asgi needs uvicorn: pip install uvicorn")
+        app = create_asgi_app(args.data_dir, args.threads)
+        if has_gunicorn:
+            run_gunicorn(app, args.host, args.port, args.workers, worker_class='uvicorn.workers.UvicornWorker')
+        else:
+            # uvicorn alone cannot fork a preloaded app, so run one process
+            import uvicorn
+            print("gunicorn not installed, serving the ASGI app in a single process")
+            uvicorn.run(app, host=args.host, port=args.port)
+        return
+
+    preload(args.data_dir)
+    if has_gunicorn:
+        run_gunicorn(backend.app, args.host, args.port, args.workers, args.threads)
+    else:
+        run_prefork(args.host, args.port, args.workers)
+
+if __name__ == '__main__':
+    main()
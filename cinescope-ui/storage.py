@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cinescope.db')
+
+POOL_SIZE = 4
+# Feedback events are written in batches of up to FEEDBACK_BATCH_SIZE, at
+# least every FEEDBACK_FLUSH_INTERVAL seconds
+FEEDBACK_BATCH_SIZE = 256
+FEEDBACK_FLUSH_INTERVAL = 1.0
+# Rating stored for like/dislike feedback that carries no explicit rating
+FEEDBACK_RATINGS = {'like': 5.0, 'dislike': 1.0}
+# Accepted range of explicit ratings (the MovieLens scale)
+MIN_RATING = 0.5
+MAX_RATING = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watchlist (
+    user_id INTEGER NOT NULL,
+    movie_id INTEGER NOT NULL,
+    added_at REAL NOT NULL,
+    UNIQUE (user_id, movie_id)
+);
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    movie_id INTEGER,
+    rating REAL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedback_user ON feedback (user_id);
+"""
+
+
+def _parse_id(value, name):
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        parsed = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if isinstance(value, float) and value != parsed:
+        raise ValueError(f"{name} must be an integer")
+    return parsed
+
+
+def parse_feedback(event):
+    """
+    (user_id, movie_id, rating) of a feedback event, or ValueError if it is
+    not one. Ids must parse as integers; the rating is the event's 'rating'
+    (a number in [MIN_RATING, MAX_RATING]), or else FEEDBACK_RATINGS of its
+    'feedback' (or 'action', as the web UI sends it).
+    """
+    if not isinstance(event, dict):
+        raise ValueError("feedback must be a JSON object")
+    user_id = _parse_id(event.get('user_id'), 'user_id')
+    movie_id = _parse_id(event.get('movie_id'), 'movie_id')
+    rating = event.get('rating')
+    if rating is not None:
+        if not isinstance(rating, (int, float)) or isinstance(rating, bool) or not MIN_RATING <= rating <= MAX_RATING:
+            raise ValueError(f"rating must be a number between {MIN_RATING} and {MAX_RATING}")
+        return user_id, movie_id, float(rating)
+    kind = event.get('feedback', event.get('action'))
+    if kind not in FEEDBACK_RATINGS:
+        raise ValueError(f"feedback must be a rating or one of {sorted(FEEDBACK_RATINGS)}")
+    return user_id, movie_id, FEEDBACK_RATINGS[kind]
+
+
+class ConnectionPool:
+    """
+    Fixed set of SQLite connections shared between threads; each is used by
+    one thread at a time. Connections run in WAL mode, so readers never
+    block the writer and a commit is one append to the log.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class Storage:
+    """
+    Persistent watchlists and feedback for the API, safe to use from many
+    request threads.
+
+    Watchlists are sets of (user_id, movie_id) rows: adding twice is a
+    no-op and reads are one indexed query in insertion order. Feedback is
+    write-behind: record_feedback only queues the event and a background
+    thread inserts queued events in batched transactions.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, pool_size=POOL_SIZE, batch_size=FEEDBACK_BATCH_SIZE,
+                 flush_interval=FEEDBACK_FLUSH_INTERVAL):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = queue.Queue()
+        self._batch_ready = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._writer = threading.Thread(target=self._write_behind, name='feedback-writer', daemon=True)
+        self._writer.start()
+
+    # --- Watchlist ---
+    def watchlist(self, user_id):
+        """Movie ids on a user's watchlist, oldest first."""
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT movie_id FROM watchlist WHERE user_id = ? ORDER BY added_at, rowid',
+                                (user_id,)).fetchall()
+        return [movie_id for (movie_id,) in rows]
+
+    def add_to_watchlist(self, user_id, movie_id):
+        """Add a movie; returns False if it was already on the watchlist."""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('INSERT OR IGNORE INTO watchlist (user_id, movie_id, added_at) VALUES (?, ?, ?)',
+                                  (user_id, movie_id, time.time()))
+        return cursor.rowcount > 0
+
+    def remove_from_watchlist(self, user_id, movie_id):
+        """Remove a movie; returns False if it was not on the watchlist."""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('DELETE FROM watchlist WHERE user_id = ? AND movie_id = ?', (user_id, movie_id))
+        return cursor.rowcount > 0
+
+    # --- Feedback ---
+    def record_feedback(self, event):
+        """
+        Queue a feedback event (a JSON-serializable dict) for the background
+        writer. Raises ValueError, without queuing it, if the event has no
+        valid ids and rating (see parse_feedback).
+        """
+        user_id, movie_id, rating = parse_feedback(event)
+        self._pending.put((user_id, movie_id, rating, json.dumps(event), time.time()))
+        if self._pending.qsize() >= self.batch_size:
+            # Full batch: let the writer flush now rather than at its next tick
+            self._batch_ready.set()
+
+    def feedback(self, user_id=None):
+        """Stored feedback events (flushing queued ones first), oldest first."""
+        self.flush()
+        query = 'SELECT payload FROM feedback'
+        params = ()
+        if user_id is not None:
+            query += ' WHERE user_id = ?'
+            params = (user_id,)
+        with self.pool.connection() as conn:
+            rows = conn.execute(query + ' ORDER BY id', params).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def rated_feedback(self, after_id=0, limit=None):
+        """
+        Stored events with a user, movie and rating and id > after_id, as
+        (id, user_id, movie_id, rating) tuples, oldest first.
+        """
+        query = ('SELECT id, user_id, movie_id, rating FROM feedback WHERE id > ? AND rating IS NOT NULL '
+                 'AND user_id IS NOT NULL AND movie_id IS NOT NULL ORDER BY id')
+        params = (after_id,)
+        if limit is not None:
+            query += ' LIMIT ?'
+            params += (limit,)
+        with self.pool.connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def flush(self):
+        """Write every queued feedback event now; returns how many were written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._pending.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return written
+                with self.pool.connection() as conn:
+                    try:
+                        conn.execute('BEGIN')
+                        conn.executemany('INSERT INTO feedback (user_id, movie_id, rating, payload, created_at) '
+                                         'VALUES (?, ?, ?, ?, ?)', batch)
+                        conn.execute('COMMIT')
+                    except sqlite3.Error:
+                        if conn.in_transaction:
+                            conn.execute('ROLLBACK')
+                        # Keep the events for the next flush
+                        for item in batch:
+                            self._pending.put(item)
+                        raise
+                written += len(batch)
+
+    def _write_behind(self):
+        while not self._stopped.is_set():
+            self._batch_ready.wait(self.flush_interval)
+            self._batch_ready.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Feedback write failed, will retry: {e}")
+
+    def close(self):
+        """Stop the writer, write what is still queued and close the connections."""
+        self._stopped.set()
+        self._batch_ready.set()
+        self._writer.join()
+        self.flush()
+        self.pool.close()
@@ -0,0 +1,32 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+for path in ['CODE', 'bench', 'cinescope-ui']:
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+
+@pytest.fixture(scope='session')
+def trained_artifacts(tmp_path_factory):
+    """Data directory and artifact root of a bundle trained once on the 'tiny' synthetic dataset."""
+    from synthetic import generate_dataset
+    from train import train_all_models
+
+    base = tmp_path_factory.mktemp('bundle')
+    data_dir = str(base / 'data')
+    artifact_root = str(base / 'artifacts')
+    generate_dataset(data_dir, 'tiny')
+    train_all_models(data_dir, artifact_root, neumf_epochs=1)
+    return data_dir, artifact_root
+
+
+@pytest.fixture
+def artifact_root(trained_artifacts, tmp_path):
+    """Private copy of the trained bundle, so tests can write new versions to it."""
+    root = str(tmp_path / 'artifacts')
+    shutil.copytree(trained_artifacts[1], root)
+    return root
@@ -0,0 +1,10 @@
+import pytest
+
+import backend
+
+
+@pytest.mark.parametrize('n', ['0', '-5', '51', '1000000', 'ten'])
+def test_recommendations_reject_bad_n(n):
+    response = backend.app.test_client().get(f'/api/recommendations/1?n={n}')
+    assert response.status_code == 400
+    assert 'between 1 and 50' in response.get_json()['error']
@@ -0,0 +1,36 @@
+import numpy as np
+
+from artifacts import load_artifacts, save_hybrid_weights
+from hybrid import HybridRecommender, DEFAULT_WEIGHTS, hybrid_recommendation
+from online_update import OnlineUpdater
+
+
+def test_weights_default_until_bundle_is_tuned(artifact_root):
+    bundle = load_artifacts(artifact_root)
+    assert bundle.hybrid_weights is None
+    assert HybridRecommender.from_bundle(bundle).weights.tolist() == DEFAULT_WEIGHTS
+
+    save_hybrid_weights({'weights': [0.5, 0.2, 0.3]}, artifact_root)
+    tuned = load_artifacts(artifact_root)
+    assert HybridRecommender.from_bundle(tuned).weights.tolist() == [0.5, 0.2, 0.3]
+    # Explicit weights and direct construction ignore the bundle's
+    assert HybridRecommender.from_bundle(tuned, DEFAULT_WEIGHTS).weights.tolist() == DEFAULT_WEIGHTS
+    assert HybridRecommender(tuned.cf_model, tuned.cbf_model, None).weights.tolist() == DEFAULT_WEIGHTS
+
+    # Compaction writes a new bundle version with the same weights
+    OnlineUpdater(tuned).compact(artifact_root)
+    compacted = load_artifacts(artifact_root)
+    assert compacted.manifest['created_at'] != tuned.manifest['created_at']
+    assert compacted.hybrid_weights['weights'] == [0.5, 0.2, 0.3]
+
+
+def test_hybrid_recommendation_does_no_file_io(artifact_root, monkeypatch):
+    bundle = load_artifacts(artifact_root, load_neumf_model=False)
+    user_id = int(bundle.cf_model.user_index[0])
+    movie_id = int(bundle.cf_model.movie_index[0])
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("hybrid_recommendation opened a file")
+    monkeypatch.setattr('builtins.open', no_open)
+    score = hybrid_recommendation(user_id, movie_id, bundle.cf_model, bundle.cbf_model, None)
+    assert np.isfinite(score)
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import instrumentation
+from instrumentation import Registry, merge_snapshots, render_snapshot
+
+
+@pytest.fixture
+def multiprocess(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'REGISTRY', Registry())
+    monkeypatch.setattr(instrumentation, '_stage_histograms', {})
+    monkeypatch.setattr(instrumentation, '_metrics_dir', None)
+    (tmp_path / '999999999.json').write_text('{}')  # left over from an earlier run
+    instrumentation.enable_multiprocess(str(tmp_path))
+    return tmp_path
+
+
+def run_worker(fn):
+    """Run ``fn`` in a forked child that writes its snapshot and exits."""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            fn()
+            instrumentation.write_snapshot()
+        except BaseException:
+            code = 1
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_merge_sums_counters_and_histograms():
+    a, b = Registry(), Registry()
+    for registry, values in [(a, [0.001, 0.2]), (b, [0.3])]:
+        for value in values:
+            registry.counter('requests_total', "Requests", endpoint='x').inc()
+            registry.histogram('request_seconds', "Latency", endpoint='x').observe(value)
+    b.counter('requests_total', "Requests", endpoint='y').inc(5)
+    a.gauge('loaded', "Loaded", lambda: 10, merge='max')
+    b.gauge('loaded', "Loaded", lambda: 7, merge='max')
+    a.gauge('cached', "Cached", lambda: 3)
+    b.gauge('cached', "Cached", lambda: 4)
+
+    text = render_snapshot(merge_snapshots([a.snapshot(), b.snapshot()]))
+    assert 'requests_total{endpoint="x"} 3' in text
+    assert 'requests_total{endpoint="y"} 5' in text
+    assert 'request_seconds_bucket{endpoint="x",le="0.25"} 2' in text
+    assert 'request_seconds_bucket{endpoint="x",le="+Inf"} 3' in text
+    assert 'request_seconds_count{endpoint="x"} 3' in text
+    assert 'loaded 10' in text
+    assert 'cached 7' in text
+
+
+def test_render_metrics_merges_forked_workers(multiprocess):
+    registry = instrumentation.REGISTRY
+    registry.gauge('cinescope_test_cached', "Cached", lambda: 1)
+    with instrumentation.stage('load.dataset'):
+        pass
+    registry.counter('cinescope_requests_total', "Requests", endpoint='a', status=200).inc()
+
+    def worker():
+        # Starts from zero rather than from the parent's copy
+        assert instrumentation.REGISTRY.snapshot()['cinescope_test_cached']['series'] == [[[], 1]]
+        assert 'cinescope_stage_seconds' not in instrumentation.REGISTRY.snapshot()
+        instrumentation.end_request('a', 200, instrumentation.begin_request())
+        instrumentation.end_request('b', 404, instrumentation.begin_request())
+
+    run_worker(worker)
+    run_worker(worker)
+
+    text = instrumentation.render_metrics()
+    assert 'cinescope_requests_total{endpoint="a",status="200"} 3' in text
+    assert 'cinescope_requests_total{endpoint="b",status="404"} 2' in text
+    assert 'cinescope_request_seconds_count{endpoint="a"} 2' in text
+    assert 'cinescope_stage_seconds_count{stage="load.dataset"} 1' in text
+    # Exited workers' gauges are dropped, the live parent's is kept
+    assert 'cinescope_test_cached 1' in text
+    assert not (multiprocess / '999999999.json').exists()
@@ -0,0 +1,126 @@
+import numpy as np
+
+from artifacts import load_artifacts
+from online_update import OnlineUpdater, clean_events
+
+
+def test_clean_events_drops_malformed_rows():
+    users, movies, ratings, valid = clean_events(['abc', 1, '2', 3, None, 4], [10, 11, 12, 'x', 14, 15],
+                                                 [4, 5, 3.5, 3, 3, 7])
+    assert valid.tolist() == [False, True, True, False, False, False]
+    assert users.dtype == np.int64 and movies.dtype == np.int64 and ratings.dtype == np.float32
+    assert users.tolist() == [1, 2] and movies.tolist() == [11, 12] and ratings.tolist() == [5.0, 3.5]
+
+
+def test_clean_events_drops_out_of_range_ids():
+    big = 2 ** 31
+    users, movies, ratings, valid = clean_events(
+        ['inf', 1e30, True, 1, np.nan, big - 1, big, 5, 6, 7],
+        [10, 11, 12, '-inf', 14, 15, 16, np.float64('inf'), np.True_, 19],
+        [4, 4, 4, 4, 4, 4, 4, 4, 4, True])
+    assert valid.tolist() == [False, False, False, False, False, True, False, False, False, False]
+    assert users.tolist() == [big - 1] and movies.tolist() == [15]
+
+
+def test_compact_fresh_bundle(artifact_root):
+    bundle = load_artifacts(artifact_root)
+    neighbors = np.array(bundle.cf_model.neighbors)
+    OnlineUpdater(bundle).compact(artifact_root)
+
+    reloaded = load_artifacts(artifact_root)
+    assert reloaded.manifest['created_at'] != bundle.manifest['created_at']
+    np.testing.assert_array_equal(reloaded.cf_model.neighbors, neighbors)
+
+
+def test_apply_skips_malformed_events(artifact_root):
+    bundle = load_artifacts(artifact_root)
+    user_id = int(bundle.user_encoder.classes_[0])
+    movie_id = int(bundle.movie_encoder.classes_[0])
+    num_users = len(bundle.user_encoder.classes_)
+    updater = OnlineUpdater(bundle)
+
+    assert updater.apply(['abc', user_id, str(user_id)], [movie_id, movie_id, movie_id], [4.0, 4.0, 9.0]) == 1
+    assert len(bundle.user_encoder.classes_) == num_users
+    assert bundle.user_encoder.classes_.dtype.kind == 'i'
+
+    updater.compact(artifact_root)
+    reloaded = load_artifacts(artifact_root)
+    row = reloaded.cf_model.user_index.get_loc(user_id)
+    col = reloaded.cf_model.movie_index.get_loc(movie_id)
+    assert reloaded.cf_model.user_item_matrix[row, col] == 4.0
+
+
+def test_add_movies_then_compact(artifact_root):
+    import pandas as pd
+
+    bundle = load_artifacts(artifact_root)
+    known = bundle.movies.iloc[0]
+    new_id = int(bundle.movies['id'].max()) + 1
+    overview = bundle.cbf_model.tfidf.inverse_transform(bundle.cbf_model.tfidf_matrix[0])[0]
+    movies = pd.DataFrame({'id': [new_id, int(known['id'])], 'title': ['Brand New Movie', known['title']],
+                           'overview': [' '.join(overview), '']})
+    updater = OnlineUpdater(bundle)
+    assert updater.add_movies(movies) == 1
+    updater.compact(artifact_root)
+
+    reloaded = load_artifacts(artifact_root)
+    cbf = reloaded.cbf_model
+    assert new_id in set(reloaded.movies['id'])
+    position = cbf.movie_positions[cbf.movie_index.get_loc(new_id)]
+    # Same overview terms as the first movie, so it is the closest neighbor
+    assert cbf.neighbor_indices[position, 0] == 0
+    assert reloaded.titles[new_id] == 'Brand New Movie'
+
+
+def test_apply_leaves_previous_bundle_intact(artifact_root):
+    bundle = load_artifacts(artifact_root)
+    user_id = int(bundle.user_encoder.classes_[0])
+    new_user = int(bundle.user_encoder.classes_.max()) + 1
+    movie_id = int(bundle.movie_encoder.classes_[0])
+    matrix = bundle.cf_model.user_item_matrix
+    embeddings = bundle.neumf_model.user_embedding.embeddings.numpy()
+    updater = OnlineUpdater(bundle)
+
+    assert updater.apply([user_id, new_user], [movie_id, movie_id], [5.0, 1.0]) == 2
+    assert updater.bundle is not bundle
+    assert bundle.cf_model.user_item_matrix is matrix
+    assert new_user not in bundle.cf_model.user_index and new_user not in bundle.user_encoder.classes_
+    np.testing.assert_array_equal(bundle.neumf_model.user_embedding.embeddings.numpy(), embeddings)
+    assert new_user in updater.bundle.cf_model.user_index and new_user in updater.bundle.user_encoder.classes_
+    assert updater.bundle.neumf_model.user_embedding.input_dim == len(embeddings) + 1
+
+
+def test_recommendations_during_feedback(artifact_root, monkeypatch):
+    import threading
+    import recommend
+
+    bundle = load_artifacts(artifact_root)
+    user_id = int(bundle.user_encoder.classes_[0])
+    new_user = int(bundle.user_encoder.classes_.max()) + 1
+    movie_ids = bundle.movie_encoder.classes_[:20].astype(int).tolist()
+    for name, value in [('_bundle', bundle), ('_recommender', None), ('_updater', None), ('_topn', False),
+                        ('_live_users', set())]:
+        monkeypatch.setattr(recommend, name, value)
+
+    errors, done = [], threading.Event()
+
+    def read():
+        while not done.is_set():
+            try:
+                assert len(recommend.get_recommendations(user_id, n=5)) == 5
+            except Exception as e:
+                errors.append(e)
+                return
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for movie_id in movie_ids[:5]:
+            recommend.apply_feedback([user_id, new_user], [movie_id, movie_id], [5.0, 4.0])
+    finally:
+        done.set()
+        reader.join()
+    assert errors == []
+    assert recommend.get_model_bundle() is recommend._updater.bundle
+    assert recommend._live_users == {user_id, new_user}
+    assert len(recommend.get_recommendations(new_user, n=5)) == 5
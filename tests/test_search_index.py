@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from search_index import TitleIndex, fuzzy_match_score
+
+TITLES = ['Star Wars', 'star wars', 'Star Trek', 'Starship Troopers', 'The Matrix', 'The Matrix Reloaded',
+          'Return of the Jedi', 'Lost in Translation', 'Amélie', 'Se7en', '12 Angry Men', 'The Godfather',
+          'The Godfather: Part II', 'Godzilla', 'Toy Story', 'Toy Story 2', 'Wars of the Roses', 'Matrimony']
+
+
+@pytest.fixture(scope='module')
+def titles():
+    from synthetic import generate_movies
+
+    movies, _ = generate_movies(np.random.default_rng(7), 1500)
+    return TITLES + movies['title'].dropna().tolist() + TITLES[:3]
+
+
+def brute_force(titles, query, limit=10, min_score=0.3):
+    """Full scan with fuzzy_match_score, as /api/autocomplete used to rank."""
+    scored = [(fuzzy_match_score(query, t), p) for p, t in enumerate(titles)]
+    scored = [(s, p) for s, p in scored if s > min_score]
+    return sorted(scored, key=lambda h: (-h[0], h[1]))[:limit]
+
+
+@pytest.mark.parametrize('query', [
+    'star wars',      # exact, with case and duplicate variants
+    'Star',           # prefix
+    'matrix',         # prefix and substring
+    'godfather',      # substring
+    'wars',           # prefix and substring
+    'str wrs',        # fuzzy
+    'teh matirx',     # fuzzy
+    'amelie',         # fuzzy over a non-ASCII title
+    'qqqqzzzz',       # no match
+    'x',              # single character
+])
+def test_search_matches_full_scan(titles, query):
+    index = TitleIndex(titles)
+    expected = brute_force(titles, query)
+    found = index.search(query, limit=10, min_score=0.3)
+    assert [p for _, p in found] == [p for _, p in expected]
+    assert [s for s, _ in found] == pytest.approx([s for s, _ in expected])
+
+
+def test_search_matches_full_scan_on_generated_queries(titles):
+    index = TitleIndex(titles)
+    rng = np.random.default_rng(3)
+    for title in rng.choice(titles, 25):
+        # Drop a character to get a near miss
+        i = rng.integers(len(title))
+        query = title[:i] + title[i + 1:]
+        if len(query) < 2:
+            continue
+        expected = brute_force(titles, query)
+        assert [p for _, p in index.search(query)] == [p for _, p in expected], query
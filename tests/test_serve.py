@@ -0,0 +1,67 @@
+import time
+import asyncio
+import threading
+
+from flask import Flask, jsonify, request
+
+from serve import ThreadPoolASGI
+
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(0.3)
+        return threading.current_thread().name
+
+    @app.route('/echo/<name>', methods=['POST'])
+    def echo(name):
+        return jsonify({'name': name, 'n': request.args.get('n', type=int), 'json': request.get_json(),
+                        'agent': request.headers.get('User-Agent')}), 201
+
+    return app
+
+
+async def call(app, method='GET', path='/', query=b'', headers=(), body=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'root_path': '',
+             'headers': list(headers), 'server': ('testserver', 80), 'http_version': '1.1', 'scheme': 'http'}
+    messages = [{'type': 'http.request', 'body': body[:3], 'more_body': True},
+                {'type': 'http.request', 'body': body[3:]}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def test_requests_run_concurrently_on_the_pool():
+    app = ThreadPoolASGI(make_app(), threads=4)
+
+    async def run():
+        start = time.perf_counter()
+        results = await asyncio.gather(*[call(app, path='/slow') for _ in range(4)])
+        return time.perf_counter() - start, results
+
+    elapsed, results = asyncio.run(run())
+    assert elapsed < 0.9
+    assert {status for status, _, _ in results} == {200}
+    assert len({body for _, _, body in results}) == 4
+
+
+def test_request_and_response_are_translated():
+    app = ThreadPoolASGI(make_app())
+    status, headers, body = asyncio.run(call(
+        app, 'POST', '/echo/abc', b'n=7',
+        headers=[(b'content-type', b'application/json'), (b'user-agent', b'pytest')], body=b'{"a": 1}'))
+    assert status == 201
+    assert headers[b'content-type'] == b'application/json'
+    assert body == b'{"agent":"pytest","json":{"a":1},"n":7,"name":"abc"}\n'
+
+    status, _, _ = asyncio.run(call(app, path='/missing'))
+    assert status == 404